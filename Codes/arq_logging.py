@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+
+# Verbosity levels: each includes the ones above it
+LOG_TRANSFERS = 0  # connections, transfer start/end, saved files
+LOG_ERRORS = 1     # per-chunk problems: NACKs, timeouts, duplicates, retries
+LOG_CHUNKS = 2     # every chunk sent, acknowledged or received
+VERBOSITY = {'transfers': LOG_TRANSFERS, 'errors': LOG_ERRORS, 'chunks': LOG_CHUNKS}
+
+BATCH_SIZE = 1024     # lines written per wake-up of the logging thread
+FLUSH_INTERVAL = 0.5  # seconds; files are flushed whenever the queue has been idle this long
+
+EVENT, CRC, METRICS, FLUSH, STOP = range(5)
+
+
+class BackgroundLogger:
+    """Writes timestamped lines to the event, CRC and metrics logs from a background thread.
+
+    Callers only put (stream, time, text) tuples on a queue; the thread formats the timestamps,
+    joins whole batches into one write per file and flushes when the queue goes idle, on flush()
+    and on close(). Opening the logger truncates the files, as the front-ends always did.
+
+    verbosity drops event lines above the given level, and crc_every keeps one CRC line in every
+    crc_every (0 turns the CRC log off). at() and crc_enabled() let callers skip formatting lines
+    that would be dropped anyway.
+    """
+
+    def __init__(self, log_file, crc_log_file, metrics_log_file, verbosity=LOG_CHUNKS, crc_every=1,
+                 flush_interval=FLUSH_INTERVAL):
+        self.files = {
+            EVENT: open(log_file, 'w', encoding='utf-8'),
+            CRC: open(crc_log_file, 'w', encoding='utf-8'),
+            METRICS: open(metrics_log_file, 'w', encoding='utf-8'),
+        }
+        self.verbosity = verbosity
+        self.crc_every = crc_every
+        self.crc_count = 0
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.last_second = None
+        self.last_stamp = ''
+        self.thread = threading.Thread(target=self.run, name='arq-logger', daemon=True)
+        self.thread.start()
+
+    def enabled(self, level):
+        return level <= self.verbosity
+
+    def at(self, level):
+        """A log(msg) callable for one verbosity level, or None when that level is off."""
+        if not self.enabled(level):
+            return None
+        return lambda msg: self.queue.put((EVENT, time.time(), msg))
+
+    def log(self, msg, level=LOG_TRANSFERS):
+        if level <= self.verbosity:
+            self.queue.put((EVENT, time.time(), msg))
+
+    def crc_enabled(self):
+        return self.crc_every > 0
+
+    def sample_crc(self):
+        """True if the next CRC line should be kept."""
+        if not self.crc_every:
+            return False
+        self.crc_count += 1
+        return (self.crc_count - 1) % self.crc_every == 0
+
+    def crc(self, line):
+        self.queue.put((CRC, time.time(), line))
+
+    def metrics(self, lines):
+        now = time.time()
+        for line in lines:
+            self.queue.put((METRICS, now, line))
+
+    def flush(self, wait=True):
+        """Write out everything queued so far, e.g. at the end of a transfer.
+
+        With wait=False the flush is only requested, which keeps an event loop from blocking;
+        it still happens before any line queued later.
+        """
+        done = threading.Event()
+        self.queue.put((FLUSH, None, done))
+        if wait:
+            done.wait()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put((STOP, None, None))
+            self.thread.join()
+
+    def timestamp(self, when):
+        second = int(when)
+        if second != self.last_second:
+            self.last_second = second
+            self.last_stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))
+        return self.last_stamp
+
+    def run(self):
+        pending = {stream: [] for stream in self.files}
+        while True:
+            try:
+                items = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                for f in self.files.values():
+                    f.flush()
+                items = [self.queue.get()]
+            try:
+                while len(items) < BATCH_SIZE:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = False
+            for stream, when, text in items:
+                if stream == FLUSH or stream == STOP:
+                    self.write(pending)
+                    for f in self.files.values():
+                        f.flush()
+                    if stream == FLUSH:
+                        text.set()
+                    else:
+                        stop = True
+                    continue
+                pending[stream].append(f'{self.timestamp(when)} | {text}\n')
+            self.write(pending)
+            if stop:
+                for f in self.files.values():
+                    f.close()
+                return
+
+    def write(self, pending):
+        for stream, lines in pending.items():
+            if lines:
+                self.files[stream].write(''.join(lines))
+                lines.clear()
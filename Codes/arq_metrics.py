@@ -0,0 +1,193 @@
+import math
+import threading
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def snr_value(total_bits, error_bits):
+    """SNR in dB as a float: inf without errors, 0.0 when every bit was in error."""
+    if error_bits == 0:
+        return math.inf
+    correct_bits = total_bits - error_bits
+    snr = correct_bits / error_bits
+    return 10 * math.log10(snr) if snr > 0 else 0.0
+
+
+def snr_db(total_bits, error_bits):
+    snr = snr_value(total_bits, error_bits)
+    return 'Infinity' if math.isinf(snr) else f"{snr:.2f}"
+
+
+SUB_BUCKET_BITS = 8  # significant bits kept per recorded value: buckets are at most 1/128 (0.8%) wide
+PERCENTILES = (50, 95, 99)
+
+# One exported metric: kind is 'counter', 'gauge' or 'summary' (value is then a Histogram)
+Sample = namedtuple('Sample', 'kind name help value')
+
+
+class Histogram:
+    """Streaming log-linear histogram in the style of HdrHistogram.
+
+    Values are counted as integers of unit (1e-6 records seconds to the microsecond) in buckets
+    that keep their top SUB_BUCKET_BITS bits, so memory stays at most 128 counters per power of two
+    however many values are recorded, and any percentile is within 1% of the true value.
+    """
+
+    def __init__(self, unit=1.0):
+        self.unit = unit
+        self.counts = {}  # bucket lower bound (in units) -> count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value, count=1):
+        scaled = max(int(value / self.unit), 0)
+        shift = max(scaled.bit_length() - SUB_BUCKET_BITS, 0)
+        key = scaled >> shift << shift
+        self.counts[key] = self.counts.get(key, 0) + count
+        self.count += count
+        self.total += value * count
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """The value at or below which q percent of the recorded values lie (the bucket's highest value)."""
+        counts = self.counts.copy()  # the metrics endpoint reads from another thread
+        if not counts:
+            return 0.0
+        target = max(1, math.ceil(q / 100 * sum(counts.values())))
+        seen = 0
+        for key in sorted(counts):
+            seen += counts[key]
+            if seen >= target:
+                width = 1 << max(key.bit_length() - SUB_BUCKET_BITS, 0)
+                return min((key + width - 1) * self.unit, self.max)
+        return self.max
+
+    def merge(self, other):
+        for key, count in other.counts.copy().items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def copy(self):
+        return Histogram(self.unit).merge(self)
+
+    def summary(self, label, fmt='{:.4f}', suffix=' s'):
+        """One metrics log line with the percentiles and the maximum."""
+        if not self.count:
+            return f"{label}: no samples"
+        values = ', '.join(f"p{q} {fmt.format(self.percentile(q))}{suffix}" for q in PERCENTILES)
+        return f"{label}: {values}, max {fmt.format(self.max)}{suffix} ({self.count} samples)"
+
+
+def prometheus_text(samples):
+    """Samples in the Prometheus text exposition format; histograms are written as summaries."""
+    lines = []
+    for sample in samples:
+        lines.append(f'# HELP {sample.name} {sample.help}')
+        lines.append(f'# TYPE {sample.name} {sample.kind}')
+        if sample.kind == 'summary':
+            for q in PERCENTILES:
+                lines.append(f'{sample.name}{{quantile="{q / 100:g}"}} {sample.value.percentile(q):g}')
+            lines.append(f'{sample.name}_sum {sample.value.total:g}')
+            lines.append(f'{sample.name}_count {sample.value.count}')
+        else:
+            lines.append(f'{sample.name} {sample.value:g}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRegistry:
+    """Live metrics of a client or server process, for a MetricsEndpoint.
+
+    Sources (ArqSender, ArqReceiver) are tracked while they run and folded into the totals when a
+    transfer ends, so counters only ever grow. extra is a callable returning more samples, e.g.
+    the number of open sessions. Sources report from their own threads; collect() is called from
+    the endpoint's.
+    """
+
+    def __init__(self, extra=None):
+        self.extra = extra
+        self.lock = threading.Lock()
+        self.finished = {}  # metric name -> Sample, summed over finished transfers
+        self.live = set()
+
+    def track(self, source):
+        with self.lock:
+            self.live.add(source)
+
+    def fold(self, source):
+        """Add a source's current numbers to the totals (just before it resets them)."""
+        samples = source.samples()
+        with self.lock:
+            self.add(self.finished, samples)
+
+    def finish(self, source):
+        self.fold(source)
+        with self.lock:
+            self.live.discard(source)
+
+    @staticmethod
+    def add(totals, samples):
+        for sample in samples:
+            current = totals.get(sample.name)
+            if current is None or sample.kind == 'gauge':
+                value = sample.value.copy() if sample.kind == 'summary' else sample.value
+                totals[sample.name] = sample._replace(value=value)
+            elif sample.kind == 'summary':
+                current.value.merge(sample.value)
+            else:
+                totals[sample.name] = current._replace(value=current.value + sample.value)
+
+    def collect(self):
+        with self.lock:
+            totals = {name: sample._replace(value=sample.value.copy()) if sample.kind == 'summary' else sample
+                      for name, sample in self.finished.items()}
+            live = list(self.live)
+        for source in live:
+            self.add(totals, source.samples())
+        samples = list(totals.values())
+        if self.extra:
+            samples += self.extra()
+        return samples
+
+
+class MetricsEndpoint:
+    """Serves a MetricsRegistry at http://host:port/metrics in the Prometheus text format, from a daemon thread."""
+
+    def __init__(self, registry, host='127.0.0.1', port=0):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = prometheus_text(registry.collect()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes are not transfer events
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
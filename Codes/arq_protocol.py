@@ -0,0 +1,226 @@
+import struct
+from collections import namedtuple
+from crc_utils import crc32
+
+# Frame layout: type | flags | sequence number | byte offset | payload length | payload | CRC32(payload)
+FRAME_HEADER = struct.Struct('!BBIQI')
+CRC_SIZE = 4
+
+FRAME_DATA = 1
+FRAME_ACK = 2    # binary acknowledgement, see pack_ack()
+FRAME_META = 3   # payload is the file extension of the transfer that follows
+FRAME_EOT = 4    # also echoed back by the receiver once the transfer is finished
+FRAME_END = 5
+FRAME_ABORT = 6  # also echoed back, like FRAME_EOT
+FRAME_CHUNK_SIZE = 7  # payload is the new chunk size (4 bytes), seq is the first chunk that uses it
+FRAME_RESUME = 8  # client: file id, size and chunk size of a file; server: the chunks it already has (see resume.py)
+FRAME_STRIPE = 9  # this connection carries one stripe of a file sent over several (see striping.py)
+FRAME_COMPRESS = 10  # client: the codec it wants to use; server: the same codec if it accepts it, else empty
+FRAME_DEDUP = 11  # client: a hash per chunk of a file; server: a bitmap of the chunks it had stored (see chunk_store.py)
+
+FRAME_TYPES = range(FRAME_DATA, FRAME_DEDUP + 1)
+
+FRAME_BUFFER_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 64 * 1024  # largest chunk a DATA frame may carry, and chunk size a transfer may announce
+# Largest payload of any frame: a chunk with its FEC check bits (2 bytes per 256), with room to
+# spare. Longer control payloads (resume entries, deduplication offers) go out in batches.
+MAX_PAYLOAD = MAX_CHUNK_SIZE + 4096
+
+# Flags on FRAME_ACK, about the chunk that triggered it: the receiver already had it (like a TCP
+# D-SACK, so the sender can spot spurious resends), or it failed its CRC check.
+RESPONSE_DUPLICATE = 0x01
+RESPONSE_NACK = 0x02
+
+# Flags on FRAME_DATA: the payload is the chunk followed by fec.encode() check bits; the CRC covers the chunk only.
+DATA_FEC = 0x02
+# The chunk is compressed with the codec agreed by FRAME_COMPRESS; the CRC (and FEC) cover the compressed bytes.
+DATA_COMPRESSED = 0x04
+# Datagram (UDP) connections number their transfers modulo 16 in these flag bits, on every frame
+# but END and on the answers to them, so repeats and late duplicates of an earlier transfer are
+# told apart from the current one (see transfer_delta). Over TCP they stay 0.
+TRANSFER_BITS = 0xF0
+TRANSFER_STEP = 0x10
+
+Frame = namedtuple('Frame', 'type flags seq offset payload crc')
+Ack = namedtuple('Ack', 'cumulative trigger flags bitmap')
+
+
+class ProtocolError(ConnectionError):
+    """The peer sent something no correct peer sends, e.g. a frame header with an unknown type or an impossible length."""
+
+
+def frame_size(payload_length):
+    return FRAME_HEADER.size + payload_length + CRC_SIZE
+
+
+def check_header(frame_type, length):
+    if frame_type not in FRAME_TYPES:
+        raise ProtocolError(f'Unknown frame type {frame_type}')
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f'Frame payload of {length} bytes exceeds the {MAX_PAYLOAD}-byte limit')
+
+
+def payload_text(payload):
+    """The text of a META or COMPRESS payload; ProtocolError if it is not UTF-8."""
+    try:
+        return bytes(payload).decode()
+    except UnicodeDecodeError:
+        raise ProtocolError('Frame payload is not valid UTF-8') from None
+
+
+def transfer_delta(flags, current):
+    """How many transfers a frame's number (in flags) is ahead of current's: 0 the same, < 0 an earlier one."""
+    delta = ((flags & TRANSFER_BITS) - (current & TRANSFER_BITS)) // TRANSFER_STEP % 16
+    return delta - 16 if delta >= 8 else delta
+
+
+def pack_frame(frame_type, payload=b'', seq=0, offset=0, flags=0, crc=None):
+    if crc is None:
+        crc = crc32(payload)
+    return FRAME_HEADER.pack(frame_type, flags, seq, offset, len(payload)) + payload + crc.to_bytes(CRC_SIZE, 'big')
+
+
+def send_frame(sock, frame_type, payload=b'', seq=0, offset=0, flags=0, crc=None):
+    """Send a frame as header, payload and CRC without concatenating them.
+
+    Uses scatter-gather sendmsg() where the platform has it, so a memoryview payload (e.g. a slice of
+    an mmap) goes to the kernel without an intermediate copy.
+    """
+    if crc is None:
+        crc = crc32(payload)
+    header = FRAME_HEADER.pack(frame_type, flags, seq, offset, len(payload))
+    trailer = crc.to_bytes(CRC_SIZE, 'big')
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(header + bytes(payload) + trailer)
+        return
+    parts = [memoryview(header), memoryview(payload), memoryview(trailer)]
+    while parts:
+        sent = sock.sendmsg(parts)
+        while parts and sent >= len(parts[0]):
+            sent -= len(parts[0])
+            parts.pop(0)
+        if sent:
+            parts[0] = parts[0][sent:]
+
+
+class FrameReader:
+    """Parses frames out of a byte stream received with recv_into() into one preallocated buffer.
+
+    Payloads are returned as memoryview slices of that buffer, so they stay valid only until the
+    next frame is read; copy them (bytes(frame.payload)) if they need to be kept. A header with an
+    unknown type or a payload over MAX_PAYLOAD raises ProtocolError before the buffer grows for
+    it, since the stream cannot be trusted past it. The reader can
+    pull from a blocking socket (read_frame) or be filled by an asyncio BufferedProtocol
+    (get_buffer / buffer_updated / next_frame).
+    """
+
+    def __init__(self, sock=None, capacity=FRAME_BUFFER_SIZE):
+        self.sock = sock
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.needed = FRAME_HEADER.size  # size of the frame currently being assembled
+
+    def next_frame(self):
+        """Return the next complete Frame in the buffer, or None if more bytes are needed."""
+        available = self.end - self.start
+        if available < FRAME_HEADER.size:
+            self.needed = FRAME_HEADER.size
+            return None
+        frame_type, flags, seq, offset, length = FRAME_HEADER.unpack_from(self.buf, self.start)
+        check_header(frame_type, length)
+        frame_size = FRAME_HEADER.size + length + CRC_SIZE
+        if available < frame_size:
+            self.needed = frame_size
+            return None
+        payload_start = self.start + FRAME_HEADER.size
+        payload = self.view[payload_start:payload_start + length]
+        crc = int.from_bytes(self.view[payload_start + length:payload_start + length + CRC_SIZE], 'big')
+        self.start += frame_size
+        return Frame(frame_type, flags, seq, offset, payload, crc)
+
+    def make_room(self, needed):
+        # Move the unparsed tail to the front (only a partial frame, never a whole transfer)
+        # and grow the buffer if a single frame is larger than it.
+        pending = self.end - self.start
+        if needed > len(self.buf):
+            new_buf = bytearray(max(needed, 2 * len(self.buf)))
+            new_buf[:pending] = self.view[self.start:self.end]
+            self.buf = new_buf
+            self.view = memoryview(self.buf)
+        elif self.start:
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def get_buffer(self, sizehint=-1):
+        """Free space to receive into; always large enough to complete the pending frame."""
+        if self.start + self.needed > len(self.buf) or self.end == len(self.buf):
+            self.make_room(self.needed)
+        return self.view[self.end:]
+
+    def reserve(self, nbytes):
+        """Grow the buffer ahead of time, e.g. when the sender announces a larger chunk size."""
+        if nbytes > len(self.buf):
+            self.make_room(nbytes)
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+
+    def feed(self, data):
+        """Append bytes that arrived some other way, e.g. a datagram or a simulated link."""
+        if len(self.buf) - self.end < len(data):
+            self.make_room(self.end - self.start + len(data))
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def read_frame(self):
+        """Return the next Frame from the socket, or None when the peer closed the connection."""
+        while True:
+            frame = self.next_frame()
+            if frame is not None:
+                return frame
+            n = self.sock.recv_into(self.get_buffer())
+            if not n:
+                return None
+            self.end += n
+
+
+def pack_ack(cumulative, trigger, flags=0, received=()):
+    """An acknowledgement: every chunk below cumulative has arrived, and so have the chunks in received.
+
+    The header's seq is the cumulative ACK and its offset the chunk that triggered the response
+    (the newest one covered, or the one flagged). The payload is a bitmap of received, bit i
+    (little-endian) standing for chunk cumulative + 1 + i, so its holes are the missing chunks.
+    """
+    bitmap = 0
+    for seq in received:
+        bitmap |= 1 << (seq - cumulative - 1)
+    return pack_frame(FRAME_ACK, bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little'), seq=cumulative, offset=trigger,
+                      flags=flags)
+
+
+def parse_ack(frame):
+    return Ack(frame.seq, frame.offset, frame.flags, int.from_bytes(frame.payload, 'little'))
+
+
+def selectively_acked(ack):
+    """The chunks beyond ack.cumulative that ack reports as received."""
+    bitmap = ack.bitmap
+    while bitmap:
+        low = bitmap & -bitmap
+        yield ack.cumulative + low.bit_length()
+        bitmap ^= low
+
+
+def describe_ack(ack):
+    """A short log form, e.g. 'ACK 12', 'NACK 7 (ACK 5, SACK 6 8)'."""
+    text = f'ACK {ack.cumulative}'
+    if ack.bitmap:
+        text += ', SACK ' + ' '.join(str(seq) for seq in selectively_acked(ack))
+    if ack.flags & RESPONSE_NACK:
+        return f'NACK {ack.trigger} ({text})'
+    if ack.flags & RESPONSE_DUPLICATE:
+        return f'Duplicate {ack.trigger} ({text})'
+    return text
@@ -0,0 +1,534 @@
+import os
+import time
+import uuid
+import fec
+from crc_utils import crc32
+from arq_metrics import Histogram, Sample, snr_db, snr_value
+from resume import Manifest
+from stage_timing import StageTimes, now
+from compression import ChunkDecompressor, available_codecs
+from arq_protocol import DATA_COMPRESSED, DATA_FEC, MAX_CHUNK_SIZE, RESPONSE_DUPLICATE, RESPONSE_NACK, ProtocolError, pack_ack
+
+REORDER_BUFFER_SIZE = 64  # chunks held beyond a gap before further ones are dropped
+ACK_EVERY = 8  # in-order chunks one coalesced ACK may cover before it is sent regardless
+
+
+# Helper to guess file type from first chunk (very basic)
+def guess_file_extension(chunk):
+    if chunk.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if chunk.startswith(b'\x89PNG'):
+        return '.png'
+    if chunk.startswith(b'GIF8'):
+        return '.gif'
+    if chunk.startswith(b'BM'):
+        return '.bmp'
+    if chunk[4:8] == b'ftyp':
+        return '.mp4'
+    if chunk[:4] == b'RIFF' and chunk[8:12] == b'WAVE':
+        return '.wav'
+    if chunk[:4] == b'ID3' or chunk[-128:-125] == b'TAG':
+        return '.mp3'
+    return '.bin'
+
+
+class FileSink:
+    """Writes validated chunks at their byte offset into a temp file next to the final output.
+
+    temp_path names the file for a resumable transfer, and reopens it if an earlier attempt left it.
+    """
+
+    def __init__(self, output_dir, temp_path=None):
+        os.makedirs(output_dir, exist_ok=True)
+        self.temp_path = temp_path or os.path.join(output_dir, f'.incoming_{uuid.uuid4().hex}.part')
+        self.file = open(self.temp_path, 'r+b' if temp_path and os.path.exists(temp_path) else 'xb')
+        self.position = None if temp_path else 0
+
+    def write_at(self, offset, chunk):
+        if offset != self.position:
+            self.file.seek(offset)
+        self.file.write(chunk)
+        self.position = offset + len(chunk)
+
+    def flush(self):
+        self.file.flush()
+
+    def sync(self):
+        """Flush, then have the OS write the file to disk, so a crash cannot lose what is written so far."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def after_writes(self, callback, *args):
+        """Call callback(*args) once every chunk written so far is synced to disk."""
+        self.sync()
+        callback(*args)
+
+    def backlogged(self):
+        """True if the caller should stop receiving until when_drained() calls back; a FileSink writes at once."""
+        return False
+
+    def when_drained(self, callback):
+        callback()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def commit(self, path):
+        self.close()
+        os.replace(self.temp_path, path)  # atomic on the same filesystem
+        return path
+
+    def read_and_remove(self):
+        self.close()
+        with open(self.temp_path, 'rb') as f:
+            data = f.read()
+        os.remove(self.temp_path)
+        return data
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+class ArqReceiver:
+    """Receiver for Go-Back-N and Selective Repeat senders.
+
+    Every response is one binary ACK frame (see arq_protocol.pack_ack) with the cumulative ACK and
+    a bitmap of the chunks held beyond a gap, flagged as a NACK when the chunk failed its CRC, so a
+    Selective Repeat sender only resends what is missing. Chunks sent with FEC check bits are
+    repaired first when their CRC fails, and only NACKed if the repair does not restore the CRC.
+
+    NACKs, duplicates and anything that opens or fills a gap are answered at once. ACKs for
+    in-order chunks are coalesced: handle_chunk() returns None and the front-end sends
+    take_ack() once it has handled everything it has received (or after a short delay), or
+    at the latest every ack_every chunks.
+
+    Every valid chunk is written straight into place in a temp file under output_dir, so memory use
+    does not grow with the file; the reorder buffer only tracks which chunks beyond a gap are on disk.
+
+    Compressed chunks (after accept_compression()) are decompressed once their CRC has been
+    checked, and are NACKed if they do not decode to at most the largest chunk size announced for
+    the transfer (by note_chunk_size(), resume() or dedup(); MAX_CHUNK_SIZE until one is). Where
+    announcements can be lost (UDP), trust_chunk_sizes=False keeps MAX_CHUNK_SIZE as the bound.
+
+    With a chunk_store (see chunk_store.py), every stored chunk is also put in it, and dedup()
+    rebuilds the chunks of a file it already holds without them being sent again.
+
+    Copies received per delivered chunk and how long in-order chunks wait for their coalesced ACK
+    are kept in histograms. With a registry (arq_metrics.MetricsRegistry), samples() are served
+    live, and each transfer's numbers are added to its totals when the receiver is reset.
+
+    With timing, each transfer adds up the time spent per stage (FEC, CRC, decompress, write,
+    chunk store, manifest, log) in a stage_timing.StageTimes; the server session adds frame
+    parsing and sending ACKs.
+
+    After resume(), the temp file is named after the file id and every stored chunk is recorded in
+    a resume.Manifest, so an aborted or dropped transfer can be picked up again where it stopped.
+    """
+
+    def __init__(self, output_dir, log_event=print, log_crc=None, reorder_buffer_size=REORDER_BUFFER_SIZE, log_chunk=None,
+                 clock=time.time, sink_factory=FileSink, ack_every=ACK_EVERY, chunk_store=None, registry=None,
+                 timing=False, trust_chunk_sizes=True):
+        self.output_dir = output_dir
+        self.clock = clock
+        self.sink_factory = sink_factory  # called with output_dir; anything with FileSink's methods
+        self.log_event = log_event
+        self.log_chunk = log_chunk  # routine per-chunk lines (valid chunks); None skips them
+        self.log_crc = log_crc
+        self.reorder_buffer_size = reorder_buffer_size
+        self.ack_every = max(1, ack_every)
+        self.chunk_store = chunk_store
+        self.registry = registry
+        self.timing = timing
+        self.trust_chunk_sizes = trust_chunk_sizes
+        self.sink = None
+        self.manifest = None
+        self.total_chunks_received = 0
+        self.reset()
+        if registry is not None:
+            registry.track(self)
+
+    def reset(self):
+        if self.registry is not None and self.total_chunks_received:
+            self.registry.fold(self)
+        if self.manifest is not None:
+            self.keep_partial()
+        elif self.sink is not None:
+            self.sink.discard()
+        self.sink = None
+        self.manifest = None
+        self.resumed_bytes = 0
+        self.decompressor = None
+        self.dedup_offered = 0  # chunks whose hashes the sender offered
+        self.dedup_chunks = 0  # of those, rebuilt from the chunk store
+        self.dedup_bytes = 0
+        self.expected_seq = 0
+        self.reorder_buffer = {}  # seq -> length of chunks written beyond the gap
+        self.ack_owed = 0  # in-order chunks not acknowledged yet
+        self.ack_trigger = 0  # the newest of them
+        self.ack_owed_since = None  # arrival of the oldest of them
+        self.arrivals = {}  # seq -> copies received, for chunks not delivered yet
+        self.copies_histogram = Histogram()
+        self.ack_wait_histogram = Histogram(1e-6)
+        self.stages = StageTimes() if self.timing else None
+        self.responses_sent = 0
+        self.is_binary = None
+        self.file_ext = None
+        self.total_chunks_received = 0
+        self.unique_chunks_received = 0
+        self.total_bytes_received = 0
+        # SNR counters
+        self.total_bits_received = 0
+        self.error_bits = 0
+        # FEC counters
+        self.fec_chunks = 0
+        self.chunks_corrected = 0
+        self.bits_corrected = 0
+        self.start_time = None
+        self.end_time = None
+        self.chunk_sizes = []  # (first chunk, size) announced by an adaptive sender
+        self.chunk_limit = None  # largest chunk size announced, if any: no compressed chunk may decompress to more
+        self.file_size = None  # size of the file, when the transfer announced it: every chunk must lie within it
+
+    def resume(self, fid, size, chunk_size):
+        """Receive the file with id fid into its resumable temp file; returns the (offset, length, CRC) of the chunks it holds."""
+        self.manifest = Manifest(self.output_dir, fid, size, chunk_size, self.file_ext)
+        self.file_size = size
+        self.bound_chunks(chunk_size)
+        held = self.manifest.open()
+        self.sink = self.sink_factory(self.output_dir, self.manifest.data_path)
+        self.is_binary = True
+        self.file_ext = self.file_ext or self.manifest.file_ext
+        # Bytes covered by the kept chunks; chunks may overlap if the chunk size changed between attempts
+        position = 0
+        for offset, length, _ in held:
+            if offset + length > position:
+                self.resumed_bytes += offset + length - max(offset, position)
+                position = offset + length
+        if held:
+            self.log_event(f'Resuming file {fid.hex()}: {len(held)} chunks ({self.resumed_bytes} bytes) kept from an earlier attempt')
+        return held
+
+    def accept_compression(self, codec):
+        """Decompress this transfer's compressed chunks with codec; returns False if it is not available here."""
+        if codec not in available_codecs():
+            self.log_event(f'Compression {codec} requested but not available')
+            return False
+        self.decompressor = ChunkDecompressor(codec)
+        return True
+
+    def dedup(self, size, chunk_size, first, hashes):
+        """Write every offered chunk that the chunk store holds; returns a held flag per chunk.
+
+        hashes are those of chunks first, first + 1... of the file; a large file is offered in
+        several batches.
+        """
+        self.dedup_offered += len(hashes)
+        self.file_size = size
+        self.bound_chunks(chunk_size)
+        held = [False] * len(hashes)
+        if self.chunk_store is None:
+            return held
+        self.is_binary = True
+        for index, key in enumerate(hashes):
+            offset = (first + index) * chunk_size
+            data = self.chunk_store.get(key)
+            if data is None or len(data) != min(chunk_size, size - offset):
+                continue
+            if self.start_time is None:
+                self.start_time = self.clock()
+            if self.sink is None:
+                self.sink = self.sink_factory(self.output_dir)
+            self.sink.write_at(offset, data)
+            held[index] = True
+            self.dedup_chunks += 1
+            self.dedup_bytes += len(data)
+        self.log_event(f'Deduplication: {self.dedup_chunks} of {self.dedup_offered} chunks rebuilt from the chunk store')
+        return held
+
+    def receive_into(self, sink, size):
+        """Write this transfer's chunks into sink, a size-byte file other receivers share (see server_engine.StripedFile)."""
+        self.sink = sink
+        self.file_size = size
+        self.is_binary = True
+
+    def detach(self):
+        """End a transfer written into a shared sink, leaving the sink to its owner."""
+        self.end_time = self.clock()
+        self.sink = None
+
+    def note_chunk_size(self, seq, size):
+        self.chunk_sizes.append((seq, size))
+        if self.trust_chunk_sizes:
+            self.bound_chunks(size)
+        self.log_event(f'Chunk size now {size} bytes from chunk {seq}')
+
+    def bound_chunks(self, size):
+        # Chunks sent before a smaller size was announced keep their size, so the largest one counts
+        self.chunk_limit = min(max(self.chunk_limit or 0, size), MAX_CHUNK_SIZE)
+
+    def handle_chunk(self, seq, offset, chunk, recv_crc, flags=0, calc_crc=None):
+        """Check one chunk and return the response frame to send back.
+
+        chunk may be a memoryview into the frame reader's buffer; it is written out, never kept.
+        flags are the DATA frame's flags. calc_crc is the chunk's CRC if it has been computed
+        already (see receive_pipeline.ChunkVerifier). A valid chunk that does not fit in a file
+        whose size the transfer announced (resume, deduplication, a stripe) raises ProtocolError.
+        """
+        stages = self.stages
+        parity = None
+        if flags & DATA_FEC:
+            chunk, parity = fec.split(chunk)
+            self.fec_chunks += 1
+        if calc_crc is None:
+            if stages is not None:
+                start = now()
+            calc_crc = crc32(chunk)
+            if stages is not None:
+                stages.add('crc', start)
+        self.total_chunks_received += 1
+        if seq >= self.expected_seq:
+            self.arrivals[seq] = self.arrivals.get(seq, 0) + 1
+        self.total_bits_received += len(chunk) * 8
+        match = (recv_crc == calc_crc)
+        if self.log_crc:
+            if stages is not None:
+                start = now()
+            self.log_crc(seq, recv_crc, calc_crc, match)
+            if stages is not None:
+                stages.add('log', start)
+        if not match and parity is not None:
+            # The CRC is checked first since most chunks arrive intact; the repair is verified by it too
+            if stages is not None:
+                start = now()
+            repaired, corrected = fec.repair(chunk, parity)
+            repaired_ok = corrected and crc32(repaired) == recv_crc
+            if stages is not None:
+                stages.add('fec', start)
+            if repaired_ok:
+                chunk = repaired
+                match = True
+                self.chunks_corrected += 1
+                self.bits_corrected += corrected
+                self.error_bits += corrected
+                self.log_event(f'Chunk {seq}: {corrected} bit error(s) corrected by FEC')
+        if not match:
+            self.error_bits += len(chunk) * 8
+            self.log_event(f'Chunk {seq}: CRC32 error (NACK)')
+            return self.ack(seq, RESPONSE_NACK)
+        if seq < self.expected_seq or seq in self.reorder_buffer:
+            self.log_event(f'Chunk {seq}: Duplicate (already received)')
+            return self.ack(seq, RESPONSE_DUPLICATE)
+        if flags & DATA_COMPRESSED:
+            if stages is not None:
+                start = now()
+            limit = self.chunk_limit or MAX_CHUNK_SIZE
+            chunk = self.decompressor.decompress(chunk, limit) if self.decompressor else None
+            if stages is not None:
+                stages.add('decompress', start)
+            if chunk is None:
+                self.log_event(f'Chunk {seq}: Does not decompress to at most {limit} bytes (NACK)')
+                return self.ack(seq, RESPONSE_NACK)
+            if self.manifest is not None:
+                recv_crc = crc32(chunk)  # the manifest lists CRCs of the file's own bytes
+        if self.file_size is not None and (offset >= self.file_size or offset + len(chunk) > self.file_size):
+            raise ProtocolError(f'Chunk {seq} at offset {offset} ({len(chunk)} bytes) lies outside the {self.file_size}-byte file')
+        if seq > self.expected_seq:
+            if seq - self.expected_seq > self.reorder_buffer_size:
+                self.log_event(f'Chunk {seq}: Beyond reorder buffer, expected {self.expected_seq} (discarded)')
+                return self.ack(seq)
+            self.store(offset, chunk, recv_crc)
+            self.reorder_buffer[seq] = len(chunk)
+            if self.log_chunk:
+                self.log_chunk_timed(f'Chunk {seq}: CRC32 valid, stored out of order (SACK)')
+            return self.ack(seq)
+        self.store(offset, chunk, recv_crc)
+        self.deliver(len(chunk))
+        filled_gap = bool(self.reorder_buffer)
+        # Chunks already written beyond the gap now count as delivered in order
+        while self.expected_seq in self.reorder_buffer:
+            self.deliver(self.reorder_buffer.pop(self.expected_seq))
+        if self.log_chunk:
+            self.log_chunk_timed(f'Chunk {seq}: CRC32 valid (ACK)')
+        if not self.ack_owed:
+            self.ack_owed_since = self.clock()
+        self.ack_owed += 1
+        self.ack_trigger = seq
+        if filled_gap or self.ack_owed >= self.ack_every:
+            return self.ack(seq)
+        return None
+
+    def log_chunk_timed(self, msg):
+        stages = self.stages
+        if stages is not None:
+            start = now()
+        self.log_chunk(msg)
+        if stages is not None:
+            stages.add('log', start)
+
+    def ack(self, trigger, flags=0):
+        # Any response carries the cumulative ACK, so it also settles the coalesced one
+        if self.ack_owed:
+            self.ack_wait_histogram.record(self.clock() - self.ack_owed_since)
+        self.ack_owed = 0
+        self.responses_sent += 1
+        return pack_ack(self.expected_seq, trigger, flags, self.reorder_buffer)
+
+    def take_ack(self):
+        """The coalesced ACK for in-order chunks that have not been acknowledged yet, or None."""
+        if not self.ack_owed:
+            return None
+        return self.ack(self.ack_trigger)
+
+    def store(self, offset, chunk, crc):
+        if offset == 0 and self.is_binary is None:
+            head = bytes(chunk)
+            try:
+                head.decode()
+                self.is_binary = False
+            except Exception:
+                self.is_binary = True
+                if self.file_ext is None:
+                    self.file_ext = guess_file_extension(head)
+        if self.start_time is None:
+            self.start_time = self.clock()
+        if self.sink is None:
+            self.sink = self.sink_factory(self.output_dir)
+        stages = self.stages
+        if stages is not None:
+            start = now()
+        self.sink.write_at(offset, chunk)
+        if stages is not None:
+            stages.add('write', start)
+        if self.chunk_store is not None:
+            if stages is not None:
+                start = now()
+            self.chunk_store.put(chunk)
+            if stages is not None:
+                stages.add('chunk store', start)
+        if self.manifest is not None and self.manifest.add(offset, len(chunk), crc):
+            # The data must be on disk before the manifest says it is there
+            if stages is not None:
+                start = now()
+            self.sink.after_writes(self.manifest.write, self.manifest.take())
+            if stages is not None:
+                stages.add('manifest', start)
+
+    def deliver(self, length):
+        self.copies_histogram.record(self.arrivals.pop(self.expected_seq, 1))
+        self.total_bytes_received += length
+        self.unique_chunks_received += 1
+        self.expected_seq += 1
+
+    def has_data(self):
+        return self.total_bytes_received > 0 or self.resumed_bytes > 0 or self.dedup_bytes > 0
+
+    def save_as(self, path):
+        """Atomically move the received file to path."""
+        self.end_time = self.clock()
+        path = self.sink.commit(path)
+        self.sink = None
+        if self.manifest is not None:
+            self.manifest.remove()
+            self.manifest = None
+        return path
+
+    def take_data(self):
+        """Return the received bytes (for short text messages) and drop the temp file."""
+        self.end_time = self.clock()
+        data = self.sink.read_and_remove() if self.sink else b''
+        self.sink = None
+        return data
+
+    def discard(self):
+        if self.sink is not None:
+            self.sink.discard()
+            self.sink = None
+
+    def keep_partial(self):
+        """Close the temp file without removing it, e.g. when the connection drops mid-transfer."""
+        if self.sink is None:
+            return None
+        if self.manifest is not None:
+            try:
+                # The last entries wait for their chunks to be synced, as every batch does
+                self.sink.after_writes(self.manifest.write, self.manifest.take())
+            except OSError:
+                pass  # the file lost a write; the entries taken are dropped with it
+        self.sink.close()
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+        path = self.sink.temp_path
+        self.sink = None
+        return path
+
+    def metrics(self):
+        """The numbers behind metrics_lines(), for benchmarks and simulations."""
+        end_time, start_time = self.end_time, self.start_time
+        duration = (end_time - start_time) if (end_time is not None and start_time is not None and end_time > start_time) else 1
+        return {
+            'time': duration,
+            'throughput': self.total_bytes_received / duration,
+            'integrity': (self.unique_chunks_received / self.total_chunks_received) if self.total_chunks_received else 0,
+            'snr_db': snr_value(self.total_bits_received, self.error_bits),
+            'bytes': self.total_bytes_received,
+            'chunks_received': self.total_chunks_received,
+            'responses': self.responses_sent,
+            'chunks_corrected': self.chunks_corrected,
+            'bits_corrected': self.bits_corrected,
+            'resumed_bytes': self.resumed_bytes,
+            'compression_ratio': (self.decompressor.bytes_out / self.decompressor.bytes_in
+                                  if self.decompressor and self.decompressor.bytes_in else 1.0),
+            'decompression_cpu': self.decompressor.cpu_time if self.decompressor else 0.0,
+            'dedup_hit_rate': self.dedup_chunks / self.dedup_offered if self.dedup_offered else 0.0,
+            'dedup_bytes': self.dedup_bytes,
+        }
+
+    def samples(self):
+        """This transfer's live numbers for a MetricsRegistry."""
+        return [
+            Sample('counter', 'arq_receiver_chunks_total', 'DATA frames received, corrupted and duplicates included',
+                   self.total_chunks_received),
+            Sample('counter', 'arq_receiver_chunks_delivered_total', 'chunks delivered in order', self.unique_chunks_received),
+            Sample('counter', 'arq_receiver_bytes_total', 'bytes delivered', self.total_bytes_received),
+            Sample('counter', 'arq_receiver_responses_total', 'ACK frames sent', self.responses_sent),
+            Sample('counter', 'arq_receiver_chunks_corrected_total', 'chunks repaired by FEC', self.chunks_corrected),
+            Sample('counter', 'arq_receiver_dedup_bytes_total', 'bytes rebuilt from the chunk store', self.dedup_bytes),
+            Sample('summary', 'arq_receiver_chunk_copies', 'copies received per delivered chunk', self.copies_histogram),
+            Sample('summary', 'arq_receiver_ack_wait_seconds', 'time the oldest in-order chunk waits for its coalesced ACK',
+                   self.ack_wait_histogram),
+        ]
+
+    def metrics_lines(self, snr_label='SNR'):
+        m = self.metrics()
+        lines = [
+            f"Total transmission time: {m['time']:.4f} seconds",
+            f"Throughput: {m['throughput']:.2f} bytes/sec",
+            f"Data Integrity Rate: {m['integrity']:.4f}",
+            f"{snr_label}: {snr_db(self.total_bits_received, self.error_bits)} dB (Total bits: {self.total_bits_received}, Error bits: {self.error_bits})",
+            f"Responses sent: {m['responses']} for {m['chunks_received']} chunks",
+            self.copies_histogram.summary('Copies per chunk', fmt='{:g}', suffix=''),
+            self.ack_wait_histogram.summary('ACK wait'),
+        ]
+        if self.fec_chunks:
+            lines.append(f"FEC: {self.chunks_corrected} of {self.fec_chunks} chunks repaired ({self.bits_corrected} bits corrected)")
+        if self.decompressor is not None:
+            lines.append(self.decompressor.metrics_line())
+        if self.dedup_offered:
+            lines.append(f"Deduplication: {self.dedup_chunks} of {self.dedup_offered} chunks "
+                         f"({100 * self.dedup_chunks / self.dedup_offered:.1f}% hit rate) rebuilt from the chunk store, "
+                         f"{self.dedup_bytes} bytes not resent")
+            if self.chunk_store is not None:
+                lines.append(self.chunk_store.metrics_line())
+        if self.resumed_bytes:
+            lines.append(f"Resumed: {self.resumed_bytes} bytes kept from an earlier attempt")
+        if self.chunk_sizes:
+            lines.append(f"Chunk sizes: {', '.join(f'{size} B from chunk {seq}' for seq, size in self.chunk_sizes)}")
+        if self.stages is not None:
+            lines += self.stages.lines(m['time'])
+        return lines
@@ -0,0 +1,714 @@
+import socket
+import time
+import fec
+from crc_utils import crc32
+from arq_metrics import Histogram, Sample, snr_db, snr_value
+from channel_noise import make_channel
+from chunk_store import OFFER_BATCH, chunk_hash, pack_offer, unpack_held
+from compression import ChunkCompressor
+from resume import missing_ranges, pack_resume_request, unpack_entries
+from stage_timing import StageTimes, now
+from udp_transport import DatagramSocket, max_datagram_chunk
+from arq_protocol import (DATA_COMPRESSED, DATA_FEC, FRAME_ABORT, FRAME_ACK, FRAME_CHUNK_SIZE, FRAME_COMPRESS,
+                          FRAME_DATA, FRAME_DEDUP, FRAME_EOT, FRAME_META, FRAME_RESUME, RESPONSE_DUPLICATE, RESPONSE_NACK,
+                          TRANSFER_BITS, TRANSFER_STEP, FrameReader, describe_ack, frame_size, parse_ack, selectively_acked, send_frame)
+
+TIMEOUT = 3  # seconds; also the retransmission timeout until the first RTT sample
+MAX_RETRIES = 5
+MIN_RTO = 0.02  # seconds
+MAX_RTO = 60
+MIN_CHUNK_SIZE = 256
+MAX_ADAPTIVE_CHUNK_SIZE = 16 * 1024  # the adaptive sizer stays well below the protocol's MAX_CHUNK_SIZE
+SIZER_EPOCH = 16  # chunk outcomes between chunk-size decisions
+
+
+MODES = ('gbn', 'sr')
+
+
+class RttEstimator:
+    """Retransmission timeout (RTO) from a smoothed RTT and RTT variance, as in TCP (RFC 6298).
+
+    Until the first sample the RTO is initial_rto. Each timeout doubles it (exponential backoff)
+    until a new sample arrives. Callers must not feed samples from retransmitted chunks (Karn's
+    algorithm), since it is unknown which copy was acknowledged.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+    GRANULARITY = 0.001  # seconds
+
+    def __init__(self, initial_rto=TIMEOUT, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.reset()
+
+    def reset(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = self.initial_rto
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        rto = self.srtt + max(self.GRANULARITY, self.K * self.rttvar)
+        self.rto = min(max(rto, self.min_rto), self.max_rto)
+
+    def backoff(self):
+        self.rto = min(self.rto * 2, self.max_rto)
+
+
+class ChunkSizer:
+    """Chooses the chunk size with the best expected goodput from the observed chunk error rate and RTT.
+
+    A chunk error rate p at size L means a chunk of size S gets through with probability
+    (1 - p) ** (S / L) (independent bit errors). Each chunk also costs its frame overhead and a share
+    of the round trip it waits for, converted to bytes at the observed rate and split across the
+    window. The size moves one power of two at a time, and only for a predicted gain of 5% or more.
+    """
+
+    MIN_GAIN = 1.05
+
+    def __init__(self, chunk_size, min_size=MIN_CHUNK_SIZE, max_size=MAX_ADAPTIVE_CHUNK_SIZE, epoch=SIZER_EPOCH, clock=time.time):
+        self.clock = clock
+        self.min_size = min_size
+        self.max_size = max_size
+        self.epoch = epoch
+        self.size = chunk_size
+        self.last_error_rate = 0.0
+        self.start_epoch()
+
+    def start_epoch(self):
+        self.good = 0
+        self.bad = 0
+        self.epoch_bytes = 0
+        self.epoch_start = self.clock()
+
+    def record(self, ok, nbytes=0):
+        if ok:
+            self.good += 1
+            self.epoch_bytes += nbytes
+        else:
+            self.bad += 1
+
+    def error_rate(self):
+        return self.bad / (self.good + self.bad) if self.good + self.bad else 0.0
+
+    def expected_goodput(self, size, error_rate, overhead):
+        return size * (1 - error_rate) ** (size / self.size) / (size + overhead)
+
+    def decide(self, srtt, window):
+        """Return a new chunk size once an epoch of outcomes is in, or None to keep the current one."""
+        if self.good + self.bad < self.epoch:
+            return None
+        error_rate = self.last_error_rate = self.error_rate()
+        elapsed = self.clock() - self.epoch_start
+        overhead = frame_size(0)
+        if srtt and elapsed > 0:
+            overhead += srtt * (self.epoch_bytes / elapsed) / window
+        candidates = [size for size in (self.size // 2, self.size, self.size * 2)
+                      if self.min_size <= size <= self.max_size] or [self.size]
+        if error_rate >= 1:
+            best = min(candidates)
+        else:
+            best = max(candidates, key=lambda size: self.expected_goodput(size, error_rate, overhead))
+            if self.expected_goodput(best, error_rate, overhead) < self.MIN_GAIN * self.expected_goodput(self.size, error_rate, overhead):
+                best = self.size
+        self.start_epoch()
+        if best == self.size:
+            return None
+        self.size = best
+        return best
+
+
+class ArqSender:
+    """Go-Back-N ('gbn') or Selective Repeat ('sr') sender; Go-Back-N with a window of 1 is plain stop-and-wait.
+
+    Channel noise is injected before sending: error_prob flips one bit in that fraction of the
+    chunks, as the front-ends always did, and ber instead flips every payload bit independently
+    (see channel_noise). seed makes either reproducible.
+
+    With fec, every chunk carries Hamming check bits (see fec) that let the receiver repair
+    single-bit errors itself instead of asking for the chunk again.
+
+    resume() asks the receiver which chunks of a file it kept from an interrupted transfer, so
+    transmit() only sends the rest. dedup() does the same for chunks the receiver holds in its
+    chunk store from any earlier transfer.
+
+    With compression (a codec from compression.available_codecs()), each transfer first asks the
+    receiver to accept that codec, then compresses every chunk that gets smaller for it; the CRC
+    and FEC cover the compressed bytes.
+
+    Per-chunk RTT, time to ACK (from the first send) and retries are kept in histograms for the
+    metrics log. With a registry (arq_metrics.MetricsRegistry), samples() are served live while
+    a transfer runs.
+
+    sock may be a udp_transport.DatagramSocket, making this ARQ the only reliability layer. Control
+    exchanges (file type, codec, EOT/ABORT) are then repeated after each retransmission timeout
+    until answered, and every frame carries the transfer's number (see arq_protocol.TRANSFER_BITS),
+    so answers and duplicates from earlier transfers are ignored.
+
+    With timing, each transfer adds up the time spent per stage (read, compress, CRC, FEC, noise,
+    send, wait for a response, log) in a stage_timing.StageTimes for the metrics log. Chunks are
+    then copied out of the file mapping in the read stage, so page faults count as reading
+    instead of landing in whichever stage touches the bytes first.
+    """
+
+    def __init__(self, sock, window=1, mode='gbn', error_prob=0.0, timeout=TIMEOUT, max_retries=MAX_RETRIES,
+                 log_event=print, log_crc=None, min_rto=MIN_RTO, max_rto=MAX_RTO, adaptive_chunks=False, log_chunk=None,
+                 clock=time.time, ber=0.0, seed=None, fec=False, compression=None, compression_level=None, registry=None,
+                 timing=False):
+        if mode not in MODES:
+            raise ValueError(f'Unknown ARQ mode: {mode}')
+        self.sock = sock
+        self.datagram = isinstance(sock, DatagramSocket)
+        self.transfer_tag = sock.transfer_tag if self.datagram else 0  # flag bits on every frame sent
+        self.clock = clock  # the simulator passes its virtual clock, together with a simulated socket
+        self.reader = FrameReader(sock)
+        self.window = max(1, int(window))
+        self.mode = mode
+        self.error_prob = error_prob
+        self.ber = ber
+        self.noise = make_channel(error_prob, ber, seed)
+        self.fec = fec
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compressor = None  # the ChunkCompressor of the current transfer, once the receiver has accepted the codec
+        self.timeout = timeout
+        # The estimator lives as long as the connection, so later transfers start from its RTO
+        self.rtt = RttEstimator(timeout, min_rto, max_rto)
+        self.max_retries = max_retries
+        self.adaptive_chunks = adaptive_chunks
+        self.sizer = None
+        self.log_event = log_event
+        self.log_chunk = log_chunk  # routine per-chunk lines (sent, acknowledged); None skips them
+        self.log_crc = log_crc
+        self.registry = registry
+        self.timing = timing
+        self.resumed_bytes = 0  # set by resume(); bytes the receiver already held
+        self.dedup_offered = 0  # set by dedup(): chunks offered, and how many (and bytes) the receiver had
+        self.dedup_chunks = 0
+        self.dedup_bytes = 0
+        self.reset()
+
+    def reset(self):
+        self.total_bytes_acked = 0
+        self.total_chunks_sent = 0
+        self.unique_chunks_acked = 0
+        self.chunk_rtts = []
+        self.rtt_histogram = Histogram(1e-6)
+        self.ack_histogram = Histogram(1e-6)  # first send to ACK, retransmissions included
+        self.retry_histogram = Histogram()
+        self.chunk_sends = {}  # seq -> (first send time, sends) for chunks in flight
+        self.retransmissions = 0
+        self.timeouts = 0
+        self.spurious_retransmissions = 0  # timeout resends of chunks the receiver already had
+        self.timeout_resent = set()
+        self.wire_chunks = {}  # seq -> (bytes to send, compressed) for chunks in flight, so resends are not compressed again
+        self.next_new_seq = 0  # chunks below this have been sent at least once, so their size is fixed
+        self.chunk_sizes = []  # (seconds into the transfer, first chunk, chunk size) for adaptive sizing
+        self.stages = StageTimes() if self.timing else None
+        # SNR counters
+        self.total_bits_sent = 0
+        self.error_bits = 0
+        self.start_time = None
+        self.end_time = None
+
+    def mode_name(self):
+        if self.mode == 'sr':
+            name = f'Selective Repeat (window {self.window})'
+        elif self.window == 1:
+            name = 'Stop-and-Wait'
+        else:
+            name = f'Go-Back-N (window {self.window})'
+        return name + (f' with FEC (Hamming, {fec.FEC_BLOCK}-byte blocks)' if self.fec else '')
+
+    def read_chunk(self, chunks, seq):
+        stages = self.stages
+        if stages is None:
+            return chunks[seq]
+        start = now()
+        chunk = bytes(chunks[seq])
+        stages.add('read', start)
+        return chunk
+
+    def send_chunk(self, seq, offset, chunk, attempt):
+        stages = self.stages
+        flags = self.transfer_tag
+        if self.compressor is not None:
+            if seq not in self.wire_chunks:
+                if stages is not None:
+                    start = now()
+                self.wire_chunks[seq] = self.compressor.compress(chunk)
+                if stages is not None:
+                    stages.add('compress', start)
+            chunk, compressed = self.wire_chunks[seq]
+            if compressed:
+                flags |= DATA_COMPRESSED
+        if stages is not None:
+            start = now()
+        crc = crc32(chunk)
+        if stages is not None:
+            stages.add('crc', start)
+        if self.log_crc:
+            if stages is not None:
+                start = now()
+            self.log_crc(seq, crc)
+            if stages is not None:
+                stages.add('log', start)
+        payload = chunk
+        if self.fec:
+            if stages is not None:
+                start = now()
+            payload = bytes(chunk) + fec.encode(chunk)
+            if stages is not None:
+                stages.add('fec', start)
+            flags |= DATA_FEC
+        if self.noise:
+            if stages is not None:
+                start = now()
+            send_chunk, bits_flipped = self.noise.corrupt(payload)
+            if stages is not None:
+                stages.add('noise', start)
+        else:
+            send_chunk, bits_flipped = payload, 0
+        if bits_flipped:
+            self.log_event(f"Chunk {seq}: {bits_flipped} bit error(s) introduced.")
+        send_time = self.clock()
+        first_send, sends = self.chunk_sends.get(seq, (send_time, 0))
+        self.chunk_sends[seq] = (first_send, sends + 1)
+        if stages is not None:
+            start = now()
+        send_frame(self.sock, FRAME_DATA, send_chunk, seq=seq, offset=offset, flags=flags, crc=crc)
+        if stages is not None:
+            stages.add('send', start)
+        if self.log_chunk:
+            if stages is not None:
+                start = now()
+            self.log_chunk(f"Chunk {seq}: Sent (retry {attempt})")
+            if stages is not None:
+                stages.add('log', start)
+        self.total_chunks_sent += 1
+        if attempt > 1:
+            self.retransmissions += 1
+        self.total_bits_sent += len(send_chunk) * 8
+        self.error_bits += bits_flipped
+        return send_time
+
+    def resume(self, fid, chunks):
+        """Offer the file behind chunks (a MappedChunks) for resuming; returns the chunks still to send.
+
+        The receiver answers with the offset, length and CRC of every chunk it kept for fid (see
+        resume.py). Those whose CRC matches the local data are skipped; the rest of the file goes
+        out as chunks at their own offsets, at a fixed chunk size.
+        """
+        self.sock.settimeout(self.timeout)
+        send_frame(self.sock, FRAME_RESUME, pack_resume_request(fid, chunks.size, chunks.chunk_size))
+        entries = []
+        while True:
+            frame = self.read_reply(FRAME_RESUME)
+            entries += unpack_entries(frame.payload)
+            if frame.seq == 0:  # the number of replies still to come
+                break
+        ranges, self.resumed_bytes = missing_ranges(entries, chunks.view)
+        if not self.resumed_bytes:
+            return chunks
+        self.log_event(f"Resuming: {self.resumed_bytes} of {chunks.size} bytes already on the server, "
+                       f"{chunks.size - self.resumed_bytes} bytes in {len(ranges)} range(s) to send")
+        return chunks.select(ranges)
+
+    def dedup(self, chunks):
+        """Offer the hash of every chunk (chunks is a MappedChunks); returns the chunks the receiver still needs.
+
+        The receiver rebuilds those it has in its chunk store; the rest go out at their own offsets,
+        at a fixed chunk size.
+        """
+        hashes = [chunk_hash(chunks[index]) for index in range(len(chunks))]
+        self.sock.settimeout(self.timeout)
+        held = []
+        for first in range(0, len(hashes), OFFER_BATCH):
+            batch = hashes[first:first + OFFER_BATCH]
+            send_frame(self.sock, FRAME_DEDUP, pack_offer(chunks.size, chunks.chunk_size, first, batch))
+            held += unpack_held(self.read_reply(FRAME_DEDUP).payload, len(batch))
+        ranges = []
+        for index, present in enumerate(held):
+            if present:
+                self.dedup_chunks += 1
+                self.dedup_bytes += len(chunks[index])
+                continue
+            start = chunks.offset(index)
+            end = start + len(chunks[index])
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        self.dedup_offered = len(hashes)
+        self.log_event(f"Deduplication: {self.dedup_chunks} of {len(hashes)} chunks already on the server")
+        return chunks.select(ranges) if self.dedup_chunks else chunks
+
+    def transmit(self, chunks):
+        """Send all chunks, then EOT (or ABORT on failure). Returns True if every chunk was ACKed.
+
+        chunks is any sequence of bytes-like chunks; a file_chunker.MappedChunks is read lazily,
+        and with adaptive_chunks its chunk size is adjusted as the transfer goes.
+        """
+        self.reset()
+        self.sizer = None
+        if self.adaptive_chunks and hasattr(chunks, 'resize'):
+            max_size = min(MAX_ADAPTIVE_CHUNK_SIZE, max_datagram_chunk(self.fec)) if self.datagram else MAX_ADAPTIVE_CHUNK_SIZE
+            self.sizer = ChunkSizer(chunks.chunk_size, max_size=max_size, clock=self.clock)
+        if hasattr(chunks, 'offset'):
+            self.chunk_offset = chunks.offset
+        else:
+            offsets = []
+            offset = 0
+            for chunk in chunks:
+                offsets.append(offset)
+                offset += len(chunk)
+            self.chunk_offset = offsets.__getitem__
+        self.compressor = self.negotiate_compression() if self.compression else None
+        if self.registry is not None:
+            self.registry.track(self)
+        try:
+            self.start_time = self.clock()
+            if self.sizer:
+                self.announce_chunk_size(0, chunks.chunk_size)
+            if self.mode == 'sr':
+                success = self.selective_repeat(chunks)
+            else:
+                success = self.go_back_n(chunks)
+            self.end_time = self.clock()
+            self.finish(FRAME_EOT if success else FRAME_ABORT)
+        finally:
+            if self.registry is not None:
+                self.registry.finish(self)
+        return success
+
+    def announce_file_type(self, file_ext):
+        """Tell the receiver the extension of the file about to be sent (FRAME_META); over UDP it is echoed back."""
+        if self.datagram:
+            self.request(FRAME_META, file_ext.encode(), replies=(FRAME_META,))
+        else:
+            send_frame(self.sock, FRAME_META, file_ext.encode())
+
+    def read_reply(self, frame_type):
+        """The receiver's next frame_type frame, skipping any other frames before it; an ABORT instead ends the transfer."""
+        while True:
+            frame = self.reader.read_frame()
+            if frame is None:
+                raise ConnectionError('Connection closed by server')
+            if frame.type == frame_type:
+                return frame
+            if frame.type == FRAME_ABORT:
+                raise ConnectionError('Transfer aborted by server')
+
+    def request(self, frame_type, payload=b'', replies=()):
+        """Send a control frame and return the first answer whose type is in replies, or None if none came.
+
+        Over TCP the frame is sent once and the answer waited for up to timeout seconds. Over UDP
+        the frame or its answer may be lost, so it is sent again after every retransmission
+        timeout, up to max_retries times; the receiver answers repeats without acting on them twice.
+        """
+        for attempt in range(self.max_retries if self.datagram else 1):
+            sent_at = self.clock()
+            send_frame(self.sock, frame_type, payload, flags=self.transfer_tag)
+            self.sock.settimeout(self.rtt.rto if self.datagram else self.timeout)
+            try:
+                while True:
+                    frame = self.reader.read_frame()
+                    if frame is None:
+                        raise ConnectionError('Connection closed by server')
+                    if frame.flags & TRANSFER_BITS != self.transfer_tag:
+                        continue  # left over from an earlier transfer
+                    if frame.type in replies:
+                        if self.datagram and attempt == 0:
+                            self.rtt.sample(self.clock() - sent_at)  # Karn: only unambiguous answers
+                        return frame
+                    if frame.type == FRAME_ACK:
+                        self.note_response(frame)
+            except socket.timeout:
+                if self.datagram:
+                    self.rtt.backoff()
+        return None
+
+    def negotiate_compression(self):
+        """Ask the receiver to accept self.compression; returns a ChunkCompressor, or None if it declines."""
+        # A receiver without compression support ignores the request
+        frame = self.request(FRAME_COMPRESS, self.compression.encode(), replies=(FRAME_COMPRESS,))
+        accepted = frame is not None and bytes(frame.payload) == self.compression.encode()
+        if not accepted:
+            self.log_event(f"Receiver does not accept {self.compression} compression; sending uncompressed")
+            return None
+        return ChunkCompressor(self.compression, self.compression_level)
+
+    def wait_response(self):
+        """read_response(), timed as the wait stage; a timeout counts as waiting too."""
+        stages = self.stages
+        if stages is None:
+            return self.read_response()
+        start = now()
+        try:
+            return self.read_response()
+        finally:
+            stages.add('wait', start)
+
+    def read_response(self):
+        """The next Ack from the receiver, or FRAME_EOT / FRAME_ABORT for its end-of-transfer echo."""
+        while True:
+            frame = self.reader.read_frame()
+            if frame is None:
+                raise ConnectionError('Connection closed by server')
+            if frame.flags & TRANSFER_BITS != self.transfer_tag:
+                continue  # left over from an earlier transfer
+            if frame.type == FRAME_ACK:
+                return self.note_response(frame)
+            if frame.type in (FRAME_EOT, FRAME_ABORT):
+                return frame.type
+
+    def note_response(self, frame):
+        ack = parse_ack(frame)
+        if ack.flags & RESPONSE_DUPLICATE and ack.trigger in self.timeout_resent:
+            self.timeout_resent.discard(ack.trigger)
+            self.spurious_retransmissions += 1
+            self.log_event(f"Chunk {ack.trigger}: Spurious retransmission (receiver already had it)")
+        return ack
+
+    def log_response(self, seq, ack):
+        stages = self.stages
+        if stages is not None:
+            start = now()
+        self.log_chunk(f"Chunk {seq}: Server response: {describe_ack(ack)}")
+        if stages is not None:
+            stages.add('log', start)
+
+    def record_ack(self, seq, chunk, ack_time, send_time):
+        self.chunk_rtts.append(ack_time - send_time)
+        self.rtt_histogram.record(ack_time - send_time)
+        first_send, sends = self.chunk_sends.pop(seq, (send_time, 1))
+        self.ack_histogram.record(ack_time - first_send)
+        self.retry_histogram.record(sends - 1)
+        self.wire_chunks.pop(seq, None)
+        self.total_bytes_acked += len(chunk)
+        self.unique_chunks_acked += 1
+        if self.sizer:
+            self.sizer.record(True, len(chunk))
+
+    def sample_rtt(self, seq, ack_time, send_times, attempts):
+        # Karn's algorithm: only chunks sent exactly once give an unambiguous RTT sample
+        if seq in send_times and attempts.get(seq) == 1:
+            self.rtt.sample(ack_time - send_times[seq])
+
+    def on_timeout(self, seqs):
+        self.timeouts += 1
+        self.timeout_resent.update(seqs)
+        self.rtt.backoff()
+        self.record_failures(len(seqs))
+
+    def record_failures(self, count):
+        if self.sizer:
+            for _ in range(count):
+                self.sizer.record(False)
+
+    def announce_chunk_size(self, seq, size):
+        # Lets the receiver size its frame buffer before the larger frames arrive
+        send_frame(self.sock, FRAME_CHUNK_SIZE, size.to_bytes(4, 'big'), seq=seq, flags=self.transfer_tag)
+        self.chunk_sizes.append((self.clock() - self.start_time, seq, size))
+
+    def send_new_chunk(self, chunks, seq, attempt):
+        """Send a chunk, first fixing its size if it has never been sent before."""
+        if seq >= self.next_new_seq:
+            if self.sizer:
+                new_size = self.sizer.decide(self.rtt.srtt, self.window)
+                if new_size:
+                    chunks.resize(new_size, seq)
+                    self.announce_chunk_size(seq, new_size)
+                    srtt = self.rtt.srtt or 0
+                    self.log_event(f"Chunk size set to {new_size} bytes from chunk {seq} "
+                                   f"(chunk error rate {self.sizer.last_error_rate:.3f}, SRTT {srtt:.4f} s)")
+            self.next_new_seq = seq + 1
+        return self.send_chunk(seq, self.chunk_offset(seq), self.read_chunk(chunks, seq), attempt)
+
+    def go_back_n(self, chunks):
+        base = 0
+        next_seq = 0
+        send_times = {}
+        attempts = {}
+        base_failures = 0  # NACKs/timeouts for the chunk at the window base
+        # len(chunks) is re-read because adaptive sizing changes the chunk count mid-transfer
+        while base < len(chunks):
+            while next_seq < len(chunks) and next_seq < base + self.window:
+                attempts[next_seq] = attempts.get(next_seq, 0) + 1
+                send_times[next_seq] = self.send_new_chunk(chunks, next_seq, attempts[next_seq])
+                next_seq += 1
+            go_back = False
+            self.sock.settimeout(max(send_times[base] + self.rtt.rto - self.clock(), 0.001))
+            try:
+                ack = self.wait_response()
+            except socket.timeout:
+                self.on_timeout(range(base, next_seq))
+                self.log_event(f"Chunk {base}: Timeout waiting for ACK/NACK. Retrying (RTO {self.rtt.rto:.3f} s).")
+                go_back = True
+            else:
+                ack_time = self.clock()
+                if self.log_chunk:
+                    self.log_response(base, ack)
+                # Cumulative ACK: everything below it has been delivered in order
+                if ack.cumulative > base:
+                    if ack.trigger < ack.cumulative:
+                        self.sample_rtt(ack.trigger, ack_time, send_times, attempts)
+                    for seq in range(base, min(ack.cumulative, next_seq)):
+                        self.record_ack(seq, chunks[seq], ack_time, send_times.pop(seq))
+                        attempts.pop(seq, None)
+                    base = min(ack.cumulative, next_seq)
+                    base_failures = 0
+                if ack.flags & RESPONSE_NACK and ack.trigger == base:
+                    self.log_event(f"Chunk {base}: NACK received. Retrying.")
+                    self.record_failures(1)
+                    go_back = True
+            if go_back:
+                base_failures += 1
+                if base_failures >= self.max_retries:
+                    self.log_event(f"Chunk {base}: Failed after {self.max_retries} attempts. Aborting.")
+                    return False
+                next_seq = base
+        return True
+
+    def selective_repeat(self, chunks):
+        base = 0
+        next_seq = 0
+        send_times = {}  # unacknowledged chunks in flight, each with its own timer
+        attempts = {}
+        acked = set()
+        while base < len(chunks):
+            while next_seq < len(chunks) and next_seq < base + self.window:
+                attempts[next_seq] = 1
+                send_times[next_seq] = self.send_new_chunk(chunks, next_seq, 1)
+                next_seq += 1
+            resend = []
+            oldest = min(send_times, key=send_times.get)
+            self.sock.settimeout(max(send_times[oldest] + self.rtt.rto - self.clock(), 0.001))
+            try:
+                ack = self.wait_response()
+            except socket.timeout:
+                timeout_time = self.clock()
+                resend = [seq for seq, send_time in send_times.items() if timeout_time - send_time >= self.rtt.rto]
+                self.on_timeout(resend)
+                for seq in resend:
+                    self.log_event(f"Chunk {seq}: Timeout waiting for ACK/NACK. Retrying (RTO {self.rtt.rto:.3f} s).")
+            else:
+                ack_time = self.clock()
+                if self.log_chunk:
+                    self.log_response(ack.trigger, ack)
+                newly_acked = [seq for seq in send_times if seq < ack.cumulative]
+                if ack.bitmap:
+                    newly_acked += [seq for seq in selectively_acked(ack) if seq in send_times]
+                if ack.trigger in newly_acked:
+                    self.sample_rtt(ack.trigger, ack_time, send_times, attempts)
+                elif ack.flags & RESPONSE_NACK and ack.trigger in send_times:
+                    self.log_event(f"Chunk {ack.trigger}: NACK received. Retrying.")
+                    self.record_failures(1)
+                    resend.append(ack.trigger)
+                for seq in newly_acked:
+                    self.record_ack(seq, chunks[seq], ack_time, send_times.pop(seq))
+                    acked.add(seq)
+            for seq in resend:
+                if attempts[seq] >= self.max_retries:
+                    self.log_event(f"Chunk {seq}: Failed after {self.max_retries} attempts. Aborting.")
+                    return False
+                attempts[seq] += 1
+                send_times[seq] = self.send_chunk(seq, self.chunk_offset(seq), self.read_chunk(chunks, seq), attempts[seq])
+            while base in acked:
+                acked.discard(base)
+                base += 1
+        return True
+
+    def finish(self, frame_type):
+        # Responses to chunks still in flight are drained up to the server's EOT/ABORT echo,
+        # so they cannot be mistaken for ACKs of the next transfer.
+        try:
+            self.request(frame_type, replies=(FRAME_EOT, FRAME_ABORT))
+        except OSError:
+            pass
+        if self.datagram:
+            # Anything still on its way from this transfer now carries an old number
+            self.sock.transfer_tag = (self.sock.transfer_tag + TRANSFER_STEP) & TRANSFER_BITS
+            self.transfer_tag = self.sock.transfer_tag
+
+    def metrics(self):
+        """The numbers behind metrics_lines(), for benchmarks and simulations."""
+        duration = self.end_time - self.start_time if self.end_time > self.start_time else 1
+        return {
+            'time': duration,
+            'throughput': self.total_bytes_acked / duration,
+            'integrity': (self.unique_chunks_acked / self.total_chunks_sent) if self.total_chunks_sent else 0,
+            'avg_rtt': sum(self.chunk_rtts) / len(self.chunk_rtts) if self.chunk_rtts else 0,
+            'snr_db': snr_value(self.total_bits_sent, self.error_bits),
+            'bytes': self.total_bytes_acked,
+            'chunks_sent': self.total_chunks_sent,
+            'retransmissions': self.retransmissions,
+            'timeouts': self.timeouts,
+            'spurious_retransmissions': self.spurious_retransmissions,
+            'rto': self.rtt.rto,
+            'rtt_p50': self.rtt_histogram.percentile(50),
+            'rtt_p95': self.rtt_histogram.percentile(95),
+            'rtt_p99': self.rtt_histogram.percentile(99),
+            'time_to_ack_p99': self.ack_histogram.percentile(99),
+            'resumed_bytes': self.resumed_bytes,
+            'compression_ratio': self.compressor.ratio() if self.compressor else 1.0,
+            'compression_cpu': self.compressor.cpu_time if self.compressor else 0.0,
+            'dedup_hit_rate': self.dedup_chunks / self.dedup_offered if self.dedup_offered else 0.0,
+            'dedup_bytes': self.dedup_bytes,
+        }
+
+    def samples(self):
+        """This transfer's live numbers for a MetricsRegistry."""
+        return [
+            Sample('counter', 'arq_sender_chunks_sent_total', 'DATA frames sent, retransmissions included', self.total_chunks_sent),
+            Sample('counter', 'arq_sender_chunks_acked_total', 'chunks acknowledged', self.unique_chunks_acked),
+            Sample('counter', 'arq_sender_bytes_acked_total', 'bytes of acknowledged chunks', self.total_bytes_acked),
+            Sample('counter', 'arq_sender_retransmissions_total', 'chunks sent again', self.retransmissions),
+            Sample('counter', 'arq_sender_timeouts_total', 'retransmission timeouts', self.timeouts),
+            Sample('gauge', 'arq_sender_rto_seconds', 'current retransmission timeout', self.rtt.rto),
+            Sample('gauge', 'arq_sender_srtt_seconds', 'smoothed RTT', self.rtt.srtt or 0.0),
+            Sample('summary', 'arq_sender_chunk_rtt_seconds', 'last send of a chunk to its ACK', self.rtt_histogram),
+            Sample('summary', 'arq_sender_time_to_ack_seconds', 'first send of a chunk to its ACK', self.ack_histogram),
+            Sample('summary', 'arq_sender_chunk_retries', 'retransmissions per acknowledged chunk', self.retry_histogram),
+        ]
+
+    def metrics_lines(self):
+        m = self.metrics()
+        return [
+            f"Total transmission time: {m['time']:.4f} seconds",
+            f"Throughput: {m['throughput']:.2f} bytes/sec",
+            f"Data Integrity Rate: {m['integrity']:.4f}",
+            f"Average RTT: {m['avg_rtt']:.4f} seconds",
+            self.rtt_histogram.summary('Chunk RTT'),
+            self.ack_histogram.summary('Time to ACK'),
+            self.retry_histogram.summary('Retries per chunk', fmt='{:g}', suffix=''),
+            f"Retransmission timeout: {self.rtt.rto:.4f} seconds (SRTT {self.rtt.srtt or 0:.4f}, RTTVAR {self.rtt.rttvar or 0:.4f})",
+            f"Retransmissions: {self.retransmissions} ({self.timeouts} timeouts, {self.spurious_retransmissions} spurious)",
+            f"Simulated SNR: {snr_db(self.total_bits_sent, self.error_bits)} dB (Total bits: {self.total_bits_sent}, Error bits: {self.error_bits})",
+            f"ARQ mode: {self.mode_name()}",
+        ] + ([self.compressor.metrics_line()] if self.compressor else []) + self.resume_lines() + self.chunk_size_lines() + (
+            self.stages.lines(m['time']) if self.stages is not None else [])
+
+    def resume_lines(self):
+        lines = []
+        if self.dedup_offered:
+            lines.append(f"Deduplication: {self.dedup_chunks} of {self.dedup_offered} chunks "
+                         f"({100 * self.dedup_chunks / self.dedup_offered:.1f}% hit rate) already on the server, "
+                         f"{self.dedup_bytes} bytes not sent")
+        if self.resumed_bytes:
+            lines.append(f"Resumed: {self.resumed_bytes} bytes were already on the server, {self.total_bytes_acked} bytes sent")
+        return lines
+
+    def chunk_size_lines(self):
+        if not self.chunk_sizes:
+            return []
+        history = ', '.join(f'{size} B from chunk {seq} at {elapsed:.3f} s' for elapsed, seq, size in self.chunk_sizes)
+        return [f"Chunk sizes: {history}"]
@@ -0,0 +1,259 @@
+import argparse
+import heapq
+import math
+import mmap
+import random
+import socket
+import time
+from arq_metrics import snr_db
+from channel_noise import BitErrorChannel
+from arq_protocol import (FRAME_ABORT, FRAME_CHUNK_SIZE, FRAME_DATA, FRAME_EOT, FRAME_HEADER, FRAME_META, MAX_CHUNK_SIZE,
+                          FrameReader, pack_frame)
+from arq_receiver import ACK_EVERY, ArqReceiver
+from arq_sender import MAX_RETRIES, MODES, ArqSender
+from file_chunker import MappedChunks
+
+UP, DOWN, TIMER = 0, 1, 2  # sender -> receiver, receiver -> sender, and callbacks due at a given time
+
+
+class NullSink:
+    """Stands in for FileSink when only the metrics matter: counts the bytes, writes nothing."""
+
+    temp_path = None
+
+    def __init__(self, output_dir=None):
+        self.bytes_written = 0
+
+    def write_at(self, offset, chunk):
+        self.bytes_written += len(chunk)
+
+    def close(self):
+        pass
+
+    def commit(self, path):
+        return path
+
+    def read_and_remove(self):
+        return b''
+
+    def discard(self):
+        pass
+
+
+class SimChannel:
+    """Discrete-event model of a full-duplex link, with a virtual clock.
+
+    Each direction serialises frames at bandwidth bits/s, one after another, and delivers them
+    delay seconds later. A DATA frame's payload bits are flipped independently with probability
+    ber, and any frame is lost with probability loss. Nothing happens in real time: the clock
+    jumps from one event to the next whenever the sender waits for a response.
+    """
+
+    def __init__(self, delay=0.001, bandwidth=100e6, ber=0.0, loss=0.0, seed=None):
+        self.delay = delay
+        self.bandwidth = bandwidth
+        self.ber = ber
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.now = 0.0
+        self.events = []  # heap of (time, order, direction, frame bytes)
+        self.order = 0
+        self.link_free = [0.0, 0.0]  # when each direction finishes serialising its last frame
+        self.receivers = [None, None, lambda callback: callback()]  # per direction: callable(frame bytes)
+        self.noise = BitErrorChannel(ber, seed)
+        self.frames_lost = 0
+
+    def clock(self):
+        return self.now
+
+    def transmit(self, direction, data):
+        start = max(self.now, self.link_free[direction])
+        self.link_free[direction] = start + len(data) * 8 / self.bandwidth
+        if self.loss and self.random.random() < self.loss:
+            self.frames_lost += 1
+            return
+        if direction == UP and data[0] == FRAME_DATA:
+            data = self.corrupt(data)
+        heapq.heappush(self.events, (self.link_free[direction] + self.delay, self.order, direction, data))
+        self.order += 1
+
+    @property
+    def payload_bits(self):
+        return self.noise.bits_seen
+
+    @property
+    def bits_flipped(self):
+        return self.noise.bits_flipped
+
+    def call_later(self, delay, callback):
+        heapq.heappush(self.events, (self.now + delay, self.order, TIMER, callback))
+        self.order += 1
+
+    def corrupt(self, data):
+        end = len(data) - 4  # the payload stops at the CRC trailer
+        noisy, flipped = self.noise.corrupt(memoryview(data)[FRAME_HEADER.size:end])
+        if not flipped:
+            return data
+        return data[:FRAME_HEADER.size] + noisy + data[end:]
+
+    def run_until(self, done, deadline):
+        """Process events in time order until done() holds or the next one lies past deadline."""
+        while not done():
+            if not self.events or self.events[0][0] > deadline:
+                self.now = max(self.now, deadline) if deadline != math.inf else self.now
+                return False
+            when, _, direction, data = heapq.heappop(self.events)
+            self.now = max(self.now, when)
+            self.receivers[direction](data)
+        return True
+
+
+class SimSocket:
+    """The sender's end of a SimChannel, with just enough of the socket API for ArqSender."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.timeout = None
+        self.inbox = bytearray()
+        channel.receivers[DOWN] = self.inbox.extend
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def sendall(self, data):
+        self.channel.transmit(UP, bytes(data))
+
+    def sendmsg(self, parts):
+        data = b''.join(parts)
+        self.channel.transmit(UP, data)
+        return len(data)
+
+    def recv_into(self, buffer):
+        if not self.inbox:
+            deadline = math.inf if self.timeout is None else self.channel.now + self.timeout
+            if not self.channel.run_until(lambda: self.inbox, deadline):
+                if deadline == math.inf:
+                    return 0  # nothing left in flight: behave like a closed connection
+                raise socket.timeout('timed out')
+        n = min(len(buffer), len(self.inbox))
+        buffer[:n] = self.inbox[:n]
+        del self.inbox[:n]
+        return n
+
+
+class SimReceiverEnd:
+    """The receiver's end: feeds arriving frames to an ArqReceiver, the way the server session does.
+
+    Each frame arrives on its own, so coalesced ACKs only cover several chunks with an ack_delay.
+    """
+
+    def __init__(self, channel, receiver, ack_delay=0.0):
+        self.channel = channel
+        self.receiver = receiver
+        self.ack_delay = ack_delay
+        self.ack_pending = False
+        self.reader = FrameReader()
+        self.completed = []  # receiver.metrics() of every finished transfer
+        self.last_metrics_lines = []
+        channel.receivers[UP] = self.deliver
+
+    def deliver(self, data):
+        reader = self.reader
+        reader.feed(data)
+        while True:
+            frame = reader.next_frame()
+            if frame is None:
+                break
+            self.handle_frame(frame)
+        if self.receiver.ack_owed and not self.ack_pending:
+            if self.ack_delay:
+                self.ack_pending = True
+                self.channel.call_later(self.ack_delay, self.send_ack)
+            else:
+                self.send_ack()
+
+    def send_ack(self):
+        self.ack_pending = False
+        ack = self.receiver.take_ack()
+        if ack is not None:
+            self.channel.transmit(DOWN, ack)
+
+    def handle_frame(self, frame):
+        receiver = self.receiver
+        if frame.type == FRAME_DATA:
+            response = receiver.handle_chunk(frame.seq, frame.offset, frame.payload, frame.crc, frame.flags)
+            if response is not None:
+                self.channel.transmit(DOWN, response)
+        elif frame.type == FRAME_META:
+            receiver.file_ext = bytes(frame.payload).decode()
+        elif frame.type == FRAME_CHUNK_SIZE:
+            receiver.note_chunk_size(frame.seq, int.from_bytes(frame.payload, 'big'))
+        elif frame.type == FRAME_EOT:
+            self.send_ack()
+            receiver.take_data()
+            self.completed.append(receiver.metrics())
+            self.last_metrics_lines = receiver.metrics_lines(snr_label='Empirical SNR')
+            receiver.reset()
+            self.channel.transmit(DOWN, pack_frame(FRAME_EOT))
+        elif frame.type == FRAME_ABORT:
+            receiver.reset()
+            self.channel.transmit(DOWN, pack_frame(FRAME_ABORT))
+
+
+def simulate(size, chunk_size=1024, window=1, mode='gbn', delay=0.001, bandwidth=100e6, ber=0.0, loss=0.0, seed=1,
+             adaptive_chunks=False, max_retries=MAX_RETRIES, log_event=None, fec=False, ack_every=ACK_EVERY, ack_delay=0.0):
+    """Transfer size bytes through a SimChannel; returns (success, sender, receiver end, channel).
+
+    The payload is an anonymous mmap, so even multi-gigabyte runs cost no memory for the data.
+    """
+    channel = SimChannel(delay, bandwidth, ber, loss, seed)
+    sock = SimSocket(channel)
+    receiver = ArqReceiver(None, log_event=log_event or (lambda msg: None), clock=channel.clock, sink_factory=NullSink,
+                           ack_every=ack_every)
+    receiver_end = SimReceiverEnd(channel, receiver, ack_delay)
+    sender = ArqSender(sock, window=window, mode=mode, max_retries=max_retries, log_event=log_event or (lambda msg: None),
+                       adaptive_chunks=adaptive_chunks, clock=channel.clock, fec=fec)
+    buffer = mmap.mmap(-1, size) if size else b''
+    with MappedChunks(buffer, chunk_size, mapping=buffer if size else None) as chunks:
+        success = sender.transmit(chunks)
+    return success, sender, receiver_end, channel
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Simulate an ARQ transfer over a virtual channel (no sockets, virtual time)')
+    parser.add_argument('--size', type=int, default=100 * 1024 * 1024, help='bytes to transfer')
+    parser.add_argument('--chunk-size', type=int, default=1024, help='(initial) chunk size in bytes')
+    parser.add_argument('--window', type=int, default=1, help='sliding window size (1 = stop-and-wait)')
+    parser.add_argument('--mode', choices=MODES, default='gbn', help='gbn = Go-Back-N, sr = Selective Repeat')
+    parser.add_argument('--delay', type=float, default=0.001, help='one-way propagation delay in seconds')
+    parser.add_argument('--bandwidth', type=float, default=100e6, help='link rate in bits/s, each direction')
+    parser.add_argument('--ber', type=float, default=0.0, help='probability of each payload bit being flipped')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability of a frame being lost (either direction)')
+    parser.add_argument('--adaptive-chunks', action='store_true', help='let the sender adapt the chunk size')
+    parser.add_argument('--fec', action='store_true', help='hybrid ARQ: send Hamming check bits with every chunk')
+    parser.add_argument('--ack-every', type=int, default=ACK_EVERY, help='in-order chunks one coalesced ACK may cover')
+    parser.add_argument('--ack-delay', type=float, default=0.0, help='seconds the receiver may hold a coalesced ACK')
+    parser.add_argument('--max-retries', type=int, default=MAX_RETRIES, help='attempts per chunk before aborting')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the channel errors and losses')
+    parser.add_argument('--verbose', action='store_true', help='print every sender and receiver event')
+    args = parser.parse_args()
+    if not 0 < args.chunk_size <= MAX_CHUNK_SIZE:
+        parser.error(f'--chunk-size must be between 1 and {MAX_CHUNK_SIZE} bytes')
+
+    start = time.perf_counter()
+    success, sender, receiver_end, channel = simulate(
+        args.size, args.chunk_size, args.window, args.mode, args.delay, args.bandwidth, args.ber, args.loss, args.seed,
+        args.adaptive_chunks, args.max_retries, log_event=print if args.verbose else None, fec=args.fec,
+        ack_every=args.ack_every, ack_delay=args.ack_delay)
+    wall = time.perf_counter() - start
+    print(f"Transfer {'complete' if success else 'aborted'}: {args.size} bytes, {len(sender.chunk_rtts)} chunks acknowledged")
+    print(f"Simulated {channel.now:.4f} s of channel time in {wall:.2f} s wall-clock")
+    print('Sender:')
+    for line in sender.metrics_lines():
+        print(f'  {line}')
+    if receiver_end.completed:
+        print('Receiver:')
+        for line in receiver_end.last_metrics_lines:
+            print(f'  {line}')
+    print(f"Channel: {channel.frames_lost} frames lost, {channel.bits_flipped} of {channel.payload_bits} payload bits flipped, "
+          f"channel SNR {snr_db(channel.payload_bits, channel.bits_flipped)} dB")
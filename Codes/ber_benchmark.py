@@ -0,0 +1,245 @@
+import argparse
+import csv
+import filecmp
+import itertools
+import json
+import math
+import os
+import random
+import socket
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from arq_logging import LOG_TRANSFERS
+from arq_protocol import FRAME_END, MAX_CHUNK_SIZE, pack_frame
+from arq_sender import ArqSender, MODES
+from channel_emulator import PROFILES, ChannelEmulator
+from file_chunker import open_chunks
+from server_engine import ServerEngine
+from udp_transport import DatagramSocket, max_datagram_chunk
+
+DEFAULT_BERS = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6]
+DEFAULT_CHUNK_SIZES = [512, 1024, 2048, 4096]
+DEFAULT_FILE_SIZES = [100 * 1024]
+SNR_PLOT_CAP = 100  # dB plotted for error-free runs (infinite SNR), as in the original Results plots
+
+FIELDS = ['ber', 'error_model', 'fec', 'chunk_size', 'file_size', 'window', 'mode', 'transport', 'link', 'delay', 'bandwidth',
+          'tcp_stall', 'repeat', 'seed',
+          'success', 'intact', 'time', 'throughput', 'integrity', 'snr_db', 'avg_rtt', 'chunks_sent', 'retransmissions',
+          'timeouts', 'chunks_corrected', 'frames_lost']
+
+# (file name, title, y label, result field) of the four plots in Results/
+PLOTS = [
+    ('throughput_vs_ber.png', 'Throughput vs. Bit Error Rate (BER)', 'Throughput (bytes/sec)', 'throughput'),
+    ('snr_vs_ber.png', 'SNR vs. Bit Error Rate (BER)', 'SNR (dB)', 'snr_db'),
+    ('data_integrity_vs_ber.png', 'Data Integrity Rate vs. Bit Error Rate (BER)', 'Data Integrity Rate', 'integrity'),
+    ('transmission_time_vs_ber.png', 'Transmission Time vs. Bit Error Rate (BER)', 'Transmission Time (seconds)', 'time'),
+]
+
+
+def run_point(point):
+    """One transfer over loopback, server and client in this process; returns a result row.
+
+    Runs in a pool worker, so every point gets its own server on a free port and its own
+    temporary directory for the input file, the received file and the server logs. With a link
+    profile, delay or bandwidth the client talks to the server through a ChannelEmulator. Over
+    UDP, server, emulator and client all use datagrams.
+    """
+    row = dict(point)
+    udp = point['transport'] == 'udp'
+    with tempfile.TemporaryDirectory(prefix='ber_benchmark_') as workdir:
+        input_path = os.path.join(workdir, 'input.bin')
+        with open(input_path, 'wb') as f:
+            f.write(random.Random(point['seed']).randbytes(point['file_size']))
+        results = []
+        engine = ServerEngine('127.0.0.1', 0, output_dir=os.path.join(workdir, 'out'), log_dir=os.path.join(workdir, 'logs'),
+                              on_log=None, on_transfer=results.append, verbosity=LOG_TRANSFERS, crc_every=0, udp=udp)
+        engine.start()
+        engine.ready.wait()
+        emulator = None
+        port = engine.port
+        if point['link'] is not None:
+            emulator = ChannelEmulator('127.0.0.1', 0, ('127.0.0.1', engine.port), profile=point['link'], seed=point['seed'],
+                                       on_log=None, delay=point['delay'], bandwidth=point['bandwidth'], udp=udp,
+                                       tcp_stall=point['tcp_stall'])
+            emulator.start()
+            emulator.ready.wait()
+            port = emulator.port
+        try:
+            with connect(port, udp) as sock:
+                per_bit = point['error_model'] == 'bit'
+                sender = ArqSender(sock, window=point['window'], mode=point['mode'], seed=point['seed'], fec=point['fec'],
+                                   error_prob=0.0 if per_bit else point['ber'], ber=point['ber'] if per_bit else 0.0,
+                                   log_event=lambda msg: None)
+                sender.announce_file_type('.bin')
+                with open_chunks(input_path, point['chunk_size']) as chunks:
+                    success = sender.transmit(chunks)
+                sock.sendall(pack_frame(FRAME_END))
+        finally:
+            if emulator is not None:
+                emulator.stop()
+                emulator.thread.join()
+            engine.stop()
+            engine.thread.join()
+        sent = sender.metrics()
+        received = results[-1] if results else None
+        row['success'] = success
+        row['intact'] = bool(success and received and received.path and filecmp.cmp(received.path, input_path, shallow=False))
+        # Channel-side numbers come from the receiver, as the Results plots always did
+        stats = received.stats if received and received.stats else {}
+        row['time'] = stats.get('time', sent['time'])
+        row['throughput'] = stats.get('throughput', 0.0)
+        row['integrity'] = stats.get('integrity', 0.0)
+        row['snr_db'] = stats.get('snr_db', math.nan)
+        row['avg_rtt'] = sent['avg_rtt']
+        row['chunks_sent'] = sent['chunks_sent']
+        row['retransmissions'] = sent['retransmissions']
+        row['timeouts'] = sent['timeouts']
+        row['chunks_corrected'] = stats.get('chunks_corrected', 0)
+        row['frames_lost'] = sum(totals['frames_lost'] for totals in emulator.stats().values()) if emulator else 0
+    return row
+
+
+def connect(port, udp):
+    if udp:
+        return DatagramSocket(('127.0.0.1', port))
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def sweep_points(args):
+    points = []
+    # Any link option puts the emulator in the path; on its own, --delay/--bandwidth start from a clean link
+    link = args.link or ('loopback' if args.delay is not None or args.bandwidth is not None else None)
+    for index, (file_size, chunk_size, ber, repeat) in enumerate(
+            itertools.product(args.file_sizes, args.chunk_sizes, args.ber, range(args.repeats))):
+        # Plain ARQ and FEC runs of a point share its seed, so they face the same channel
+        for fec in args.fec:
+            points.append({'ber': ber, 'error_model': args.error_model, 'fec': fec == 'on', 'chunk_size': chunk_size,
+                           'file_size': file_size, 'window': args.window, 'mode': args.mode,
+                           'transport': 'udp' if args.udp else 'tcp', 'link': link, 'delay': args.delay,
+                           'bandwidth': args.bandwidth, 'tcp_stall': None if args.udp else args.tcp_stall, 'repeat': repeat,
+                           'seed': args.seed + index})
+    return points
+
+
+def run_sweep(points, workers):
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_point, point) for point in points]
+        for done, future in enumerate(as_completed(futures), 1):
+            row = future.result()
+            rows.append(row)
+            status = 'ok' if row['intact'] else ('corrupt' if row['success'] else 'aborted')
+            print(f"[{done}/{len(points)}] BER {row['ber']:g} chunk {row['chunk_size']}{' FEC' if row['fec'] else ''} "
+                  f"file {row['file_size']} repeat {row['repeat']}: {status}, {row['throughput']:.0f} bytes/sec in {row['time']:.3f} s")
+    rows.sort(key=lambda row: (row['file_size'], row['chunk_size'], row['fec'], row['ber'], row['repeat']))
+    return rows
+
+
+def write_csv(rows, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_json(rows, path, args):
+    def clean(value):
+        # JSON has no Infinity/NaN; write them the way the metrics logs do
+        if isinstance(value, float) and math.isinf(value):
+            return 'Infinity'
+        if isinstance(value, float) and math.isnan(value):
+            return None
+        return value
+    with open(path, 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'config': vars(args),
+                   'results': [{key: clean(row[key]) for key in FIELDS} for row in rows]}, f, indent=2)
+
+
+def averaged(rows, field):
+    """{(file_size, chunk_size, fec): [(ber, mean)]} over the repeats that completed; aborted points are left out."""
+    series = {}
+    for (file_size, chunk_size, fec, ber), group in itertools.groupby(
+            rows, key=lambda r: (r['file_size'], r['chunk_size'], r['fec'], r['ber'])):
+        values = [row[field] for row in group if row['success']]
+        if field == 'snr_db':
+            values = [SNR_PLOT_CAP if math.isinf(value) else value for value in values]
+        if values:
+            series.setdefault((file_size, chunk_size, fec), []).append((ber, sum(values) / len(values)))
+    return series
+
+
+def plot_results(rows, out_dir):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('matplotlib is not installed; skipping the plots (the CSV/JSON results are written).')
+        return []
+    file_sizes = sorted({row['file_size'] for row in rows})
+    written = []
+    for name, title, ylabel, field in PLOTS:
+        series = averaged(rows, field)
+        for file_size in file_sizes:
+            fig, ax = plt.subplots(figsize=(10, 6))
+            for (size, chunk_size, fec), points in sorted(series.items()):
+                if size == file_size:
+                    ax.plot([ber for ber, _ in points], [value for _, value in points], marker='o',
+                            linestyle='--' if fec else '-', label=f"{chunk_size} bytes{' + FEC' if fec else ''}")
+            ax.set_title(title)
+            ax.set_xlabel('Bit Error Rate (BER)')
+            ax.set_ylabel(ylabel)
+            ax.grid(True)
+            ax.legend()
+            fig.tight_layout()
+            # One file size keeps the original file names; several get a size suffix each
+            path = os.path.join(out_dir, name if len(file_sizes) == 1 else name.replace('.png', f'_{file_size}B.png'))
+            fig.savefig(path, dpi=100)
+            plt.close(fig)
+            written.append(path)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sweep error probability, chunk size and file size over loopback and plot the results')
+    parser.add_argument('--ber', type=float, nargs='+', default=DEFAULT_BERS, help='error probabilities to sweep')
+    parser.add_argument('--error-model', choices=('chunk', 'bit'), default='chunk',
+                        help='chunk: --ber values are the chance of one flipped bit per chunk (as in the original plots); '
+                             'bit: they are true per-bit error rates, e.g. 1e-5')
+    parser.add_argument('--fec', choices=('off', 'on'), nargs='+', default=['off'],
+                        help='plain ARQ, hybrid ARQ with Hamming FEC, or both ("--fec off on") to compare them')
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=DEFAULT_CHUNK_SIZES, help='chunk sizes in bytes')
+    parser.add_argument('--file-sizes', type=int, nargs='+', default=DEFAULT_FILE_SIZES, help='file sizes in bytes (random data)')
+    parser.add_argument('--window', type=int, default=1, help='sliding window size (1 = stop-and-wait)')
+    parser.add_argument('--mode', choices=MODES, default='gbn', help='gbn = Go-Back-N, sr = Selective Repeat')
+    parser.add_argument('--udp', action='store_true', help='send datagrams over UDP instead of a TCP connection (emulator included)')
+    parser.add_argument('--link', choices=PROFILES, help='run every transfer through channel_emulator with this link profile')
+    parser.add_argument('--delay', type=float, help='one-way link delay in seconds (overrides the profile)')
+    parser.add_argument('--bandwidth', type=float, help='link rate in bits/s (overrides the profile)')
+    parser.add_argument('--tcp-stall', type=float, help='over TCP, let the emulator hold lost frames up this many seconds, '
+                                                         'as TCP does, instead of dropping them (see channel_emulator.py)')
+    parser.add_argument('--repeats', type=int, default=1, help='transfers per sweep point, averaged in the plots')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='parallel worker processes')
+    parser.add_argument('--seed', type=int, default=1, help='base seed for the data and the error injection')
+    parser.add_argument('--out-dir', default='Results', help='directory for results.csv, results.json and the plots')
+    parser.add_argument('--no-plots', action='store_true', help='only write the CSV/JSON results')
+    args = parser.parse_args()
+    max_chunk_size = max_datagram_chunk('on' in args.fec) if args.udp else MAX_CHUNK_SIZE
+    if not all(0 < size <= max_chunk_size for size in args.chunk_sizes):
+        parser.error(f'--chunk-sizes must be between 1 and {max_chunk_size} bytes' + (' over UDP' if args.udp else ''))
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    points = sweep_points(args)
+    print(f"Running {len(points)} transfers on {args.workers} workers")
+    start = time.perf_counter()
+    rows = run_sweep(points, args.workers)
+    print(f"Sweep finished in {time.perf_counter() - start:.1f} s")
+    write_csv(rows, os.path.join(args.out_dir, 'results.csv'))
+    write_json(rows, os.path.join(args.out_dir, 'results.json'), args)
+    print(f"Results written to {os.path.join(args.out_dir, 'results.csv')} and results.json")
+    if not args.no_plots:
+        for path in plot_results(rows, args.out_dir):
+            print(f"Plot written to {path}")
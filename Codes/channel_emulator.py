@@ -0,0 +1,471 @@
+import argparse
+import asyncio
+import collections
+import random
+import socket
+import threading
+from arq_protocol import FRAME_ACK, FRAME_DATA, FRAME_HEADER, FrameReader, ProtocolError
+from channel_noise import BitErrorChannel
+
+LISTEN_PORT = 65433
+TARGET = ('127.0.0.1', 65432)
+UP, DOWN = 0, 1  # client -> server, server -> client
+
+# Named link profiles: one-way delay (s), bandwidth (bits/s, 0 = unlimited) and Gilbert-Elliott burst parameters
+PROFILES = {
+    'loopback': {},
+    'lan': {'delay': 0.0005, 'bandwidth': 1e9},
+    'wan': {'delay': 0.02, 'bandwidth': 100e6},
+    'long-fat': {'delay': 0.05, 'bandwidth': 1e9},  # 100 ms RTT at 1 Gbit/s: a 12.5 MB bandwidth-delay product
+    'satellite': {'delay': 0.3, 'bandwidth': 20e6, 'p_good_bad': 0.001, 'p_bad_good': 0.1, 'ber_bad': 1e-5},
+    'wifi': {'delay': 0.002, 'bandwidth': 50e6, 'p_good_bad': 0.01, 'p_bad_good': 0.3, 'loss_bad': 0.3, 'ber_bad': 1e-4},
+}
+
+
+class GilbertElliott:
+    """Two-state burst error model, stepped once per frame.
+
+    The channel is either good or bad; it goes bad with probability p_good_bad and recovers
+    with probability p_bad_good after every frame, so bad bursts last 1 / p_bad_good frames on
+    average. Each state has its own frame loss probability and bit error rate.
+    """
+
+    def __init__(self, p_good_bad=0.0, p_bad_good=1.0, ber_good=0.0, ber_bad=0.0, loss_good=0.0, loss_bad=0.0, seed=None):
+        self.p_good_bad = p_good_bad
+        self.p_bad_good = p_bad_good
+        self.loss = (loss_good, loss_bad)
+        self.noise = (BitErrorChannel(ber_good, seed), BitErrorChannel(ber_bad, None if seed is None else seed + 1))
+        self.rng = random.Random(seed)
+        self.bad = False
+        self.frames = 0
+        self.bad_frames = 0
+        self.frames_lost = 0
+        self.frames_corrupted = 0
+
+    @property
+    def bits_flipped(self):
+        return sum(noise.bits_flipped for noise in self.noise)
+
+    def step(self):
+        if self.bad:
+            self.bad = self.rng.random() >= self.p_bad_good
+        else:
+            self.bad = self.rng.random() < self.p_good_bad
+        self.frames += 1
+        self.bad_frames += self.bad
+
+    def apply(self, frame, lossy=True, corruptible=True):
+        """The frame as it leaves the channel: None if lost, else with its payload possibly corrupted."""
+        self.step()
+        if lossy and self.rng.random() < self.loss[self.bad]:
+            self.frames_lost += 1
+            return None
+        if not corruptible:
+            return frame
+        end = len(frame) - 4  # the payload stops at the CRC trailer
+        noisy, flipped = self.noise[self.bad].corrupt(memoryview(frame)[FRAME_HEADER.size:end])
+        if not flipped:
+            return frame
+        self.frames_corrupted += 1
+        return frame[:FRAME_HEADER.size] + noisy + frame[end:]
+
+
+def impairment(frame, direction, control_loss=False):
+    """(may be lost, may be corrupted) for a frame going in direction.
+
+    Only DATA frames and per-chunk responses are impaired: the sender recovers from those with
+    its timeouts and retransmissions. Control frames (metadata, chunk size, EOT and its echo,
+    ABORT, END and their echoes) always arrive over TCP, since nothing would resend them; with
+    control_loss (the UDP relay, where the client repeats them until answered, or a TCP relay
+    with a stall, where TCP resends them) they can be lost too. Responses are never corrupted, because the sender does not check their CRC.
+    """
+    if len(frame) < FRAME_HEADER.size:
+        return False, False
+    if direction == UP:
+        return (True, True) if frame[0] == FRAME_DATA else (control_loss, False)
+    return frame[0] == FRAME_ACK or control_loss, False
+
+
+class Link:
+    """One direction of the emulated link: serialises frames at bandwidth bits/s and delivers them delay seconds later.
+
+    Frames are delivered in order through a single timer, so equal delivery times never
+    reorder them (asyncio's timer heap does not keep insertion order). With stall, a frame the
+    channel loses is delivered stall seconds late instead, and every frame behind it waits for
+    it: what a TCP connection does when it retransmits a lost segment itself.
+    """
+
+    def __init__(self, loop, direction, deliver, delay=0.0, bandwidth=0, channel=None, control_loss=False, stall=None):
+        self.loop = loop
+        self.direction = direction
+        self.control_loss = control_loss
+        self.stall = stall
+        self.deliver = deliver  # callable(frame bytes), or callable(None) to close
+        self.delay = delay
+        self.bandwidth = bandwidth
+        self.channel = channel
+        self.free = 0.0  # when the link finishes serialising its last frame
+        self.queue = collections.deque()  # (delivery time, frame or None)
+        self.timer = None
+        self.frames = 0
+        self.bytes = 0
+
+    def send(self, frame):
+        now = self.loop.time()
+        start = max(now, self.free)
+        self.free = start + len(frame) * 8 / self.bandwidth if self.bandwidth else start
+        self.frames += 1
+        self.bytes += len(frame)
+        when = self.free + self.delay
+        if self.channel is not None:
+            lossy, corruptible = impairment(frame, self.direction, self.control_loss)
+            if lossy or corruptible:
+                sent, frame = frame, self.channel.apply(frame, lossy, corruptible)
+                if frame is None:
+                    if self.stall is None:
+                        return
+                    frame = sent
+                    when += self.stall
+        self.schedule(when, frame)
+
+    def close(self):
+        # Behind every frame already queued, like a FIN
+        self.schedule(max(self.loop.time(), self.free) + self.delay, None)
+
+    def schedule(self, when, frame):
+        if self.queue:
+            when = max(when, self.queue[-1][0])
+        self.queue.append((when, frame))
+        if self.timer is None:
+            self.timer = self.loop.call_at(when, self.drain)
+
+    def drain(self):
+        self.timer = None
+        now = self.loop.time()
+        while self.queue and self.queue[0][0] <= now:
+            self.deliver(self.queue.popleft()[1])
+        if self.queue:
+            self.timer = self.loop.call_at(self.queue[0][0], self.drain)
+
+
+class FrameSplitter:
+    """Cuts a TCP byte stream back into whole frames, so they can be dropped or corrupted individually.
+
+    A stream that stops making sense (see arq_protocol.ProtocolError) cannot be cut any further;
+    on_error is called with the error and the rest of the stream is ignored.
+    """
+
+    def __init__(self, on_frame, on_error):
+        self.reader = FrameReader()
+        self.on_frame = on_frame
+        self.on_error = on_error
+        self.failed = False
+
+    def feed(self, data):
+        if self.failed:
+            return
+        reader = self.reader
+        if len(reader.buf) - reader.end < len(data):
+            reader.make_room(reader.end - reader.start + len(data))
+        reader.buf[reader.end:reader.end + len(data)] = data
+        reader.buffer_updated(len(data))
+        while True:
+            start = reader.start
+            try:
+                if reader.next_frame() is None:
+                    break
+            except ProtocolError as e:
+                self.failed = True
+                self.on_error(e)
+                break
+            self.on_frame(bytes(reader.view[start:reader.start]))
+
+
+class TcpProxySession(asyncio.Protocol):
+    """One client connection and its connection to the target, joined by an up and a down Link."""
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.loop = emulator.loop
+        self.client = None
+        self.server = None
+        self.pending = []  # client bytes that arrive before the target connection is up
+        self.up = emulator.make_link(UP, self.to_server)
+        self.down = emulator.make_link(DOWN, self.to_client)
+        self.up_frames = FrameSplitter(self.up.send, self.protocol_error)
+        self.down_frames = FrameSplitter(self.down.send, self.protocol_error)
+
+    def connection_made(self, transport):
+        self.client = transport
+        set_nodelay(transport)
+        self.emulator.sessions.add(self)
+        self.loop.create_task(self.connect())
+
+    async def connect(self):
+        try:
+            transport, _ = await self.loop.create_connection(lambda: TcpTargetProtocol(self), *self.emulator.target)
+        except OSError as e:
+            self.emulator.log(f'Cannot reach {self.emulator.target[0]}:{self.emulator.target[1]}: {e}')
+            self.client.close()
+            return
+        set_nodelay(transport)
+        self.server = transport
+        for data in self.pending:
+            self.up_frames.feed(data)
+        self.pending = None
+
+    def data_received(self, data):
+        if self.pending is not None:
+            self.pending.append(data)
+        else:
+            self.up_frames.feed(data)
+
+    def connection_lost(self, exc):
+        self.up.close()
+        self.emulator.sessions.discard(self)
+
+    def protocol_error(self, error):
+        self.emulator.log(f'Protocol error: {error}. Closing the connection.')
+        self.client.close()
+        if self.server is not None:
+            self.server.close()
+
+    def to_server(self, frame):
+        if self.server is None or self.server.is_closing():
+            return
+        if frame is None:
+            self.server.close()
+        else:
+            self.server.write(frame)
+
+    def to_client(self, frame):
+        if self.client.is_closing():
+            return
+        if frame is None:
+            self.client.close()
+        else:
+            self.client.write(frame)
+
+
+class TcpTargetProtocol(asyncio.Protocol):
+    def __init__(self, session):
+        self.session = session
+
+    def data_received(self, data):
+        self.session.down_frames.feed(data)
+
+    def connection_lost(self, exc):
+        self.session.down.close()
+
+
+class UdpRelay(asyncio.DatagramProtocol):
+    """Datagram mode: every datagram is one frame; each client address gets its own socket towards the target."""
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.transport = None
+        self.clients = {}  # client address -> (up link, target transport or None until connected, backlog)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        client = self.clients.get(addr)
+        if client is None:
+            client = self.clients[addr] = [None, None, []]
+            client[0] = self.emulator.make_link(UP, lambda frame: self.to_server(client, frame))
+            self.emulator.loop.create_task(self.connect(addr, client))
+        client[0].send(data)
+
+    async def connect(self, addr, client):
+        down = self.emulator.make_link(DOWN, lambda frame: self.to_client(addr, frame))
+        transport, _ = await self.emulator.loop.create_datagram_endpoint(
+            lambda: UdpTargetProtocol(down), remote_addr=self.emulator.target)
+        client[1] = transport
+        for frame in client[2]:
+            transport.sendto(frame)
+        client[2] = None
+
+    def to_client(self, addr, frame):
+        if frame is not None:
+            self.transport.sendto(frame, addr)
+
+    def to_server(self, client, frame):
+        if frame is None:
+            return
+        if client[1] is None:
+            client[2].append(frame)
+        else:
+            client[1].sendto(frame)
+
+
+class UdpTargetProtocol(asyncio.DatagramProtocol):
+    def __init__(self, down):
+        self.down = down
+
+    def datagram_received(self, data, addr):
+        self.down.send(data)
+
+
+def set_nodelay(transport):
+    sock = transport.get_extra_info('socket')
+    if sock is not None and sock.type == socket.SOCK_STREAM:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class ChannelEmulator:
+    """Proxy that puts an emulated link between a client and the server.
+
+    Each direction gets its own one-way delay, bandwidth cap and Gilbert-Elliott channel, with
+    the parameters of a PROFILES entry overridden by keyword arguments. Like ServerEngine it can
+    run on a background thread (start/stop, with ready set once listening), and with
+    listen_port=0 it picks a free port, which is how the benchmark scripts it.
+
+    Relaying TCP, a lost frame is dropped by default, so the ARQ recovers it as it would over
+    UDP. With tcp_stall, the loss happens under TCP instead: any frame, control frames included,
+    may be held up for tcp_stall seconds along with everything behind it (see Link), which is the
+    head-of-line blocking the UDP transport avoids.
+    """
+
+    def __init__(self, listen_host='127.0.0.1', listen_port=LISTEN_PORT, target=TARGET, udp=False, profile='loopback',
+                 seed=None, on_log=print, tcp_stall=None, **link):
+        settings = {'delay': 0.0, 'bandwidth': 0, 'p_good_bad': 0.0, 'p_bad_good': 1.0, 'ber_good': 0.0, 'ber_bad': 0.0,
+                    'loss_good': 0.0, 'loss_bad': 0.0}
+        settings.update(PROFILES[profile])
+        settings.update({key: value for key, value in link.items() if value is not None})
+        self.settings = settings
+        self.listen_host = listen_host
+        self.port = listen_port
+        self.target = target
+        self.udp = udp
+        self.tcp_stall = None if udp else tcp_stall
+        self.seed = seed
+        self.on_log = on_log
+        self.channels = []
+        self.sessions = set()
+        self.loop = None
+        self.stopping = None
+        self.thread = None
+        self.ready = threading.Event()  # set once listening; port then holds the bound port
+
+    def log(self, msg):
+        if self.on_log:
+            self.on_log(msg)
+
+    def make_link(self, direction, deliver):
+        s = self.settings
+        channel = None
+        if s['p_good_bad'] or s['ber_good'] or s['loss_good']:
+            seed = None if self.seed is None else self.seed + 2 * len(self.channels)
+            channel = GilbertElliott(s['p_good_bad'], s['p_bad_good'], s['ber_good'], s['ber_bad'], s['loss_good'],
+                                     s['loss_bad'], seed)
+            self.channels.append((direction, channel))
+        return Link(self.loop, direction, deliver, s['delay'], s['bandwidth'], channel,
+                    control_loss=self.udp or self.tcp_stall is not None, stall=self.tcp_stall)
+
+    def stats(self):
+        """Frames seen, lost and corrupted per direction, summed over all connections so far."""
+        totals = {}
+        for direction, channel in self.channels:
+            entry = totals.setdefault('up' if direction == UP else 'down',
+                                      {'frames': 0, 'bad_frames': 0, 'frames_lost': 0, 'frames_corrupted': 0, 'bits_flipped': 0})
+            for key in entry:
+                entry[key] += getattr(channel, key)
+        return totals
+
+    def describe(self):
+        s = self.settings
+        text = f"delay {s['delay'] * 1000:g} ms each way, bandwidth {s['bandwidth'] / 1e6:g} Mbit/s" if s['bandwidth'] \
+            else f"delay {s['delay'] * 1000:g} ms each way, unlimited bandwidth"
+        if s['p_good_bad'] or s['ber_good'] or s['loss_good']:
+            text += (f", Gilbert-Elliott p(G->B) {s['p_good_bad']:g} p(B->G) {s['p_bad_good']:g}, "
+                     f"loss {s['loss_good']:g}/{s['loss_bad']:g}, BER {s['ber_good']:g}/{s['ber_bad']:g} (good/bad)")
+        if self.tcp_stall is not None:
+            text += f", lost frames held up {self.tcp_stall * 1000:g} ms by TCP"
+        return text
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        if self.udp:
+            transport, _ = await self.loop.create_datagram_endpoint(lambda: UdpRelay(self),
+                                                                    local_addr=(self.listen_host, self.port))
+            self.port = transport.get_extra_info('sockname')[1]
+            server = None
+        else:
+            server = await self.loop.create_server(lambda: TcpProxySession(self), self.listen_host, self.port,
+                                                   reuse_address=True)
+            self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.log(f"Emulating {self.describe()} on {'UDP' if self.udp else 'TCP'} {self.listen_host}:{self.port} "
+                 f"-> {self.target[0]}:{self.target[1]}")
+        try:
+            await self.stopping.wait()
+        finally:
+            if server is not None:
+                server.close()
+                for session in list(self.sessions):
+                    session.client.close()
+                    if session.server is not None:
+                        session.server.close()
+            else:
+                transport.close()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def start(self):
+        """Run on a background thread, e.g. inside the benchmark."""
+        self.thread = threading.Thread(target=self.run_logged, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def run_logged(self):
+        try:
+            self.run()
+        except OSError as e:
+            self.log(f'Emulator error: {e}')
+        finally:
+            self.ready.set()
+
+    def stop(self):
+        if self.loop is not None and self.stopping is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Emulate a slow, lossy link between client.py and server.py')
+    parser.add_argument('--listen', default=f'127.0.0.1:{LISTEN_PORT}', help='address the client connects to (host:port)')
+    parser.add_argument('--target', default=f'{TARGET[0]}:{TARGET[1]}', help='address of the server (host:port)')
+    parser.add_argument('--udp', action='store_true', help='relay datagrams instead of a TCP stream')
+    parser.add_argument('--profile', choices=PROFILES, default='loopback', help='starting point for the link settings below')
+    parser.add_argument('--delay', type=float, help='one-way delay in seconds')
+    parser.add_argument('--bandwidth', type=float, help='bits/s in each direction (0 = unlimited)')
+    parser.add_argument('--p-good-bad', type=float, help='per-frame probability of a good channel turning bad')
+    parser.add_argument('--p-bad-good', type=float, help='per-frame probability of a bad channel recovering')
+    parser.add_argument('--ber-good', type=float, help='bit error rate while good')
+    parser.add_argument('--ber-bad', type=float, help='bit error rate while bad')
+    parser.add_argument('--loss-good', type=float, help='frame loss probability while good')
+    parser.add_argument('--loss-bad', type=float, help='frame loss probability while bad')
+    parser.add_argument('--tcp-stall', type=float, help='relaying TCP, deliver lost frames this many seconds late, holding up '
+                                                         'the frames behind them, instead of dropping them')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the channel state, losses and bit errors')
+    args = parser.parse_args()
+
+    listen_host, listen_port = parse_address(args.listen)
+    emulator = ChannelEmulator(listen_host, listen_port, parse_address(args.target), udp=args.udp, profile=args.profile,
+                               seed=args.seed, tcp_stall=args.tcp_stall, delay=args.delay, bandwidth=args.bandwidth, p_good_bad=args.p_good_bad,
+                               p_bad_good=args.p_bad_good, ber_good=args.ber_good, ber_bad=args.ber_bad,
+                               loss_good=args.loss_good, loss_bad=args.loss_bad)
+    try:
+        emulator.run()
+    except KeyboardInterrupt:
+        pass
+    for direction, totals in emulator.stats().items():
+        print(f"{direction}: {totals['frames']} frames, {totals['bad_frames']} in bad state, {totals['frames_lost']} lost, "
+              f"{totals['frames_corrupted']} corrupted ({totals['bits_flipped']} bits flipped)")
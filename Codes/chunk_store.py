@@ -0,0 +1,94 @@
+import hashlib
+import struct
+from collections import OrderedDict
+from arq_protocol import MAX_CHUNK_SIZE, MAX_PAYLOAD
+
+HASH_SIZE = 32  # BLAKE2b-256
+DEDUP_OFFER = struct.Struct('!QII')  # file size, chunk size, index of the first chunk offered; the chunk hashes follow
+OFFER_BATCH = (MAX_PAYLOAD - DEDUP_OFFER.size) // HASH_SIZE  # hashes per offer frame
+STORE_BYTES = 64 * 1024 * 1024  # default capacity of the server's chunk store
+
+
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).digest()
+
+
+def pack_offer(size, chunk_size, first, hashes):
+    return DEDUP_OFFER.pack(size, chunk_size, first) + b''.join(hashes)
+
+
+def unpack_offer(payload):
+    """(file size, chunk size, first chunk index, list of chunk hashes) from a client's FRAME_DEDUP payload.
+
+    Raises ValueError for an offer pack_offer() would not make: a chunk size outside
+    1..MAX_CHUNK_SIZE, a partial hash, or hashes that do not cover the file's chunks from first on
+    in batches of OFFER_BATCH.
+    """
+    payload = bytes(payload)
+    if len(payload) < DEDUP_OFFER.size or (len(payload) - DEDUP_OFFER.size) % HASH_SIZE:
+        raise ValueError(f'{len(payload)}-byte offer is not a header and whole hashes')
+    size, chunk_size, first = DEDUP_OFFER.unpack_from(payload)
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f'Chunk size {chunk_size} out of range')
+    count = (len(payload) - DEDUP_OFFER.size) // HASH_SIZE
+    chunks = -(-size // chunk_size)
+    if first % OFFER_BATCH or count != min(OFFER_BATCH, chunks - first):
+        raise ValueError(f'{count} hashes from chunk {first} do not fit a {size}-byte file of {chunks} chunks')
+    return size, chunk_size, first, [payload[start:start + HASH_SIZE] for start in range(DEDUP_OFFER.size, len(payload), HASH_SIZE)]
+
+
+def pack_held(held):
+    """The server's reply: bit i (little-endian) is set if it had chunk i."""
+    bitmap = 0
+    for index, present in enumerate(held):
+        if present:
+            bitmap |= 1 << index
+    return bitmap.to_bytes((len(held) + 7) // 8, 'little')
+
+
+def unpack_held(payload, count):
+    bitmap = int.from_bytes(payload, 'little')
+    return [bool(bitmap >> index & 1) for index in range(count)]
+
+
+class ChunkStore:
+    """Content-addressed chunks in memory, keyed by their BLAKE2b hash.
+
+    Every chunk the server stores is put here too; once the chunks add up to more than capacity
+    bytes, the least recently used ones are evicted. One store is shared by all the sessions of
+    a server (they run on one event loop thread, so it needs no lock).
+    """
+
+    def __init__(self, capacity=STORE_BYTES):
+        self.capacity = capacity
+        self.chunks = OrderedDict()  # hash -> bytes, least recently used first
+        self.size = 0
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def put(self, data):
+        if len(data) > self.capacity:
+            return
+        key = chunk_hash(data)
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return
+        self.chunks[key] = bytes(data)
+        self.size += len(data)
+        while self.size > self.capacity:
+            _, evicted = self.chunks.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def get(self, key):
+        self.lookups += 1
+        data = self.chunks.get(key)
+        if data is not None:
+            self.hits += 1
+            self.chunks.move_to_end(key)
+        return data
+
+    def metrics_line(self):
+        return (f"Chunk store: {len(self.chunks)} chunks, {self.size} of {self.capacity} bytes, {self.evictions} evicted, "
+                f"{self.hits} of {self.lookups} lookups hit")
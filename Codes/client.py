@@ -1,80 +1,107 @@
+import argparse
 import socket
 import os
-import random
-import time
-from crc_utils import crc32
-from file_chunker import file_chunker
+from arq_logging import LOG_CHUNKS, LOG_ERRORS, VERBOSITY, BackgroundLogger
+from file_chunker import MappedChunks, open_chunks
+from arq_protocol import FRAME_END, FRAME_META, MAX_CHUNK_SIZE, pack_frame
+from arq_metrics import MetricsEndpoint, MetricsRegistry
+from arq_sender import ArqSender, MODES, TIMEOUT, MAX_RETRIES
+from resume import file_id
+from stage_timing import dump_profile, start_profile
+from striping import send_striped, striped_metrics_lines
+from udp_transport import DatagramSocket, max_datagram_chunk
+from compression import available_codecs, worth_compressing
 
 PORT = 65432
 CHUNK_SIZE = 1024
-TIMEOUT = 3  # seconds
-MAX_RETRIES = 5
-END_SIGNAL = b'__END__'
-EOT_SIGNAL = b'__EOT__'
 LOG_DIR = 'Log Files/Client Logs'
 LOG_FILE = os.path.join(LOG_DIR, 'transmission_log.txt')
 CRC_LOG_FILE = os.path.join(LOG_DIR, 'crc_log.txt')
 METRICS_LOG_FILE = os.path.join(LOG_DIR, 'metrics_log.txt')
 
+parser = argparse.ArgumentParser(description='Stop-and-Wait / Go-Back-N / Selective Repeat ARQ client')
+parser.add_argument('--port', type=int, default=PORT, help='server port (e.g. a channel_emulator.py proxy in front of it)')
+parser.add_argument('--udp', action='store_true', help='send datagrams over UDP, so this ARQ is the only reliability layer (the server needs --udp too)')
+parser.add_argument('--window', type=int, default=1, help='sliding window size (1 = stop-and-wait)')
+parser.add_argument('--mode', choices=MODES, default='gbn', help='gbn = Go-Back-N, sr = Selective Repeat')
+parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='(initial) chunk size in bytes')
+parser.add_argument('--adaptive-chunk-size', action='store_true', help='adapt the chunk size to the error rate and RTT instead of keeping it')
+parser.add_argument('--fec', action='store_true', help='send Hamming check bits so the server can repair single-bit errors without a retransmission')
+parser.add_argument('--compress', choices=available_codecs(), help='compress chunks that get smaller (skipped for JPEG, MP3, MP4 and other compressed types)')
+parser.add_argument('--compress-level', type=int, default=None, help='compression level for --compress (default depends on the codec)')
+parser.add_argument('--streams', type=int, default=1, help='send files as this many stripes over parallel connections')
+parser.add_argument('--dedup', action='store_true', help="offer chunk hashes first and send only the chunks missing from the server's chunk store")
+parser.add_argument('--no-resume', action='store_true', help='send every file in full instead of resuming from what the server kept of an earlier attempt')
+parser.add_argument('--log-level', choices=VERBOSITY, default='chunks', help='transfers, errors (adds retries) or chunks (every chunk)')
+parser.add_argument('--ber', type=float, default=0.0, help='per-bit error rate of the simulated channel (replaces the per-chunk error prompt)')
+parser.add_argument('--seed', type=int, default=None, help='seed for the simulated channel errors')
+parser.add_argument('--crc-log-every', type=int, default=1, help='log the CRC of every Nth chunk (0 = no CRC log)')
+parser.add_argument('--stage-times', action='store_true', help='break each transfer down by stage (read, CRC, send, wait, log...) in the metrics log')
+parser.add_argument('--profile', action='store_true', help='run each transfer under cProfile and write its stats next to the logs')
+parser.add_argument('--metrics-port', type=int, default=None, help='serve live Prometheus metrics at http://127.0.0.1:PORT/metrics (0 = any free port)')
+args = parser.parse_args()
+max_chunk_size = max_datagram_chunk(args.fec) if args.udp else MAX_CHUNK_SIZE  # a DATA frame must fit in one datagram
+if not 0 < args.chunk_size <= max_chunk_size:
+    parser.error(f'--chunk-size must be between 1 and {max_chunk_size} bytes' + (' over UDP' if args.udp else ''))
+if args.udp:
+    # Striping, deduplication and resuming need TCP: their requests and replies do not fit in a datagram
+    if args.streams > 1 or args.dedup:
+        print('--streams and --dedup need TCP; sending over one UDP stream without deduplication')
+    args.streams, args.dedup, args.no_resume = 1, False, True
+if args.profile and args.streams > 1:
+    print('--profile only covers text and files sent over one stream (stripes run on threads of their own)')
+
 server_ip = input('Enter the server IP address: ').strip()
 
+def connect():
+    if args.udp:
+        return DatagramSocket((server_ip, args.port), timeout=TIMEOUT)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT)
+    sock.connect((server_ip, args.port))
+    # Pipelined chunks must not wait behind Nagle's algorithm
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
 try:
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(TIMEOUT)
-    s.connect((server_ip, PORT))
-    print(f"Successfully connected to server at {server_ip}:{PORT}")
+    s = connect()
+    print(f"Successfully connected to server at {server_ip}:{args.port}")
 except Exception as e:
-    print(f"Failed to connect to server at {server_ip}:{PORT}. Error: {e}")
+    print(f"Failed to connect to server at {server_ip}:{args.port}. Error: {e}")
     exit(1)
 
 # Create log directory and clear logs only when client is actually run
 os.makedirs(LOG_DIR, exist_ok=True)
-open(LOG_FILE, 'w').close()
-open(CRC_LOG_FILE, 'w').close()
-open(METRICS_LOG_FILE, 'w').close()
+logger = BackgroundLogger(LOG_FILE, CRC_LOG_FILE, METRICS_LOG_FILE, verbosity=VERBOSITY[args.log_level],
+                          crc_every=args.crc_log_every)
+registry = None
+if args.metrics_port is not None:
+    registry = MetricsRegistry()
+    metrics_endpoint = MetricsEndpoint(registry, port=args.metrics_port).start()
+    print(f"Metrics at http://127.0.0.1:{metrics_endpoint.port}/metrics")
+profiles_written = 0
 
 def is_file(path):
     return os.path.isfile(path)
 
 def get_chunks(input_data, is_binary_file):
     if is_binary_file:
-        return list(file_chunker(input_data, CHUNK_SIZE))
+        return open_chunks(input_data, args.chunk_size)
     else:
-        data = input_data.encode()
-        return [data[i:i+CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
-
-def flip_random_bit(data):
-    if not data:
-        return data
-    idx = random.randint(0, len(data) - 1)
-    bit = 1 << random.randint(0, 7)
-    flipped = bytearray(data)
-    flipped[idx] ^= bit
-    return bytes(flipped)
-
-def log_event(logf, msg):
-    logf.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {msg}\n")
-    logf.flush()
-
-def log_crc(crcf, chunk_num, crc):
-    crcf.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | Chunk {chunk_num}: CRC sent: {crc:08X}\n")
-    crcf.flush()
+        return MappedChunks(input_data.encode(), args.chunk_size)
 
-def log_metrics(metricsf, metrics_lines):
-    for line in metrics_lines:
-        metricsf.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {line}\n")
-    metricsf.flush()
+def log_crc(chunk_num, crc):
+    if logger.sample_crc():
+        logger.crc(f"Chunk {chunk_num}: CRC sent: {crc:08X}")
 
-with s, \
-     open(LOG_FILE, 'a') as logf, \
-     open(CRC_LOG_FILE, 'a') as crcf, \
-     open(METRICS_LOG_FILE, 'a') as metricsf:
+with s:
     while True:
         input_data = input('Enter text or file path (or type END to finish): ').strip()
         if input_data.upper() == 'END':
-            s.sendall(END_SIGNAL)
+            s.sendall(pack_frame(FRAME_END))
             print('Session ended by user.')
-            log_event(logf, 'Session ended by user.')
+            logger.log('Session ended by user.')
+            logger.close()
             break
         is_binary_file = is_file(input_data)
         if is_binary_file:
@@ -85,93 +112,72 @@ with s, \
             print("Detected text input.")
         chunks = get_chunks(input_data, is_binary_file)
         total_chunks = len(chunks)
-        print(f"Total chunks to send: {total_chunks}")
+        print(f"Total chunks to send: {total_chunks}" + (' (at the initial chunk size)' if args.adaptive_chunk_size else ''))
         # Error simulation
-        error_prob = input('Enter bit error probability per chunk (0 for none): ').strip()
-        try:
-            error_prob = float(error_prob)
-        except ValueError:
+        if args.ber:
             error_prob = 0.0
-        log_event(logf, f"Transmission started: {input_data} | Chunks: {total_chunks} | Error prob: {error_prob}")
-        chunk_num = 0
-        total_bytes_acked = 0
-        total_chunks_sent = 0
-        unique_chunks_acked = set()
-        start_time = time.time()
-        chunk_rtts = []
-        # SNR counters
-        total_bits_sent = 0
-        error_bits = 0
-        while chunk_num < total_chunks:
-            chunk = chunks[chunk_num]
-            retries = 0
-            while retries < MAX_RETRIES:
-                crc = crc32(chunk)
-                log_crc(crcf, chunk_num, crc)
-                send_chunk = chunk
-                # Simulate random bit error
-                bit_error_introduced = False
-                if error_prob > 0 and random.random() < error_prob:
-                    send_chunk = flip_random_bit(send_chunk)
-                    log_event(logf, f"Chunk {chunk_num}: Bit error introduced.")
-                    bit_error_introduced = True
-                send_time = time.time()
-                s.sendall(send_chunk + crc.to_bytes(4, 'big'))
-                log_event(logf, f"Chunk {chunk_num}: Sent (retry {retries+1})")
-                total_chunks_sent += 1
-                total_bits_sent += len(send_chunk) * 8
-                if bit_error_introduced:
-                    error_bits += 8  # 1 bit flipped per chunk
+            logger.log(f"Transmission started: {input_data} | Chunks: {total_chunks} | BER: {args.ber} | Window: {args.window} | Mode: {args.mode}")
+        else:
+            error_prob = input('Enter bit error probability per chunk (0 for none): ').strip()
+            try:
+                error_prob = float(error_prob)
+            except ValueError:
+                error_prob = 0.0
+            logger.log(f"Transmission started: {input_data} | Chunks: {total_chunks} | Error prob: {error_prob} | Window: {args.window} | Mode: {args.mode}")
+        compression = args.compress if worth_compressing(file_type if is_binary_file else None) else None
+        if args.compress and not compression:
+            print(f"{file_type} files are compressed already; sending without --compress")
+        def make_sender(sock, index=0):
+            # Each stream of a striped transfer gets its own noise, seeded apart from the others
+            return ArqSender(sock, window=args.window, mode=args.mode, error_prob=error_prob, ber=args.ber,
+                             seed=None if args.seed is None else args.seed + index, timeout=TIMEOUT, max_retries=MAX_RETRIES,
+                             log_event=logger.at(LOG_ERRORS) or (lambda msg: None), log_chunk=logger.at(LOG_CHUNKS),
+                             log_crc=log_crc if logger.crc_enabled() else None,
+                             adaptive_chunks=args.adaptive_chunk_size, fec=args.fec,
+                             compression=compression, compression_level=args.compress_level, registry=registry,
+                             timing=args.stage_times)
+        with chunks:
+            if is_binary_file and chunks.size and args.streams > 1:
+                if file_type:
+                    s.sendall(pack_frame(FRAME_META, file_type.encode()))
+                extra = []
+                try:
+                    for _ in range(args.streams - 1):
+                        extra.append(connect())
+                except OSError as e:
+                    print(f"Opened {len(extra) + 1} of {args.streams} connections ({e})")
                 try:
-                    resp = s.recv(1024)
-                    ack_time = time.time()
-                    resp_decoded = resp.decode()
-                    log_event(logf, f"Chunk {chunk_num}: Server response: {resp_decoded}")
-                    if resp_decoded.startswith('ACK'):
-                        chunk_num += 1
-                        total_bytes_acked += len(chunk)
-                        unique_chunks_acked.add(chunk_num)
-                        chunk_rtts.append(ack_time - send_time)
-                        break
-                    else:
-                        log_event(logf, f"Chunk {chunk_num}: NACK received. Retrying.")
-                except socket.timeout:
-                    log_event(logf, f"Chunk {chunk_num}: Timeout waiting for ACK/NACK. Retrying.")
-                retries += 1
+                    success, senders = send_striped([s] + extra, chunks, file_type, make_sender,
+                                                    logger.at(LOG_ERRORS) or (lambda msg: None))
+                finally:
+                    for sock in extra:
+                        try:
+                            sock.sendall(pack_frame(FRAME_END))
+                        except OSError:
+                            pass
+                        sock.close()
+                metrics_lines = striped_metrics_lines(senders)
             else:
-                print(f"Chunk {chunk_num}: Failed after {MAX_RETRIES} attempts. Aborting.")
-                log_event(logf, f"Chunk {chunk_num}: Failed after {MAX_RETRIES} attempts. Aborting.")
-                break
-        end_time = time.time()
-        s.sendall(EOT_SIGNAL)
+                sender = make_sender(s)
+                profile = start_profile() if args.profile else None
+                if is_binary_file and file_type:
+                    sender.announce_file_type(file_type)
+                if is_binary_file and chunks.size and args.dedup:
+                    chunks = sender.dedup(chunks)
+                elif is_binary_file and chunks.size and not args.no_resume:
+                    chunks = sender.resume(file_id(input_data), chunks)
+                success = sender.transmit(chunks)
+                metrics_lines = sender.metrics_lines()
+                if profile is not None:
+                    profiles_written += 1
+                    print(f"Profile written to {dump_profile(profile, LOG_DIR, f'profile_{profiles_written}')}")
+        if not success:
+            print(f"Transfer failed after {MAX_RETRIES} attempts on one chunk. Aborted.")
         print('Transmission complete for this message/file.')
-        log_event(logf, f"Transmission complete for {input_data}.")
+        logger.log(f"Transmission complete for {input_data}.")
         # Metrics
-        duration = end_time - start_time if end_time > start_time else 1
-        throughput = total_bytes_acked / duration
-        data_integrity_rate = (len(unique_chunks_acked) / total_chunks_sent) if total_chunks_sent else 0
-        avg_rtt = sum(chunk_rtts) / len(chunk_rtts) if chunk_rtts else 0
-        # SNR calculation
-        if error_bits == 0:
-            snr_db = 'Infinity'
-        else:
-            correct_bits = total_bits_sent - error_bits
-            snr = correct_bits / error_bits if error_bits > 0 else 0
-            snr_db = f"{10 * (snr if snr > 0 else 0):.2f}" if snr > 0 else '0.00'
-            import math
-            if snr > 0:
-                snr_db = f"{10 * math.log10(snr):.2f}"
-            else:
-                snr_db = '0.00'
-        snr_line = f"Simulated SNR: {snr_db} dB (Total bits: {total_bits_sent}, Error bits: {error_bits})"
-        print(snr_line)
-        metrics_lines = [
-            f"Total transmission time: {duration:.4f} seconds",
-            f"Throughput: {throughput:.2f} bytes/sec",
-            f"Data Integrity Rate: {data_integrity_rate:.4f}",
-            f"Average RTT: {avg_rtt:.4f} seconds",
-            snr_line
-        ]
         for line in metrics_lines:
             print(line)
-        log_metrics(metricsf, metrics_lines) 
\ No newline at end of file
+        logger.metrics(metrics_lines)
+        # EOT or ABORT has gone out: make sure this transfer's lines are on disk
+        logger.flush()
@@ -2,10 +2,16 @@ import tkinter as tk
 from tkinter import filedialog, scrolledtext, messagebox
 import threading
 import os
-import time
-import random
-from crc_utils import crc32
-from file_chunker import file_chunker
+from arq_logging import LOG_CHUNKS, LOG_ERRORS, LOG_TRANSFERS, BackgroundLogger
+from file_chunker import MappedChunks, open_chunks
+from arq_protocol import FRAME_END, FRAME_META, pack_frame
+from arq_sender import ArqSender, TIMEOUT, MAX_RETRIES
+from resume import file_id
+from stage_timing import dump_profile, start_profile
+from striping import send_striped, striped_metrics_lines
+from compression import available_codecs, worth_compressing
+from udp_transport import DatagramSocket
+from ui_bridge import UiBridge
 import socket
 from PIL import Image, ImageTk
 import sys
@@ -15,25 +21,33 @@ import pygame
 
 
 CHUNK_SIZE = 1024
-
-TIMEOUT = 3
-MAX_RETRIES = 5
-END_SIGNAL = b'__END__'
-EOT_SIGNAL = b'__EOT__'
-ABORT_SIGNAL = b'__ABORT__'
 LOG_DIR = 'Log Files/Client Logs'
 LOG_FILE = os.path.join(LOG_DIR, 'transmission_log.txt')
 CRC_LOG_FILE = os.path.join(LOG_DIR, 'crc_log.txt')
 METRICS_LOG_FILE = os.path.join(LOG_DIR, 'metrics_log.txt')
+LOG_LEVEL = LOG_CHUNKS  # LOG_TRANSFERS / LOG_ERRORS / LOG_CHUNKS, for the log file and the log area alike
+CRC_LOG_EVERY = 1       # log the CRC of every Nth chunk (0 = no CRC log)
+STAGE_TIMES = False     # break each transfer down by stage (read, CRC, send, wait, log...) in the metrics log
+PROFILE = False         # run each single-stream transfer under cProfile; stats go next to the logs
+UDP = False             # send datagrams over UDP (one stream, no resume or dedup); the server needs UDP too
 PORT = 65432
+ARQ_MODES = {'Go-Back-N': 'gbn', 'Selective Repeat': 'sr'}
 class ClientGUI:
     def __init__(self, root):
         self.root = root
         self.root.title('Stop-and-Wait ARQ Client')
         self.file_path = None
         self.is_binary_file = False
+        self.profiles_written = 0
         self.server_ip = tk.StringVar()
         self.error_prob = tk.StringVar(value='0')
+        self.window_size = tk.StringVar(value='1')
+        self.arq_mode = tk.StringVar(value='Go-Back-N')
+        self.adaptive_chunks = tk.BooleanVar(value=False)
+        self.fec = tk.BooleanVar(value=False)
+        self.dedup = tk.BooleanVar(value=False)
+        self.streams = tk.StringVar(value='1')
+        self.compression = tk.StringVar(value='Off')
         self.input_text = tk.StringVar()
         self.connected = False
         self.s = None
@@ -77,14 +91,35 @@ class ClientGUI:
         self.error_entry = tk.Entry(frame, textvariable=self.error_prob, width=10, state='disabled')
         self.error_entry.grid(row=4, column=1, sticky='w')
 
+        # ARQ options
+        self.options_frame = tk.Frame(frame)
+        self.options_frame.grid(row=6, column=0, columnspan=3, sticky='w', pady=5)
+        tk.Label(self.options_frame, text='Window Size (1 = Stop-and-Wait):').pack(side='left')
+        self.window_entry = tk.Entry(self.options_frame, textvariable=self.window_size, width=6)
+        self.window_entry.pack(side='left')
+        tk.Label(self.options_frame, text='ARQ Mode:').pack(side='left', padx=(10, 0))
+        self.mode_menu = tk.OptionMenu(self.options_frame, self.arq_mode, *ARQ_MODES)
+        self.mode_menu.pack(side='left')
+        tk.Checkbutton(self.options_frame, text='Adaptive chunk size', variable=self.adaptive_chunks).pack(side='left', padx=(10, 0))
+        tk.Checkbutton(self.options_frame, text='FEC', variable=self.fec).pack(side='left', padx=(10, 0))
+        tk.Checkbutton(self.options_frame, text='Dedup', variable=self.dedup).pack(side='left', padx=(10, 0))
+        tk.Label(self.options_frame, text='Compression:').pack(side='left', padx=(10, 0))
+        tk.OptionMenu(self.options_frame, self.compression, 'Off', *available_codecs()).pack(side='left')
+        tk.Label(self.options_frame, text='Streams:').pack(side='left', padx=(10, 0))
+        tk.Entry(self.options_frame, textvariable=self.streams, width=4).pack(side='left')
+
         # Start/End buttons
         self.start_btn = tk.Button(frame, text='Start Transmission', command=self.start_transmission, state='disabled')
         self.start_btn.grid(row=5, column=0, pady=5)
         tk.Button(frame, text='End Session', command=self.end_session).grid(row=5, column=1, pady=5, sticky='w')
         tk.Button(frame, text='Performance Logs', command=self.show_logs_window).grid(row=5, column=2, pady=5, sticky='w')
 
+        self.progress_label = tk.Label(self.root, anchor='w', justify='left')
+        self.progress_label.pack(padx=10, fill='x')
         self.log_area = scrolledtext.ScrolledText(self.root, width=80, height=20, state='disabled')
         self.log_area.pack(padx=10, pady=10)
+        # The transfer thread never touches Tk itself: it goes through the bridge, drained by the main loop
+        self.ui = UiBridge(self.root, self.log_area, self.progress_label)
 
     def connect_to_server(self):
         ip = self.server_ip.get().strip()
@@ -108,9 +143,14 @@ class ClientGUI:
         try:
             if self.s:
                 self.s.close()
-            self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.s.settimeout(TIMEOUT)
-            self.s.connect((ip, PORT))
+            if UDP:
+                self.s = DatagramSocket((ip, PORT), timeout=TIMEOUT)
+            else:
+                self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.s.settimeout(TIMEOUT)
+                self.s.connect((ip, PORT))
+                # Pipelined chunks must not wait behind Nagle's algorithm
+                self.s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         except Exception as e:
             self.connected = False
             messagebox.showerror('Error', f'Failed to connect to server: {e}')
@@ -293,15 +333,10 @@ class ClientGUI:
             pass
 
     def log(self, msg):
-        self.log_area.config(state='normal')
-        self.log_area.insert('end', msg + '\n')
-        self.log_area.see('end')
-        self.log_area.config(state='disabled')
+        self.ui.log(msg)
 
     def clear_logs(self):
-        self.log_area.config(state='normal')
-        self.log_area.delete('1.0', 'end')
-        self.log_area.config(state='disabled')
+        self.ui.clear()
 
     def start_transmission(self):
         if not self.connected:
@@ -318,6 +353,21 @@ class ClientGUI:
         except ValueError:
             messagebox.showerror('Error', 'Error probability must be a number between 0 and 1.')
             return
+        try:
+            window = int(self.window_size.get())
+            if window < 1:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror('Error', 'Window size must be a positive integer.')
+            return
+        mode = ARQ_MODES[self.arq_mode.get()]
+        try:
+            streams = int(self.streams.get())
+            if streams < 1:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror('Error', 'Streams must be a positive integer.')
+            return
         # Ensure only one of text or file is selected
         if self.file_path and self.input_text.get():
             messagebox.showerror('Error', 'Please provide either text or a file, not both.')
@@ -326,14 +376,6 @@ class ClientGUI:
             input_data = self.file_path
             is_binary_file = True
             info_msg = f"Preparing to send file: {os.path.basename(self.file_path)}"
-            # If mp3, send extension as metadata before file data
-            ext = os.path.splitext(self.file_path)[1].lower()
-            if ext == '.mp3' and self.s:
-                try:
-                    ext_bytes = ext.encode().ljust(8, b' ')
-                    self.s.sendall(ext_bytes)
-                except Exception:
-                    pass
         else:
             input_data = self.input_text.get()
             is_binary_file = False
@@ -341,138 +383,123 @@ class ClientGUI:
                 messagebox.showerror('Error', 'Please enter text to send.')
                 return
             info_msg = "Preparing to send text message."
-        # Clear all log files before each new transmission
-        open(LOG_FILE, 'w').close()
-        open(CRC_LOG_FILE, 'w').close()
-        open(METRICS_LOG_FILE, 'w').close()
+        # A fresh logger clears all log files before each new transmission
+        self.logger = BackgroundLogger(LOG_FILE, CRC_LOG_FILE, METRICS_LOG_FILE, verbosity=LOG_LEVEL, crc_every=CRC_LOG_EVERY)
         self.clear_logs()  # Clear GUI log area before each transmission
         self.log(info_msg)
-        with open(LOG_FILE, 'a') as f:
-            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {info_msg}\n")
-        threading.Thread(target=self.transmit, args=(ip, input_data, is_binary_file, error_prob), daemon=True).start()
+        self.logger.log(info_msg)
+        threading.Thread(target=self.transmit, args=(ip, input_data, is_binary_file, error_prob, window, mode, self.adaptive_chunks.get(),
+                                                     self.fec.get(), streams,
+                                                     None if self.compression.get() == 'Off' else self.compression.get(),
+                                                     self.dedup.get()),
+                         daemon=True).start()
 
-    def transmit(self, server_ip, input_data, is_binary_file, error_prob):
+    def transmit(self, server_ip, input_data, is_binary_file, error_prob, window=1, mode='gbn', adaptive_chunks=False, use_fec=False,
+                 streams=1, compression=None, dedup=False):
         self.transmitting = True
         # Use the persistent socket self.s for all transmissions
         if not self.s:
             self.log('No connection to server. Please connect first.')
             self.transmitting = False
             return
-        def log_event(msg):
-            self.log(msg)
-            with open(LOG_FILE, 'a') as f:
-                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {msg}\n")
+        logger = self.logger
+        def log_event(msg, level=LOG_TRANSFERS):
+            if logger.enabled(level):
+                # Routine per-chunk lines only show on the progress label, coalesced
+                (self.ui.chunk if level == LOG_CHUNKS else self.log)(msg)
+                logger.log(msg, level)
+        def log_chunk(msg):
+            log_event(msg, LOG_CHUNKS)
         def log_crc(chunk_num, crc):
-            with open(CRC_LOG_FILE, 'a') as f:
-                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | Chunk {chunk_num}: CRC sent: {crc:08X}\n")
-        def log_metrics(metrics_lines):
-            with open(METRICS_LOG_FILE, 'a') as f:
-                for line in metrics_lines:
-                    f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {line}\n")
+            if logger.sample_crc():
+                logger.crc(f"Chunk {chunk_num}: CRC sent: {crc:08X}")
         def get_chunks(input_data, is_binary_file):
             if is_binary_file:
-                return list(file_chunker(input_data, CHUNK_SIZE))
+                return open_chunks(input_data, CHUNK_SIZE)
             else:
-                data = input_data.encode()
-                return [data[i:i+CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+                return MappedChunks(input_data.encode(), CHUNK_SIZE)
         chunks = get_chunks(input_data, is_binary_file)
         total_chunks = len(chunks)
         self.log(f"Total chunks to send: {total_chunks}")
-        log_event(f"Transmission started: {input_data} | Chunks: {total_chunks} | Error prob: {error_prob}")
-        chunk_num = 0
-        total_bytes_acked = 0
-        total_chunks_sent = 0
-        unique_chunks_acked = set()
-        start_time = time.time()
-        chunk_rtts = []
-        # SNR counters
-        total_bits_sent = 0
-        error_bits = 0
-        transfer_success = True
-        while chunk_num < total_chunks:
-            chunk = chunks[chunk_num]
-            retries = 0
-            while retries < MAX_RETRIES:
-                crc = crc32(chunk)
-                log_crc(chunk_num, crc)
-                send_chunk = chunk
-                bit_error_introduced = False
-                if error_prob > 0 and random.random() < error_prob:
-                    send_chunk = self.flip_random_bit(send_chunk)
-                    log_event(f"Chunk {chunk_num}: Bit error introduced.")
-                    bit_error_introduced = True
-                send_time = time.time()
-                try:
-                    self.s.sendall(send_chunk + crc.to_bytes(4, 'big'))
-                except Exception as e:
-                    log_event(f"Send error: {e}")
-                    self.transmitting = False
-                    return
-                log_event(f"Chunk {chunk_num}: Sent (retry {retries+1})")
-                total_chunks_sent += 1
-                total_bits_sent += len(send_chunk) * 8
-                if bit_error_introduced:
-                    error_bits += 8  # 1 bit flipped per chunk
-                try:
-                    resp = self.s.recv(1024)
-                    ack_time = time.time()
-                    resp_decoded = resp.decode()
-                    log_event(f"Chunk {chunk_num}: Server response: {resp_decoded}")
-                    if resp_decoded.startswith('ACK'):
-                        chunk_num += 1
-                        total_bytes_acked += len(chunk)
-                        unique_chunks_acked.add(chunk_num)
-                        chunk_rtts.append(ack_time - send_time)
-                        break
+        log_event(f"Transmission started: {input_data} | Chunks: {total_chunks} | Error prob: {error_prob} | Window: {window} | Mode: {mode}")
+        if UDP:
+            # Striping, deduplication and resuming need TCP: their requests and replies do not fit in a datagram
+            streams, dedup = 1, False
+        if compression and is_binary_file and not worth_compressing(os.path.splitext(input_data)[1]):
+            log_event(f"{os.path.splitext(input_data)[1]} files are compressed already; sending uncompressed")
+            compression = None
+        senders = []  # every sender of this transfer, for the progress label
+        def make_sender(sock, index=0):
+            sender = ArqSender(sock, window=window, mode=mode, error_prob=error_prob, timeout=TIMEOUT, max_retries=MAX_RETRIES,
+                               log_event=lambda msg: log_event(msg, LOG_ERRORS),
+                               log_chunk=log_chunk if logger.enabled(LOG_CHUNKS) else None,
+                               log_crc=log_crc if logger.crc_enabled() else None, adaptive_chunks=adaptive_chunks, fec=use_fec,
+                               compression=compression, timing=STAGE_TIMES)
+            senders.append(sender)
+            return sender
+        total_bytes = chunks.size
+        self.ui.track(lambda: (sum(s.resumed_bytes + s.dedup_bytes + s.total_bytes_acked for s in senders), total_bytes))
+        ext = os.path.splitext(input_data)[1].lower() if is_binary_file else ''
+        def connect():
+            sock = socket.create_connection((server_ip, PORT), timeout=TIMEOUT)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        try:
+            try:
+                with chunks:
+                    if is_binary_file and chunks.size and streams > 1:
+                        # Send the file extension as metadata before file data
+                        if ext:
+                            self.s.sendall(pack_frame(FRAME_META, ext.encode()))
+                        # One stripe per connection; the extra connections last for this transfer only
+                        extra = []
+                        try:
+                            for _ in range(streams - 1):
+                                extra.append(connect())
+                            transfer_success, senders = send_striped([self.s] + extra, chunks, ext,
+                                                                     make_sender, lambda msg: log_event(msg, LOG_ERRORS))
+                        finally:
+                            for sock in extra:
+                                try:
+                                    sock.sendall(pack_frame(FRAME_END))
+                                except OSError:
+                                    pass
+                                sock.close()
+                        metrics_lines = striped_metrics_lines(senders)
                     else:
-                        log_event(f"Chunk {chunk_num}: NACK received. Retrying.")
-                except socket.timeout:
-                    log_event(f"Chunk {chunk_num}: Timeout waiting for ACK/NACK. Retrying.")
-                retries += 1
+                        sender = make_sender(self.s)
+                        profile = start_profile() if PROFILE else None
+                        if ext:
+                            sender.announce_file_type(ext)
+                        if is_binary_file and chunks.size and dedup:
+                            chunks = sender.dedup(chunks)
+                        elif is_binary_file and chunks.size and not UDP:
+                            chunks = sender.resume(file_id(input_data), chunks)
+                        transfer_success = sender.transmit(chunks)
+                        metrics_lines = sender.metrics_lines()
+                        if profile is not None:
+                            self.profiles_written += 1
+                            log_event(f"Profile written to {dump_profile(profile, LOG_DIR, f'profile_{self.profiles_written}')}")
+            except Exception as e:
+                log_event(f"Send error: {e}")
+                return
+            # Show transfer status only
+            if transfer_success:
+                self.show_status_message('Transfer complete.', 'green')
             else:
-                self.log(f"Chunk {chunk_num}: Failed after {MAX_RETRIES} attempts. Aborting.")
-                log_event(f"Chunk {chunk_num}: Failed after {MAX_RETRIES} attempts. Aborting.")
-                transfer_success = False
-                # Send abort signal to server
-                try:
-                    self.s.sendall(ABORT_SIGNAL)
-                except Exception:
-                    pass
-                break
-        end_time = time.time()
-        try:
-            if transfer_success and chunk_num == total_chunks:
-                self.s.sendall(EOT_SIGNAL)
-        except Exception:
-            pass
-        # Show transfer status only
-        if transfer_success and chunk_num == total_chunks:
-            self.show_status_message('Transfer complete.', 'green')
-        else:
-            self.show_status_message('Transfer failed.', 'red')
-        log_event(f"Transmission complete for {input_data}.")
-        # Metrics (do not display in main log area)
-        duration = end_time - start_time if end_time > start_time else 1
-        throughput = total_bytes_acked / duration
-        data_integrity_rate = (len(unique_chunks_acked) / total_chunks_sent) if total_chunks_sent else 0
-        avg_rtt = sum(chunk_rtts) / len(chunk_rtts) if chunk_rtts else 0
-        import math
-        if error_bits == 0:
-            snr_db = 'Infinity'
-        else:
-            correct_bits = total_bits_sent - error_bits
-            snr = correct_bits / error_bits if error_bits > 0 else 0
-            snr_db = f"{10 * math.log10(snr):.2f}" if snr > 0 else '0.00'
-        snr_line = f"Simulated SNR: {snr_db} dB (Total bits: {total_bits_sent}, Error bits: {error_bits})"
-        metrics_lines = [
-            f"Total transmission time: {duration:.4f} seconds",
-            f"Throughput: {throughput:.2f} bytes/sec",
-            f"Data Integrity Rate: {data_integrity_rate:.4f}",
-            f"Average RTT: {avg_rtt:.4f} seconds",
-            snr_line
-        ]
-        log_metrics(metrics_lines)
-        self.transmitting = False
+                self.show_status_message('Transfer failed.', 'red')
+            log_event(f"Transmission complete for {input_data}.")
+            # Metrics (do not display in main log area)
+            logger.metrics(metrics_lines)
+        finally:
+            # EOT or ABORT has gone out, or the send failed: write this transfer's logs out, release
+            # the files and give the controls back either way
+            self.ui.track(None)
+            logger.close()
+            self.transmitting = False
+            self.ui.call(self.ready_for_next)
+
+    def ready_for_next(self):
         # Reset input fields for next transmission, but stay connected
         self.connected = True
         self.connect_btn.config(state='disabled')
@@ -487,19 +514,10 @@ class ClientGUI:
         self.file_label.config(text='No file selected')
         self.update_send_choice()
 
-    def flip_random_bit(self, data):
-        if not data:
-            return data
-        idx = random.randint(0, len(data) - 1)
-        bit = 1 << random.randint(0, 7)
-        flipped = bytearray(data)
-        flipped[idx] ^= bit
-        return bytes(flipped)
-
     def end_session(self):
         if self.s:
             try:
-                self.s.sendall(END_SIGNAL)
+                self.s.sendall(pack_frame(FRAME_END))
             except Exception:
                 pass
             self.s.close()
@@ -545,12 +563,7 @@ class ClientGUI:
                 text.pack()
 
     def show_status_message(self, message, color):
-        self.log_area.config(state='normal')
-        self.log_area.insert('end', message + '\n')
-        self.log_area.tag_add('status', 'end-2l', 'end-1l')
-        self.log_area.tag_config('status', foreground=color, font=('Arial', 12, 'bold'))
-        self.log_area.see('end')
-        self.log_area.config(state='disabled')
+        self.ui.status(message, color)
 
 if __name__ == '__main__':
     root = tk.Tk()
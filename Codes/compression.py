@@ -0,0 +1,161 @@
+import lzma
+import time
+import zlib
+from arq_protocol import MAX_CHUNK_SIZE
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # LZ4 is optional; zlib and lzma are always there
+    lz4_frame = None
+
+DEFAULT_LEVELS = {'zlib': 6, 'lzma': 1, 'lz4': 0}
+MIN_SAVING = 0.05  # a chunk is sent compressed only if that saves at least this fraction of it
+PROBE_AFTER = 8  # chunks in a row that do not compress before the compressor only samples each chunk first
+PROBE_SIZE = 512  # bytes of a chunk sampled at the fastest zlib level
+LZMA_DICT_SIZE = 64 * 1024  # plenty for one chunk, and cheap for the decoder to allocate
+
+# Formats that are compressed already: zlib only burns CPU on them
+INCOMPRESSIBLE_TYPES = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.m4a', '.aac', '.ogg', '.flac', '.mkv',
+                        '.webm', '.avi', '.mov', '.zip', '.gz', '.bz2', '.xz', '.7z', '.rar', '.pdf', '.docx', '.xlsx'}
+
+
+def lzma_filters(level=None):
+    # The dictionary size is fixed, so the decoder does not need to know the encoder's preset
+    if level is None:
+        return [{'id': lzma.FILTER_LZMA2, 'dict_size': LZMA_DICT_SIZE}]
+    return [{'id': lzma.FILTER_LZMA2, 'preset': level, 'dict_size': LZMA_DICT_SIZE}]
+
+
+def compress_raw(codec, data, level):
+    # Raw streams, without the containers' headers and checksums: the frame CRC covers the data
+    if codec == 'zlib':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+    if codec == 'lzma':
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=lzma_filters(level))
+    return lz4_frame.compress(data, compression_level=level, content_checksum=False)
+
+
+def decompress_raw(codec, data, max_length):
+    """Decompress one chunk; raises ValueError if it is incomplete or would exceed max_length bytes.
+
+    The decoder stops one byte past max_length, so a small payload that would expand to
+    gigabytes (a decompression bomb) costs no more than a chunk.
+    """
+    if codec == 'zlib':
+        decompressor = zlib.decompressobj(-15)
+    elif codec == 'lzma':
+        decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=lzma_filters())
+    else:
+        decompressor = lz4_frame.LZ4FrameDecompressor()
+    chunk = decompressor.decompress(data, max_length + 1)
+    if len(chunk) > max_length:
+        raise ValueError(f'Decompresses to more than {max_length} bytes')
+    if not decompressor.eof:
+        raise ValueError('Incomplete compressed data')
+    return chunk
+
+
+def available_codecs():
+    return tuple(codec for codec in DEFAULT_LEVELS if codec != 'lz4' or lz4_frame is not None)
+
+
+def worth_compressing(file_ext):
+    """False for file types that are compressed already (JPEG, MP3, MP4, archives, ...)."""
+    return (file_ext or '').lower() not in INCOMPRESSIBLE_TYPES
+
+
+class ChunkCompressor:
+    """Compresses chunks one at a time for the sender, and keeps the numbers for its metrics.
+
+    A chunk is sent compressed only if that saves at least MIN_SAVING of it. After PROBE_AFTER
+    chunks in a row that did not, each chunk's first PROBE_SIZE bytes are compressed at the
+    fastest zlib level first, and the chunk is only compressed in full if that sample shrinks.
+    Incompressible stretches of a file then cost little CPU, and compression picks up again as
+    soon as the data changes. cpu_time is the compressing thread's CPU time.
+    """
+
+    def __init__(self, codec='zlib', level=None):
+        if codec not in available_codecs():
+            raise ValueError(f'Unknown or unavailable codec: {codec}')
+        self.codec = codec
+        self.level = DEFAULT_LEVELS[codec] if level is None else level
+        self.bytes_in = 0  # bytes of every chunk offered
+        self.bytes_out = 0  # bytes sent for them, compressed or not
+        self.chunks_compressed = 0
+        self.chunks_raw = 0
+        self.cpu_time = 0.0
+        self.misses = 0  # chunks in a row that did not compress
+        self.chunks_probed_out = 0  # chunks sent raw on the strength of a sample alone
+
+    def compress(self, chunk):
+        """Returns (bytes to send, whether they are compressed)."""
+        self.bytes_in += len(chunk)
+        start = time.thread_time()
+        packed = None
+        if self.misses < PROBE_AFTER or self.probe(chunk):
+            packed = compress_raw(self.codec, chunk, self.level)
+        else:
+            self.chunks_probed_out += 1
+        self.cpu_time += time.thread_time() - start
+        if packed is None or len(packed) > len(chunk) * (1 - MIN_SAVING):
+            self.misses += 1
+            return self.raw(chunk)
+        self.misses = 0
+        self.chunks_compressed += 1
+        self.bytes_out += len(packed)
+        return packed, True
+
+    @staticmethod
+    def probe(chunk):
+        sample = chunk[:PROBE_SIZE]
+        compressor = zlib.compressobj(1, zlib.DEFLATED, -15)
+        return len(compressor.compress(sample) + compressor.flush()) <= len(sample) * (1 - MIN_SAVING)
+
+    def raw(self, chunk):
+        self.chunks_raw += 1
+        self.bytes_out += len(chunk)
+        return chunk, False
+
+    def ratio(self):
+        return self.bytes_in / self.bytes_out if self.bytes_out else 1.0
+
+    def describe(self):
+        return f'{self.codec} level {self.level}'
+
+    def metrics_line(self):
+        return (f"Compression: {self.describe()}, {self.chunks_compressed} of {self.chunks_compressed + self.chunks_raw} chunks "
+                f"compressed ({self.chunks_probed_out} skipped after a sample), {self.bytes_in} -> {self.bytes_out} bytes "
+                f"(ratio {self.ratio():.2f}), CPU time {self.cpu_time:.4f} s")
+
+
+class ChunkDecompressor:
+    """The receiver's side of a ChunkCompressor; decompress() returns None for data that does not decode
+    to at most the chunk size the sender announced."""
+
+    def __init__(self, codec):
+        if codec not in available_codecs():
+            raise ValueError(f'Unknown or unavailable codec: {codec}')
+        self.codec = codec
+        self.bytes_in = 0  # compressed bytes received
+        self.bytes_out = 0  # what they decompressed to
+        self.chunks = 0
+        self.cpu_time = 0.0
+
+    def decompress(self, data, max_length=MAX_CHUNK_SIZE):
+        start = time.thread_time()
+        try:
+            chunk = decompress_raw(self.codec, data, max_length)
+        except (zlib.error, lzma.LZMAError, RuntimeError, ValueError):
+            return None
+        finally:
+            self.cpu_time += time.thread_time() - start
+        self.chunks += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(chunk)
+        return chunk
+
+    def metrics_line(self):
+        ratio = self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+        return (f"Compression: {self.codec}, {self.chunks} chunks decompressed, {self.bytes_in} -> {self.bytes_out} bytes "
+                f"(ratio {ratio:.2f}), CPU time {self.cpu_time:.4f} s")
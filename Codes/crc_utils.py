@@ -1,25 +1,116 @@
-import zlib
-
-def crc16_ccitt(data: bytes, poly: int = 0x1021, init_crc: int = 0xFFFF) -> int:
-    crc = init_crc
-    for byte in data:
-        crc ^= (byte << 8)
-        for _ in range(8):
-            if crc & 0x8000:
-                crc = (crc << 1) ^ poly
-            else:
-                crc <<= 1
-            crc &= 0xFFFF  # Keep CRC 16-bit
-    return crc
-
-def crc32(data: bytes) -> int:
-    return zlib.crc32(data) & 0xFFFFFFFF
-
-# Example usage:
-if __name__ == "__main__":
-    user_input = input("Enter data to calculate CRC-16-CCITT and CRC32: ")
-    data = user_input.encode()
-    crc16 = crc16_ccitt(data)
-    crc32_val = crc32(data)
-    print(f"CRC-16-CCITT of '{user_input}': {crc16:04X}")
-    print(f"CRC32 of '{user_input}': {crc32_val:08X}") 
\ No newline at end of file
+import binascii
+import struct
+import zlib
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; batches fall back to the per-chunk loop
+    np = None
+
+CRC16_POLY = 0x1021
+CRC16_INIT = 0xFFFF
+
+
+def crc16_ccitt_bitwise(data: bytes, poly: int = CRC16_POLY, init_crc: int = CRC16_INIT) -> int:
+    # Reference implementation: eight shift/xor steps per byte
+    crc = init_crc
+    for byte in data:
+        crc ^= (byte << 8)
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ poly
+            else:
+                crc <<= 1
+            crc &= 0xFFFF  # Keep CRC 16-bit
+    return crc
+
+
+@lru_cache(maxsize=None)
+def crc16_tables(poly: int = CRC16_POLY, slices: int = 8) -> tuple:
+    # tables[k][x] is the CRC (init 0) of byte x followed by k zero bytes
+    base = tuple(crc16_ccitt_bitwise(bytes([i]), poly, 0) for i in range(256))
+    tables = [base]
+    for _ in range(1, slices):
+        prev = tables[-1]
+        tables.append(tuple(((c << 8) & 0xFFFF) ^ base[c >> 8] for c in prev))
+    return tuple(tables)
+
+
+def crc16_ccitt_table(data: bytes, poly: int = CRC16_POLY, init_crc: int = CRC16_INIT) -> int:
+    table = crc16_tables(poly)[0]
+    crc = init_crc
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def crc16_ccitt_sliced(data: bytes, poly: int = CRC16_POLY, init_crc: int = CRC16_INIT) -> int:
+    # Slicing-by-8: one lookup per byte, but one loop iteration per 8 bytes
+    t0, t1, t2, t3, t4, t5, t6, t7 = crc16_tables(poly, 8)
+    crc = init_crc
+    head = len(data) - len(data) % 8
+    for b0, b1, b2, b3, b4, b5, b6, b7 in struct.iter_unpack('8B', memoryview(data)[:head]):
+        crc = (t7[(crc >> 8) ^ b0] ^ t6[(crc & 0xFF) ^ b1] ^ t5[b2] ^ t4[b3]
+               ^ t3[b4] ^ t2[b5] ^ t1[b6] ^ t0[b7])
+    for byte in memoryview(data)[head:]:
+        crc = ((crc << 8) & 0xFFFF) ^ t0[(crc >> 8) ^ byte]
+    return crc
+
+
+def crc16_ccitt(data: bytes, poly: int = CRC16_POLY, init_crc: int = CRC16_INIT) -> int:
+    if poly == CRC16_POLY:
+        # binascii.crc_hqx is the same MSB-first CRC-CCITT, table-driven in C
+        return binascii.crc_hqx(data, init_crc)
+    return crc16_ccitt_sliced(data, poly, init_crc)
+
+
+def crc16_ccitt_numpy(chunks, poly: int = CRC16_POLY, init_crc: int = CRC16_INIT) -> list:
+    """CRC-16 of equal-length chunks, one table step per byte column across all chunks at once."""
+    if not chunks:
+        return []
+    table = np.array(crc16_tables(poly)[0], dtype=np.uint16)
+    matrix = np.frombuffer(b''.join(chunks), dtype=np.uint8).reshape(len(chunks), -1)
+    crc = np.full(len(chunks), init_crc, dtype=np.uint16)
+    for column in matrix.T:
+        crc = (crc << 8) ^ table[(crc >> 8) ^ column]
+    return crc.tolist()
+
+
+def crc16_ccitt_batch(chunks, poly: int = CRC16_POLY, init_crc: int = CRC16_INIT, use_numpy=None) -> list:
+    """CRC-16 of every chunk, in order.
+
+    use_numpy=None picks the NumPy path when it is installed and there is no C implementation
+    for the polynomial; chunks are grouped by length for it.
+    """
+    if use_numpy is None:
+        use_numpy = np is not None and poly != CRC16_POLY
+    if not use_numpy:
+        return [crc16_ccitt(chunk, poly, init_crc) for chunk in chunks]
+    if np is None:
+        raise RuntimeError('NumPy is not installed')
+    by_length = {}
+    for i, chunk in enumerate(chunks):
+        by_length.setdefault(len(chunk), []).append(i)
+    result = [0] * len(chunks)
+    for indices in by_length.values():
+        for i, crc in zip(indices, crc16_ccitt_numpy([chunks[i] for i in indices], poly, init_crc)):
+            result[i] = crc
+    return result
+
+
+def crc32(data: bytes) -> int:
+    return zlib.crc32(data) & 0xFFFFFFFF
+
+
+def crc32_batch(chunks) -> list:
+    return [zlib.crc32(chunk) & 0xFFFFFFFF for chunk in chunks]
+
+# Example usage:
+if __name__ == "__main__":
+    user_input = input("Enter data to calculate CRC-16-CCITT and CRC32: ")
+    data = user_input.encode()
+    crc16 = crc16_ccitt(data)
+    crc32_val = crc32(data)
+    print(f"CRC-16-CCITT of '{user_input}': {crc16:04X}")
+    print(f"CRC32 of '{user_input}': {crc32_val:08X}")
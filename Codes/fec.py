@@ -0,0 +1,72 @@
+from functools import lru_cache
+
+FEC_BLOCK = 256  # data bytes per Hamming block: one bit error per block can be corrected
+PARITY_SIZE = 2  # bytes of check bits per block (up to 15 syndrome bits and the overall parity)
+
+
+@lru_cache(maxsize=None)
+def syndrome_masks(block_size):
+    """Bit masks over a block read as a little-endian integer: mask j selects the bits whose position has bit j set."""
+    masks = []
+    for j in range((block_size * 8 - 1).bit_length()):
+        if j < 3:
+            pattern = bytes([(0xAA, 0xCC, 0xF0)[j]]) * block_size
+        else:
+            pattern = bytes(0xFF if k & (1 << (j - 3)) else 0 for k in range(block_size))
+        masks.append(int.from_bytes(pattern, 'little'))
+    return tuple(masks)
+
+
+def check_bits(value, masks):
+    # Hamming syndrome (XOR of the positions of all set bits) and overall parity, packed as syndrome << 1 | parity
+    syndrome = 0
+    for j, mask in enumerate(masks):
+        syndrome |= ((value & mask).bit_count() & 1) << j
+    return syndrome << 1 | (value.bit_count() & 1)
+
+
+def parity_length(data_length, block_size=FEC_BLOCK):
+    return -(-data_length // block_size) * PARITY_SIZE
+
+
+def encode(data, block_size=FEC_BLOCK):
+    """Check bits for data: PARITY_SIZE bytes per block_size bytes, to be sent after it."""
+    masks = syndrome_masks(block_size)
+    view = memoryview(data)
+    return b''.join(check_bits(int.from_bytes(view[start:start + block_size], 'little'), masks).to_bytes(PARITY_SIZE, 'big')
+                    for start in range(0, len(view), block_size))
+
+
+def split(payload, block_size=FEC_BLOCK):
+    """Separate a received payload into (data, check bits)."""
+    blocks = -(-len(payload) // (block_size + PARITY_SIZE))
+    data_length = len(payload) - blocks * PARITY_SIZE
+    return payload[:data_length], payload[data_length:]
+
+
+def repair(data, parity, block_size=FEC_BLOCK):
+    """Correct single-bit errors in each block of data (SECDED Hamming code).
+
+    Returns (data, bits corrected), or (None, 0) when a block holds an error the code can only
+    detect. A block with three or more errors can be miscorrected, so callers still verify the
+    result with the chunk's CRC.
+    """
+    masks = syndrome_masks(block_size)
+    view = memoryview(data)
+    repaired = None
+    corrected = 0
+    for index, start in enumerate(range(0, len(view), block_size)):
+        block = view[start:start + block_size]
+        value = int.from_bytes(block, 'little')
+        sent = int.from_bytes(parity[index * PARITY_SIZE:(index + 1) * PARITY_SIZE], 'big')
+        diff = check_bits(value, masks) ^ sent
+        if not diff:
+            continue
+        position = diff >> 1
+        if not diff & 1 or position >= len(block) * 8:
+            return None, 0  # an even number of errors (or a corrupted check field): detectable only
+        if repaired is None:
+            repaired = bytearray(data)
+        repaired[start + position // 8] ^= 1 << (position % 8)
+        corrected += 1
+    return (bytes(repaired) if repaired is not None else data), corrected
@@ -1,13 +1,143 @@
-def file_chunker(file_path, chunk_size=1024):
-    with open(file_path, 'rb') as f:
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            yield chunk
-
-if __name__ == "__main__":
-    path = input("Enter file path to chunk: ")
-    size = int(input("Enter chunk size (bytes): ") or 1024)
-    for i, chunk in enumerate(file_chunker(path, size)):
-        print(f"Chunk {i} (size {len(chunk)}): {chunk[:32]}{'...' if len(chunk) > 32 else ''}") 
\ No newline at end of file
+import mmap
+from bisect import bisect_right
+
+
+def file_chunker(file_path, chunk_size=1024):
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class MappedChunks:
+    """Chunks served lazily as memoryview slices, without copying the data.
+
+    The buffer is an mmap of the file (see open_chunks) or any bytes-like object, e.g. an encoded
+    text message. Nothing is read until a chunk is sent, and the OS pages the file in on demand.
+
+    Chunks are chunk_size bytes, but resize() can change the size for every chunk from a given
+    index on, so a sender can adapt it mid-transfer while chunks already sent keep their bounds.
+    """
+
+    def __init__(self, buffer, chunk_size=1024, mapping=None, file=None):
+        self.view = memoryview(buffer)
+        self.chunk_size = chunk_size
+        self.size = len(self.view)
+        self.mapping = mapping
+        self.file = file
+        # (first index, first offset, chunk size) of each run of equal-sized chunks
+        self.segments = [(0, 0, chunk_size)]
+        self.segment_starts = [0]
+        self.count = self.chunk_count()
+
+    def chunk_count(self):
+        first_index, first_offset, chunk_size = self.segments[-1]
+        return first_index + (max(self.size - first_offset, 0) + chunk_size - 1) // chunk_size
+
+    def segment(self, index):
+        return self.segments[bisect_right(self.segment_starts, index) - 1]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        if len(self.segments) == 1:
+            start = index * self.chunk_size
+            return self.view[start:start + self.chunk_size]
+        first_index, first_offset, chunk_size = self.segment(index)
+        start = first_offset + (index - first_index) * chunk_size
+        return self.view[start:start + chunk_size]
+
+    def offset(self, index):
+        first_index, first_offset, chunk_size = self.segment(index)
+        return first_offset + (index - first_index) * chunk_size
+
+    def resize(self, chunk_size, from_index):
+        """Use chunk_size for chunk from_index and every chunk after it."""
+        if chunk_size == self.segment(from_index)[2]:
+            return
+        offset = self.offset(from_index)
+        while self.segments[-1][0] >= from_index:
+            self.segments.pop()
+            self.segment_starts.pop()
+            if not self.segments:
+                break
+        self.segments.append((from_index, offset, chunk_size))
+        self.segment_starts.append(from_index)
+        self.chunk_size = chunk_size
+        self.count = self.chunk_count()
+
+    def select(self, ranges):
+        """Only the chunks covering the given (start, end) byte ranges, e.g. what a resumed transfer still has to send."""
+        return RangeChunks(self, ranges)
+
+    def close(self):
+        try:
+            self.view.release()
+            if self.mapping is not None:
+                self.mapping.close()
+        except BufferError:
+            pass  # a chunk view is still referenced somewhere; the mapping is freed with it
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RangeChunks:
+    """Chunks over some byte ranges of a MappedChunks buffer, at the parent's current chunk size.
+
+    Chunks keep their offsets in the whole buffer and never span two ranges. There is no resize(),
+    so a sender keeps the chunk size fixed for them.
+    """
+
+    def __init__(self, parent, ranges):
+        self.parent = parent
+        self.view = parent.view
+        self.size = parent.size
+        self.chunk_size = parent.chunk_size
+        self.bounds = [(offset, min(offset + self.chunk_size, end))
+                       for start, end in ranges for offset in range(start, end, self.chunk_size)]
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def __getitem__(self, index):
+        start, end = self.bounds[index]
+        return self.view[start:end]
+
+    def offset(self, index):
+        return self.bounds[index][0]
+
+    def close(self):
+        self.parent.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_chunks(file_path, chunk_size=1024):
+    f = open(file_path, 'rb')
+    try:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:  # empty files cannot be mapped
+        f.close()
+        return MappedChunks(b'', chunk_size)
+    return MappedChunks(mapping, chunk_size, mapping=mapping, file=f)
+
+if __name__ == "__main__":
+    path = input("Enter file path to chunk: ")
+    size = int(input("Enter chunk size (bytes): ") or 1024)
+    for i, chunk in enumerate(file_chunker(path, size)):
+        print(f"Chunk {i} (size {len(chunk)}): {chunk[:32]}{'...' if len(chunk) > 32 else ''}")
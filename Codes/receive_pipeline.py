@@ -0,0 +1,151 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import fec
+from arq_protocol import DATA_FEC, FRAME_DATA
+from arq_receiver import FileSink
+from crc_utils import crc32
+
+WRITE_QUEUE = 256  # chunks the disk writer may fall behind by before the session stops reading
+VERIFY_WORKERS = 0  # CRC threads next to the event loop's own; 0 checks inline. Only pays off with spare cores and large chunks
+VERIFY_PARALLEL_BYTES = 64 * 1024  # smaller batches are checked inline: handing them over would cost more
+ZLIB_UNLOCKED_BYTES = 5 * 1024  # zlib.crc32 only releases the GIL on buffers larger than this
+
+
+def chunk_crc(payload, flags):
+    """CRC32 of a DATA frame's chunk, as ArqReceiver.handle_chunk checks it: without the FEC check bits."""
+    if flags & DATA_FEC:
+        payload = fec.split(payload)[0]
+    return crc32(payload)
+
+
+def indexed_crcs(frames):
+    return [(index, chunk_crc(frame.payload, frame.flags)) for index, frame in frames]
+
+
+class ChunkVerifier:
+    """Checks the CRCs of a batch of DATA frames on a thread pool, alongside the calling thread.
+
+    The session parses every frame asyncio delivered in one go, has the batch checked here and
+    passes each chunk's CRC to ArqReceiver.handle_chunk, which does the rest (duplicates, gaps,
+    ACKs) on the event loop as before. zlib.crc32 releases the GIL on large buffers, so large
+    chunks are checked in parallel; batches of small ones are left to the receiver.
+    """
+
+    def __init__(self, workers=VERIFY_WORKERS):
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='arq-verify')
+
+    def crcs(self, frames):
+        """Each frame's chunk CRC (None for other frames), or None if the batch is better checked inline."""
+        data = [(index, frame) for index, frame in enumerate(frames) if frame.type == FRAME_DATA]
+        total = sum(len(frame.payload) for _, frame in data)
+        if len(data) < 2 or total < VERIFY_PARALLEL_BYTES or total < len(data) * ZLIB_UNLOCKED_BYTES:
+            return None
+        parts = min(self.workers + 1, len(data))
+        groups = [data[part::parts] for part in range(parts)]
+        futures = [self.pool.submit(indexed_crcs, group) for group in groups[1:]]
+        crcs = [None] * len(frames)
+        for index, crc in indexed_crcs(groups[0]):
+            crcs[index] = crc
+        for future in futures:
+            for index, crc in future.result():
+                crcs[index] = crc
+        return crcs
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class QueuedSink(FileSink):
+    """A FileSink written by a thread of its own, fed through a queue.
+
+    write_at() copies the chunk (it may be a view into the frame reader's buffer) and returns, so
+    an ACK waits for the chunk's CRC check but not for the disk; nothing here blocks the caller.
+    Once the writer is depth chunks behind, backlogged() is true: the session then stops reading
+    from its transport until when_drained() calls back, so a slow disk holds up the sender through
+    flow control instead of growing the queue. after_writes() and flush() run on the writer thread,
+    behind the chunks queued before them. Closing the file waits for everything queued, which
+    that limit keeps short. A failed write is raised by the next write_at() or by commit().
+    """
+
+    def __init__(self, output_dir, temp_path=None, depth=WRITE_QUEUE):
+        super().__init__(output_dir, temp_path)
+        self.depth = depth
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.backlog = 0  # items queued and not yet done
+        self.drained = []  # callbacks waiting for the backlog to go down
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='arq-writer', daemon=True)
+        self.thread.start()
+
+    def write_at(self, offset, chunk):
+        self.check()
+        self.put((offset, bytes(chunk)))
+
+    def after_writes(self, callback, *args):
+        self.check()
+        self.put((None, (callback, args)))
+
+    def flush(self):
+        self.put((None, None))
+
+    def backlogged(self):
+        return self.backlog >= self.depth
+
+    def when_drained(self, callback):
+        """Call callback() once the writer is down to half of depth, from its thread (at once if it is already)."""
+        with self.lock:
+            if self.backlog > self.depth // 2:
+                self.drained.append(callback)
+                return
+        callback()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        super().close()
+
+    def commit(self, path):
+        self.close()
+        self.check()
+        return super().commit(path)
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def put(self, item):
+        with self.lock:
+            self.backlog += 1
+        self.queue.put(item)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                if self.error is not None:
+                    continue  # the file is lost already; keep draining so waiting sessions are released
+                offset, data = item
+                if offset is not None:
+                    super().write_at(offset, data)
+                elif data is None:
+                    super().flush()
+                else:
+                    super().sync()
+                    callback, args = data
+                    callback(*args)
+            except OSError as e:
+                self.error = e
+            finally:
+                with self.lock:
+                    self.backlog -= 1
+                    drained = []
+                    if self.backlog <= self.depth // 2:
+                        drained, self.drained = self.drained, []
+                for callback in drained:
+                    callback()
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import struct
+import time
+from arq_protocol import MAX_CHUNK_SIZE, MAX_PAYLOAD, ProtocolError
+from crc_utils import crc32
+
+RESUME_REQUEST = struct.Struct('!16sQI')  # file id, file size, chunk size: the client's FRAME_RESUME payload
+RESUME_ENTRY = struct.Struct('!QII')  # offset, length, CRC32 of one chunk the server holds: its reply, repeated
+RESUME_BATCH = MAX_PAYLOAD // RESUME_ENTRY.size  # entries per reply frame
+MANIFEST_FLUSH_EVERY = 64  # chunks stored between manifest writes
+PARTIAL_MAX_AGE = 7 * 24 * 3600  # seconds a partial file may sit untouched before the server deletes it
+
+
+def file_id(path):
+    """16-byte id of a file's current version: its name, size and modification time, hashed."""
+    st = os.stat(path)
+    return hashlib.sha256(f'{os.path.basename(path)}|{st.st_size}|{st.st_mtime_ns}'.encode()).digest()[:16]
+
+
+def pack_resume_request(fid, size, chunk_size):
+    return RESUME_REQUEST.pack(fid, size, chunk_size)
+
+
+def unpack_resume_request(payload):
+    """(file id, file size, chunk size) from a FRAME_RESUME request; ProtocolError if it is malformed."""
+    if len(payload) != RESUME_REQUEST.size:
+        raise ProtocolError(f'Resume request of {len(payload)} bytes, expected {RESUME_REQUEST.size}')
+    fid, size, chunk_size = RESUME_REQUEST.unpack(bytes(payload))
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ProtocolError(f'Resume chunk size {chunk_size} out of range')
+    return fid, size, chunk_size
+
+
+def pack_entries(entries):
+    return b''.join(RESUME_ENTRY.pack(offset, length, crc) for offset, length, crc in entries)
+
+
+def unpack_entries(payload):
+    return list(RESUME_ENTRY.iter_unpack(bytes(payload)))
+
+
+def missing_ranges(held, view):
+    """Check the chunks the server holds against the local file.
+
+    held are (offset, length, CRC) entries from the server's reply; a chunk only counts as present
+    if the same bytes of view have that CRC. Returns (byte ranges still to send as (start, end),
+    bytes already on the server).
+    """
+    present = sorted((offset, offset + length) for offset, length, crc in held
+                     if offset + length <= len(view) and crc32(view[offset:offset + length]) == crc)
+    ranges = []
+    position = 0
+    have = 0
+    for start, end in present:
+        if start > position:
+            ranges.append((position, start))
+        if end > position:
+            have += end - max(start, position)
+            position = end
+    if position < len(view):
+        ranges.append((position, len(view)))
+    return ranges, have
+
+
+def expire_partials(directory, max_age=PARTIAL_MAX_AGE, now=None):
+    """Delete the partial files and manifests in directory untouched for max_age seconds.
+
+    Kept for resuming, a .incoming_<id>.part and its .manifest are otherwise never removed unless
+    the same file is sent again. They go as a pair, by the newer of their modification times.
+    Returns (files removed, bytes freed).
+    """
+    now = time.time() if now is None else now
+    groups = {}  # path without extension -> [(path, stat)]
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0, 0
+    for name in names:
+        base, ext = os.path.splitext(name)
+        if name.startswith('.incoming_') and ext in ('.part', '.manifest'):
+            path = os.path.join(directory, name)
+            try:
+                groups.setdefault(base, []).append((path, os.stat(path)))
+            except FileNotFoundError:
+                pass
+    removed = freed = 0
+    for files in groups.values():
+        if now - max(st.st_mtime for _, st in files) < max_age:
+            continue
+        for path, st in files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            freed += st.st_size
+    return removed, freed
+
+
+class Manifest:
+    """On-disk record of what the server has received of one file, so the transfer can resume.
+
+    It lives next to the partial file, as .incoming_<file id>.manifest: a JSON header line (file
+    id, size, chunk size, extension), then one "offset length crc" line per stored chunk. Lines
+    are appended in batches, each after the partial file has been synced to disk (fsync), so even
+    after a crash the manifest never lists data that is not in the file; a torn or corrupted line
+    ends what is read back.
+    """
+
+    def __init__(self, directory, fid, size, chunk_size, file_ext=None):
+        base = os.path.join(directory, f'.incoming_{fid.hex()}')
+        self.path = base + '.manifest'
+        self.data_path = base + '.part'
+        self.file_id = fid
+        self.size = size
+        self.chunk_size = chunk_size
+        self.file_ext = file_ext
+        self.pending = []
+        self.file = None
+
+    def open(self):
+        """Load the chunks a previous attempt stored, or start a new manifest; returns the (offset, length, CRC) entries."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        entries = self.load()
+        if entries is None:
+            # Nothing usable to resume from: start over, without leftovers of an older attempt
+            for path in (self.data_path, self.path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            entries = []
+            header = {'file_id': self.file_id.hex(), 'size': self.size, 'chunk_size': self.chunk_size, 'file_ext': self.file_ext}
+            self.file = open(self.path, 'x')
+            self.file.write(json.dumps(header) + '\n')
+            self.file.flush()
+        else:
+            self.file = open(self.path, 'a')
+        return entries
+
+    def load(self):
+        if not os.path.exists(self.path) or not os.path.exists(self.data_path):
+            return None
+        chunks = {}
+        with open(self.path) as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                return None
+            if header.get('size') != self.size:
+                return None
+            self.file_ext = self.file_ext or header.get('file_ext')
+            for line in f:
+                fields = line.split()
+                if len(fields) != 3 or not line.endswith('\n'):
+                    break  # torn write at the end
+                try:
+                    offset, length, crc = int(fields[0]), int(fields[1]), int(fields[2], 16)
+                except ValueError:
+                    break  # corrupted: trust nothing from here on, as with a torn line
+                if offset < 0 or length <= 0 or offset + length > self.size:
+                    break
+                chunks[offset] = (length, crc)  # a later copy of a chunk replaces the earlier one
+        return [(offset, length, crc) for offset, (length, crc) in sorted(chunks.items())]
+
+    def add(self, offset, length, crc):
+        """Note a stored chunk; returns True when a batch is due (sync the data file, then call flush())."""
+        self.pending.append(f'{offset} {length} {crc:08x}\n')
+        return len(self.pending) >= MANIFEST_FLUSH_EVERY
+
+    def take(self):
+        """The lines added since the last batch, for write() once their chunks are in the data file."""
+        lines, self.pending = self.pending, []
+        return lines
+
+    def write(self, lines):
+        if lines and self.file is not None:
+            self.file.write(''.join(lines))
+            self.file.flush()
+
+    def flush(self):
+        self.write(self.take())
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        """Drop the manifest once the file is complete."""
+        self.pending = []
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -1,166 +1,50 @@
-import socket
-import os
-import time
-from crc_utils import crc32
+import argparse
+from arq_logging import VERBOSITY
+from arq_receiver import ACK_EVERY
+from chunk_store import STORE_BYTES
+from receive_pipeline import VERIFY_WORKERS, WRITE_QUEUE
+from resume import PARTIAL_MAX_AGE
+from server_engine import ACK_DELAY, HOST, PORT, ServerEngine
 
-HOST = '0.0.0.0'  # Listen on all interfaces
-PORT = 65432        # Port to listen on (non-privileged ports are > 1023)
-CHUNK_SIZE = 1024
-END_SIGNAL = b'__END__'
-EOT_SIGNAL = b'__EOT__'
-LOG_DIR = 'Log Files/Server Logs'
-OUTPUT_DIR = 'Received Output'
-LOG_FILE = os.path.join(LOG_DIR, 'reception_log.txt')
-CRC_LOG_FILE = os.path.join(LOG_DIR, 'crc_log.txt')
-METRICS_LOG_FILE = os.path.join(LOG_DIR, 'metrics_log.txt')
 
+def print_result(result):
+    if result.status == 'aborted':
+        return
+    if result.status == 'failed' and not result.metrics:
+        print(f'[{result.session}] Transfer failed: no data received.')
+    for line in result.metrics:
+        print(f'[{result.session}] {line}')
+    print(f'[{result.session}] Reception complete for this message/file. Waiting for next...')
 
-# Helper to guess file type from first chunk (very basic)
-def guess_file_extension(chunk):
-    if chunk.startswith(b'\xff\xd8\xff'):
-        return '.jpg'
-    if chunk.startswith(b'\x89PNG'):
-        return '.png'
-    if chunk.startswith(b'GIF8'):
-        return '.gif'
-    if chunk.startswith(b'BM'):
-        return '.bmp'
-    if chunk[4:8] == b'ftyp':
-        return '.mp4'
-    if chunk[:4] == b'RIFF' and chunk[8:12] == b'WAVE':
-        return '.wav'
-    if chunk[:4] == b'ID3' or chunk[-128:-125] == b'TAG':
-        return '.mp3'
-    return '.bin'
 
-def log_event(logf, msg):
-    logf.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {msg}\n")
-    logf.flush()
+parser = argparse.ArgumentParser(description='ARQ server: receives files and messages from any number of clients at once')
+parser.add_argument('--host', default=HOST, help='interface to listen on')
+parser.add_argument('--port', type=int, default=PORT, help='port to listen on')
+parser.add_argument('--udp', action='store_true', help='receive datagrams over UDP instead of TCP connections (clients need --udp too)')
+parser.add_argument('--log-level', choices=VERBOSITY, default='chunks', help='transfers, errors (adds NACKs and duplicates) or chunks (every chunk)')
+parser.add_argument('--crc-log-every', type=int, default=1, help='log the CRC check of every Nth chunk (0 = no CRC log)')
+parser.add_argument('--ack-every', type=int, default=ACK_EVERY, help='in-order chunks one coalesced ACK may cover (1 = ACK every chunk)')
+parser.add_argument('--ack-delay', type=float, default=ACK_DELAY, help='seconds a coalesced ACK may wait for more chunks')
+parser.add_argument('--chunk-store-mb', type=float, default=STORE_BYTES / 2 ** 20,
+                    help='memory for the deduplication chunk store, least recently used chunks evicted first (0 = off)')
+parser.add_argument('--keep-partial-hours', type=float, default=PARTIAL_MAX_AGE / 3600,
+                    help='delete partial files kept for resuming once untouched this long, at startup (0 = keep them)')
+parser.add_argument('--verify-workers', type=int, default=VERIFY_WORKERS,
+                    help='threads checking the CRCs of large batches of chunks next to the event loop (0 = check inline)')
+parser.add_argument('--write-queue', type=int, default=WRITE_QUEUE,
+                    help='chunks the disk writer thread may fall behind by (0 = write on the event loop)')
+parser.add_argument('--stage-times', action='store_true', help='break each transfer down by stage (parse, CRC, write, ACK, log...) in the metrics log')
+parser.add_argument('--profile', action='store_true', help='run each transfer under cProfile and write its stats next to the logs')
+parser.add_argument('--metrics-port', type=int, default=None, help='serve live Prometheus metrics at http://127.0.0.1:PORT/metrics (0 = any free port)')
+args = parser.parse_args()
 
-def log_crc(crcf, chunk_num, recv_crc, calc_crc, match):
-    crcf.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | Chunk {chunk_num}: CRC received: {recv_crc:08X}, CRC calculated: {calc_crc:08X}, Match: {match}\n")
-    crcf.flush()
-
-def log_metrics(metricsf, metrics_lines):
-    for line in metrics_lines:
-        metricsf.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {line}\n")
-    metricsf.flush()
-
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    # Create log directory and clear logs only when server is actually run
-    os.makedirs(LOG_DIR, exist_ok=True)
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    open(LOG_FILE, 'w').close()
-    open(CRC_LOG_FILE, 'w').close()
-    open(METRICS_LOG_FILE, 'w').close()
-    with open(LOG_FILE, 'a') as logf, open(CRC_LOG_FILE, 'a') as crcf, open(METRICS_LOG_FILE, 'a') as metricsf:
-        s.bind((HOST, PORT))
-        s.listen()
-        print(f"Server listening on {HOST}:{PORT}")
-        conn, addr = s.accept()
-        with conn:
-            print('Connected by', addr)
-            while True:
-                chunk_num = 0
-                received_chunks = []
-                is_binary = None
-                output_path = None
-                file_ext = None
-                end_signal_received = False
-                total_chunks_received = 0
-                unique_chunks_received = set()
-                total_bytes_received = 0
-                # SNR counters
-                total_bits_received = 0
-                error_bits = 0
-                start_time = None
-                while True:
-                    data = conn.recv(CHUNK_SIZE + 4)
-                    if not data:
-                        break
-                    if data == END_SIGNAL:
-                        print('End signal received. Session closed.')
-                        log_event(logf, 'End signal received. Session closed.')
-                        end_signal_received = True
-                        break
-                    if data == EOT_SIGNAL:
-                        # Save file/message immediately after EOT
-                        if received_chunks:
-                            full_data = b''.join(received_chunks)
-                            end_time = time.time()
-                            if is_binary:
-                                output_path = os.path.join(OUTPUT_DIR, f'received_file{file_ext}')
-                                with open(output_path, 'wb') as f:
-                                    f.write(full_data)
-                                print(f'Full binary file received and saved as: {output_path}')
-                                log_event(logf, f'Full binary file received and saved as: {output_path}')
-                            else:
-                                try:
-                                    print('Full message received:', full_data.decode())
-                                    log_event(logf, f'Full message received: {full_data.decode()}')
-                                except Exception as e:
-                                    print('Could not decode received data as text:', e)
-                                    log_event(logf, f'Could not decode received data as text: {e}')
-                            # Metrics
-                            duration = (end_time - start_time) if (end_time and start_time and end_time > start_time) else 1
-                            throughput = total_bytes_received / duration
-                            data_integrity_rate = (len(unique_chunks_received) / total_chunks_received) if total_chunks_received else 0
-                            # SNR calculation
-                            if error_bits == 0:
-                                snr_db = 'Infinity'
-                            else:
-                                correct_bits = total_bits_received - error_bits
-                                snr = correct_bits / error_bits if error_bits > 0 else 0
-                                snr_db = f"{10 * (snr if snr > 0 else 0):.2f}" if snr > 0 else '0.00'
-                                import math
-                                if snr > 0:
-                                    snr_db = f"{10 * math.log10(snr):.2f}"
-                                else:
-                                    snr_db = '0.00'
-                            snr_line = f"Empirical SNR: {snr_db} dB (Total bits: {total_bits_received}, Error bits: {error_bits})"
-                            print(snr_line)
-                            metrics_lines = [
-                                f"Total transmission time: {duration:.4f} seconds",
-                                f"Throughput: {throughput:.2f} bytes/sec",
-                                f"Data Integrity Rate: {data_integrity_rate:.4f}",
-                                snr_line
-                            ]
-                            for line in metrics_lines:
-                                print(line)
-                            log_metrics(metricsf, metrics_lines)
-                        print('Reception complete for this message/file. Waiting for next...')
-                        break  # Reset for next transmission
-                    if len(data) < 5:
-                        print(f'Chunk {chunk_num}: Incomplete data received.')
-                        log_event(logf, f'Chunk {chunk_num}: Incomplete data received.')
-                        conn.sendall(b'NACK: Incomplete data')
-                        break
-                    chunk, recv_crc_bytes = data[:-4], data[-4:]
-                    recv_crc = int.from_bytes(recv_crc_bytes, 'big')
-                    calc_crc = crc32(chunk)
-                    total_chunks_received += 1
-                    total_bits_received += len(chunk) * 8
-                    match = (recv_crc == calc_crc)
-                    log_crc(crcf, chunk_num, recv_crc, calc_crc, match)
-                    if match:
-                        if is_binary is None:
-                            try:
-                                chunk.decode()
-                                is_binary = False
-                            except Exception:
-                                is_binary = True
-                                file_ext = guess_file_extension(chunk)
-                        if start_time is None:
-                            start_time = time.time()
-                        received_chunks.append(chunk)
-                        total_bytes_received += len(chunk)
-                        unique_chunks_received.add(chunk_num)
-                        conn.sendall(b'ACK: CRC32 valid')
-                        log_event(logf, f'Chunk {chunk_num}: CRC32 valid (ACK)')
-                    else:
-                        error_bits += len(chunk) * 8
-                        conn.sendall(b'NACK: CRC32 error')
-                        log_event(logf, f'Chunk {chunk_num}: CRC32 error (NACK)')
-                    chunk_num += 1
-                if end_signal_received:
-                    break 
\ No newline at end of file
+engine = ServerEngine(args.host, args.port, on_log=print, on_transfer=print_result,
+                      verbosity=VERBOSITY[args.log_level], crc_every=args.crc_log_every, ack_every=args.ack_every,
+                      ack_delay=args.ack_delay, store_bytes=int(args.chunk_store_mb * 2 ** 20),
+                      metrics_port=args.metrics_port, timing=args.stage_times, profile=args.profile,
+                      udp=args.udp, write_queue=args.write_queue, verify_workers=args.verify_workers,
+                      partial_max_age=args.keep_partial_hours * 3600)
+try:
+    engine.run()
+except KeyboardInterrupt:
+    print('Server stopped.')
@@ -0,0 +1,789 @@
+import asyncio
+import functools
+import itertools
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+from arq_logging import LOG_CHUNKS, LOG_ERRORS, LOG_TRANSFERS, BackgroundLogger
+from arq_protocol import (FRAME_ABORT, FRAME_CHUNK_SIZE, FRAME_COMPRESS, FRAME_DATA, FRAME_DEDUP, FRAME_END, FRAME_EOT,
+                          FRAME_META, FRAME_RESUME, FRAME_STRIPE, MAX_CHUNK_SIZE, TRANSFER_BITS, TRANSFER_STEP, FrameReader,
+                          ProtocolError, frame_size, pack_frame, payload_text, transfer_delta)
+from arq_metrics import MetricsEndpoint, MetricsRegistry, Sample
+from arq_receiver import ACK_EVERY, ArqReceiver, FileSink
+from chunk_store import STORE_BYTES, ChunkStore, pack_held, unpack_offer
+from receive_pipeline import VERIFY_WORKERS, WRITE_QUEUE, ChunkVerifier, QueuedSink
+from resume import PARTIAL_MAX_AGE, RESUME_BATCH, expire_partials, pack_entries, unpack_resume_request
+from stage_timing import dump_profile, now, start_profile
+from striping import unpack_stripe
+from udp_transport import IDLE_TIMEOUT, enlarge_buffers, whole_frame
+
+HOST = '0.0.0.0'  # Listen on all interfaces
+PORT = 65432
+LOG_DIR = 'Log Files/Server Logs'
+OUTPUT_DIR = 'Received Output'
+STRIPE_TIMEOUT = 60  # seconds a striped file waits for its next stripe while none is being received
+RESERVE_FRAMES = 8  # frames of the announced chunk size the receive buffer is grown to hold
+ACK_DELAY = 0.0  # seconds a coalesced ACK may wait for more chunks; 0 sends it after each batch of received data
+PWRITE = hasattr(os, 'pwrite')  # positional writes without a shared file position (not on Windows)
+LOG_FILE = os.path.join(LOG_DIR, 'reception_log.txt')
+CRC_LOG_FILE = os.path.join(LOG_DIR, 'crc_log.txt')
+METRICS_LOG_FILE = os.path.join(LOG_DIR, 'metrics_log.txt')
+
+# Outcome of one transfer, passed to the front-end's on_transfer callback.
+# status is 'complete', 'failed' or 'aborted'; path is set for files, message for text;
+# metrics are the printable lines and stats the same numbers as ArqReceiver.metrics().
+TransferResult = namedtuple('TransferResult', 'session status path file_ext message metrics stats')
+
+
+class StripedFile:
+    """One file arriving as stripes over several sessions (see striping.py).
+
+    It is the sink of every stripe's receiver: chunks go to their offset in one temp file made
+    by sink_factory, with os.pwrite where the platform has it unless the file has a writer
+    thread of its own. The receivers never close or discard it; the engine commits or removes
+    the file once every stripe has finished, and removes it if the missing stripes have not
+    started STRIPE_TIMEOUT seconds after the last one ended.
+    """
+
+    def __init__(self, output_dir, transfer_id, count, size, file_ext, session_id, sink_factory=FileSink):
+        self.file = sink_factory(output_dir)
+        self.pwrite = PWRITE and not isinstance(self.file, QueuedSink)
+        self.temp_path = self.file.temp_path
+        self.transfer_id = transfer_id
+        self.count = count
+        self.size = size
+        self.file_ext = file_ext
+        self.session_id = session_id  # of stripe 0, the client's main connection; names the output file
+        self.joined = set()  # stripe indices a session has started receiving
+        self.outcomes = {}  # stripe index -> (status, receiver metrics)
+        self.attached = 0  # sessions sending a stripe of it right now
+        self.timer = None  # while none are: the engine's deadline for the next one
+        self.start_time = time.time()
+
+    def write_at(self, offset, chunk):
+        if self.pwrite:
+            os.pwrite(self.file.file.fileno(), chunk, offset)
+        else:
+            self.file.write_at(offset, chunk)
+
+    def flush(self):
+        pass
+
+    def backlogged(self):
+        return self.file.backlogged()
+
+    def when_drained(self, callback):
+        self.file.when_drained(callback)
+
+    def close(self):
+        pass
+
+    def discard(self):
+        pass
+
+    def metrics_lines(self, stats):
+        lines = [
+            f"Striped transfer: {self.count} streams, {stats['bytes']} of {self.size} bytes",
+            f"Total transmission time: {stats['time']:.4f} seconds",
+            f"Aggregate throughput: {stats['throughput']:.2f} bytes/sec",
+        ]
+        for index in range(self.count):
+            status, m = self.outcomes.get(index, ('missing', None))
+            if m is None:
+                lines.append(f"Stream {index}: {status}")
+                continue
+            lines.append(f"Stream {index}: {status}, {m['bytes']} bytes, {m['throughput']:.2f} bytes/sec, "
+                         f"integrity {m['integrity']:.4f}, {m['responses']} responses")
+        return lines
+
+
+class ArqSession(asyncio.BufferedProtocol):
+    """One client connection: its own frame reader, ArqReceiver, metrics and output file.
+
+    Frames are parsed straight out of the buffer asyncio receives into, a whole batch at a time,
+    and the engine's ChunkVerifier, if it has one, checks the batch's CRCs on its worker threads
+    (see receive_pipeline.py). Immediate responses (NACKs, gaps, duplicates) are written as each frame
+    is handled; in-order chunks share one coalesced ACK, sent once the whole batch asyncio
+    delivered has been handled, or ack_delay later if the engine has one. Chunks go to disk
+    through the engine's sink_factory, by default a QueuedSink with a writer thread, so an ACK
+    never waits for a write; when the writer falls behind, the session stops reading from its
+    transport until it catches up, and the event loop never waits for the disk.
+
+    With the engine's profile switch, each transfer runs under cProfile from its first frame to
+    its EOT or ABORT (see ServerEngine).
+    """
+
+    reliable = True  # frames arrive in order and none are lost, so announced chunk sizes bound the chunks after them
+
+    def __init__(self, engine, session_id):
+        self.engine = engine
+        self.session_id = session_id
+        self.name = f'#{session_id}'
+        self.transport = None
+        self.reader = FrameReader()
+        self.ack_timer = None
+        self.resume_id = None  # file id of the resumable transfer in progress, claimed in engine.resuming
+        self.stripe = None  # StripedFile this session is sending a stripe of
+        self.stripe_index = None
+        self.profile = None  # cProfile.Profile of the transfer in progress
+        self.paused = False  # reading stopped until the disk writer catches up
+        self.receiver = ArqReceiver(engine.output_dir, log_event=self.log_problem,
+                                    log_crc=self.log_crc if engine.crc_every else None,
+                                    log_chunk=self.log_chunk if engine.verbosity >= LOG_CHUNKS else None,
+                                    sink_factory=engine.sink_factory, ack_every=engine.ack_every,
+                                    chunk_store=engine.chunk_store, registry=engine.registry, timing=engine.timing,
+                                    trust_chunk_sizes=self.reliable)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # ACKs for pipelined chunks must not wait behind Nagle's algorithm
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = transport.get_extra_info('peername')
+        if peer:
+            self.name = f'#{self.session_id} {peer[0]}:{peer[1]}'
+        self.engine.sessions.add(self)
+        self.log_event('Connected')
+
+    def get_buffer(self, sizehint):
+        return self.reader.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.reader.buffer_updated(nbytes)
+        self.process_frames()
+
+    def process_frames(self):
+        if self.engine.profile and self.profile is None:
+            self.profile = self.engine.start_profile()
+        stages = self.receiver.stages
+        if stages is not None:
+            start = now()
+        frames = []
+        error = None
+        while True:
+            try:
+                frame = self.reader.next_frame()
+            except ProtocolError as e:
+                error = e  # handle the good frames ahead of it first
+                break
+            if frame is None:
+                break
+            frames.append(frame)
+        if stages is not None:
+            stages.add('parse', start)
+        crcs = None
+        if self.engine.verifier is not None:
+            if stages is not None:
+                start = now()
+            crcs = self.engine.verifier.crcs(frames)
+            if stages is not None and crcs is not None:
+                stages.add('verify', start)
+        for index, frame in enumerate(frames):
+            if self.transport.is_closing():
+                break
+            try:
+                self.handle_frame(frame, crcs[index] if crcs is not None else None)
+            except ProtocolError as e:
+                error = e
+                break
+        if error is not None and not self.transport.is_closing():
+            self.protocol_error(error)
+        if self.receiver.ack_owed and self.ack_timer is None and not self.transport.is_closing():
+            if self.engine.ack_delay:
+                self.ack_timer = self.engine.loop.call_later(self.engine.ack_delay, self.send_ack)
+            else:
+                self.send_ack()
+        sink = self.receiver.sink
+        if sink is not None and not self.paused and sink.backlogged() and not self.transport.is_closing():
+            # The disk is behind: stop reading, so flow control holds up the sender, until it catches up
+            self.paused = True
+            self.transport.pause_reading()
+            sink.when_drained(functools.partial(self.engine.loop.call_soon_threadsafe, self.resume_reading))
+
+    def resume_reading(self):
+        self.paused = False
+        if not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    def send_ack(self):
+        if self.ack_timer is not None:
+            # Sent early (e.g. ahead of an EOT): the coalesced ACK must not go out a second time
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        ack = self.receiver.take_ack()
+        if ack is not None and not self.transport.is_closing():
+            self.write_ack(ack)
+
+    def write_ack(self, ack):
+        stages = self.receiver.stages
+        if stages is not None:
+            start = now()
+        self.transport.write(ack)
+        if stages is not None:
+            stages.add('ack', start)
+
+    def connection_lost(self, exc):
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+        if self.stripe is not None:
+            self.end_stripe('lost')
+        partial_path = self.receiver.keep_partial()
+        if partial_path:
+            self.log_event(f'Connection closed mid-transfer. Partial data kept in: {partial_path}')
+        self.release_resume()
+        self.end_profile(keep=self.receiver.start_time is not None)
+        if self.engine.registry is not None:
+            self.engine.registry.finish(self.receiver)
+        self.log_event('Connection closed')
+        self.engine.sessions.discard(self)
+
+    def handle_frame(self, frame, calc_crc=None):
+        if frame.type == FRAME_DATA:
+            response = self.receiver.handle_chunk(frame.seq, frame.offset, frame.payload, frame.crc, frame.flags, calc_crc)
+            if response is not None:
+                self.write_ack(response)
+        elif frame.type == FRAME_META:
+            # File extension sent by the client ahead of the data
+            self.receiver.file_ext = payload_text(frame.payload)
+        elif frame.type == FRAME_RESUME:
+            self.start_resume(frame.payload)
+        elif frame.type == FRAME_STRIPE:
+            self.start_stripe(frame.payload)
+        elif frame.type == FRAME_DEDUP:
+            self.start_dedup(frame.payload)
+        elif frame.type == FRAME_COMPRESS:
+            codec = payload_text(frame.payload)
+            accepted = self.receiver.accept_compression(codec)
+            self.transport.write(pack_frame(FRAME_COMPRESS, codec.encode() if accepted else b'', flags=frame.flags & TRANSFER_BITS))
+        elif frame.type == FRAME_CHUNK_SIZE:
+            size = int.from_bytes(frame.payload, 'big')
+            if not 0 < size <= MAX_CHUNK_SIZE:
+                raise ProtocolError(f'Chunk size {size} out of range')
+            self.receiver.note_chunk_size(frame.seq, size)
+            self.reader.reserve(RESERVE_FRAMES * frame_size(size))
+        elif frame.type == FRAME_EOT:
+            self.send_ack()
+            if self.stripe is not None:
+                self.end_stripe('complete')
+            else:
+                self.finish_transfer()
+            self.end_profile()
+            self.transport.write(pack_frame(FRAME_EOT, flags=frame.flags & TRANSFER_BITS))
+            self.engine.logger.flush(wait=False)
+        elif frame.type == FRAME_ABORT:
+            self.log_event('Transfer aborted by client.')
+            self.abort_transfer()
+            self.transport.write(pack_frame(FRAME_ABORT, flags=frame.flags & TRANSFER_BITS))
+            self.engine.logger.flush(wait=False)
+        elif frame.type == FRAME_END:
+            self.log_event('End signal received. Session closed.')
+            self.transport.close()
+
+    def protocol_error(self, error):
+        self.log_event(f'Protocol error: {error}. Closing the connection.')
+        if self.receiver.start_time is not None or self.stripe is not None:
+            self.abort_transfer()
+        self.transport.close()
+
+    def abort_transfer(self):
+        if self.stripe is not None:
+            self.end_stripe('aborted')  # the striped transfer is reported once all its stripes have ended
+        else:
+            if self.receiver.manifest is not None:
+                self.log_event(f'Partial data kept for resuming: {self.receiver.keep_partial()}')
+            else:
+                self.receiver.discard()
+            self.release_resume()
+            self.engine.transfer_done(TransferResult(self.name, 'aborted', None, None, None, [], {}))
+            self.receiver.reset()
+        self.end_profile()
+
+    def start_resume(self, payload):
+        # Reply with the chunks kept for this file; the client resends the rest
+        try:
+            fid, size, chunk_size = unpack_resume_request(payload)
+        except ProtocolError:
+            self.transport.write(pack_frame(FRAME_ABORT))  # the client is waiting for the reply
+            raise
+        held = []
+        if fid in self.engine.resuming:
+            self.log_event(f'File {fid.hex()} is being received by another session; receiving it from scratch')
+        else:
+            self.engine.resuming.add(fid)
+            self.resume_id = fid
+            held = self.receiver.resume(fid, size, chunk_size)
+        # In batches that fit a frame; seq counts the replies still to come after each
+        batches = [held[start:start + RESUME_BATCH] for start in range(0, len(held), RESUME_BATCH)] or [[]]
+        for index, batch in enumerate(batches):
+            self.transport.write(pack_frame(FRAME_RESUME, pack_entries(batch), seq=len(batches) - 1 - index))
+
+    def start_dedup(self, payload):
+        # Rebuild the offered chunks held in the chunk store, and tell the client which they were
+        try:
+            size, chunk_size, first, hashes = unpack_offer(payload)
+        except ValueError as e:
+            self.log_event(f'Invalid deduplication offer ({e}); transfer aborted')
+            self.abort_transfer()
+            self.transport.write(pack_frame(FRAME_ABORT))
+            return
+        self.transport.write(pack_frame(FRAME_DEDUP, pack_held(self.receiver.dedup(size, chunk_size, first, hashes))))
+
+    def start_stripe(self, payload):
+        transfer_id, index, count, size, file_ext = unpack_stripe(payload)
+        if self.stripe is not None:
+            raise ProtocolError('A second stripe announced on one connection')
+        self.stripe = self.engine.join_stripe(transfer_id, index, count, size, file_ext or self.receiver.file_ext, self.session_id)
+        self.stripe_index = index
+        self.receiver.receive_into(self.stripe, size)
+        self.log_event(f'Receiving stripe {index + 1} of {count} of a {size}-byte file')
+
+    def end_stripe(self, status):
+        stripe, self.stripe = self.stripe, None
+        self.receiver.detach()
+        metrics_lines = self.receiver.metrics_lines(snr_label='Empirical SNR')
+        self.engine.log_metrics(f'{self.name} stripe {self.stripe_index}', metrics_lines)
+        self.engine.stripe_done(stripe, self.stripe_index, status, self.receiver.metrics())
+        self.receiver.reset()
+
+    def end_profile(self, keep=True):
+        profile, self.profile = self.profile, None
+        if profile is not None:
+            self.engine.end_profile(profile, self.name if keep else None)
+
+    def release_resume(self):
+        if self.resume_id is not None:
+            self.engine.resuming.discard(self.resume_id)
+            self.resume_id = None
+
+    def finish_transfer(self):
+        receiver = self.receiver
+        self.release_resume()
+        if not receiver.has_data():
+            self.engine.transfer_done(TransferResult(self.name, 'failed', None, None, None, [], {}))
+            receiver.reset()
+            return
+        path = message = None
+        status = 'complete'
+        if receiver.is_binary:
+            path = os.path.join(self.engine.output_dir, f'received_file_{self.session_id}{receiver.file_ext or ".bin"}')
+            path = receiver.save_as(path)
+            self.log_event(f'Full binary file received and saved as: {path}')
+        else:
+            full_data = receiver.take_data()
+            try:
+                message = full_data.decode()
+                self.log_event(f'Full message received: {message}')
+            except Exception as e:
+                status = 'failed'
+                self.log_event(f'Could not decode received data as text: {e}')
+        metrics_lines = receiver.metrics_lines(snr_label='Empirical SNR')
+        self.engine.log_metrics(self.name, metrics_lines)
+        self.engine.transfer_done(TransferResult(self.name, status, path, receiver.file_ext, message, metrics_lines,
+                                                   receiver.metrics()))
+        receiver.reset()
+
+    def log_event(self, msg):
+        self.engine.log_event(f'[{self.name}] {msg}')
+
+    def log_problem(self, msg):
+        self.engine.log_event(f'[{self.name}] {msg}', LOG_ERRORS)
+
+    def log_chunk(self, msg):
+        self.engine.log_event(f'[{self.name}] {msg}', LOG_CHUNKS)
+
+    def log_crc(self, chunk_num, recv_crc, calc_crc, match):
+        if self.engine.logger.sample_crc():
+            self.engine.log_crc(f'[{self.name}] Chunk {chunk_num}: CRC received: {recv_crc:08X}, CRC calculated: {calc_crc:08X}, Match: {match}')
+
+
+class DatagramPeer:
+    """The transport a DatagramSession writes to: the UDP server's socket, addressed to one client."""
+
+    def __init__(self, server, addr):
+        self.server = server
+        self.addr = addr
+        self.closing = False
+        self.reading = True
+
+    def write(self, data):
+        if not self.closing:
+            self.server.transport.sendto(data, self.addr)
+
+    def pause_reading(self):
+        # The socket is shared, so the client's datagrams are dropped instead; the sender resends them
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        # Like a TCP transport, connection_lost follows on the next loop iteration
+        if not self.closing:
+            self.closing = True
+            session = self.server.sessions.pop(self.addr, None)
+            if session is not None:
+                self.server.engine.loop.call_soon(session.connection_lost, None)
+
+    def get_extra_info(self, name, default=None):
+        return self.addr if name == 'peername' else default
+
+
+class DatagramSession(ArqSession):
+    """An ArqSession for one client address of the UDP server, fed one frame per datagram.
+
+    Nothing retransmits underneath, so the client repeats its control frames until answered.
+    Each transfer has a number, moved on after its EOT or ABORT (see arq_protocol.TRANSFER_BITS):
+    frames of an earlier transfer are repeats whose answer was lost, and are answered again, or
+    late duplicates, and are dropped. A frame of a later one means every copy of the client's
+    EOT or ABORT was lost; the transfer in progress is then aborted. META is echoed, since the client waits for it. Resume, deduplication and
+    striping are TCP only: their requests and replies do not fit in a datagram.
+    """
+
+    reliable = False  # a chunk-size announcement may be lost, so compressed chunks keep the protocol's bound
+
+    def __init__(self, engine, session_id):
+        super().__init__(engine, session_id)
+        self.transfer_tag = 0  # this transfer's number, as TRANSFER_BITS flags
+        self.last_seen = engine.loop.time()
+
+    def datagram_received(self, data):
+        self.last_seen = self.engine.loop.time()
+        self.reader.feed(data)
+        self.process_frames()
+
+    def handle_frame(self, frame, calc_crc=None):
+        if frame.type == FRAME_END:
+            super().handle_frame(frame)
+            return
+        delta = transfer_delta(frame.flags, self.transfer_tag)
+        if delta < 0:
+            if frame.type in (FRAME_EOT, FRAME_ABORT):
+                self.transport.write(pack_frame(frame.type, flags=frame.flags & TRANSFER_BITS))
+            return
+        if delta > 0:
+            if self.receiver.start_time is not None:
+                self.log_event('The client has moved on to its next transfer; aborting this one')
+                self.abort_transfer()
+            else:
+                self.receiver.reset()
+            self.transfer_tag = frame.flags & TRANSFER_BITS
+        if frame.type in (FRAME_RESUME, FRAME_DEDUP, FRAME_STRIPE):
+            self.log_event('Resume, deduplication and striping need TCP; request ignored')
+            return
+        super().handle_frame(frame, calc_crc)
+        if frame.type == FRAME_META:
+            self.transport.write(pack_frame(FRAME_META, bytes(frame.payload), flags=self.transfer_tag))
+        elif frame.type in (FRAME_EOT, FRAME_ABORT):
+            self.transfer_tag = (self.transfer_tag + TRANSFER_STEP) & TRANSFER_BITS
+
+    def write_ack(self, ack):
+        if self.transfer_tag:
+            ack = bytearray(ack)
+            ack[1] |= self.transfer_tag
+        super().write_ack(ack)
+
+
+class DatagramServer(asyncio.DatagramProtocol):
+    """The engine's UDP endpoint: a DatagramSession per client address.
+
+    A datagram that is not exactly one whole frame is dropped. A client silent for IDLE_TIMEOUT
+    seconds is dropped as if its connection had closed, since UDP has no FIN to say it has gone.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.transport = None
+        self.sessions = {}  # client address -> DatagramSession
+        self.sweeper = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            enlarge_buffers(sock)
+        self.sweeper = self.engine.loop.call_later(IDLE_TIMEOUT / 4, self.sweep)
+
+    def datagram_received(self, data, addr):
+        if not whole_frame(data):
+            return
+        session = self.sessions.get(addr)
+        if session is None:
+            session = self.sessions[addr] = DatagramSession(self.engine, next(self.engine.session_ids))
+            session.connection_made(DatagramPeer(self, addr))
+        elif not session.transport.reading:
+            return
+        session.datagram_received(data)
+
+    def error_received(self, exc):
+        pass  # e.g. ICMP port unreachable from a client that has gone; the idle sweep drops it
+
+    def sweep(self):
+        now = self.engine.loop.time()
+        for session in list(self.sessions.values()):
+            if now - session.last_seen > IDLE_TIMEOUT:
+                session.log_event(f'Nothing received for {IDLE_TIMEOUT} s; dropping the session')
+                session.transport.close()
+        self.sweeper = self.engine.loop.call_later(IDLE_TIMEOUT / 4, self.sweep)
+
+    def close(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+        for session in list(self.sessions.values()):
+            session.transport.close()
+        if self.transport is not None:
+            self.transport.close()
+
+
+class ServerEngine:
+    """asyncio server that runs any number of concurrent ARQ sessions on one event loop.
+
+    The CLI and GUI are front-ends that pass callbacks: on_log(msg) for connection and transfer
+    events, on_chunk_log(msg) for per-chunk and CRC lines (optional, they always go to the log
+    files) and on_transfer(TransferResult) when a transfer finishes. verbosity and crc_every
+    are passed on to the BackgroundLogger and apply to the callbacks as well; ack_every and ack_delay set
+    how in-order ACKs are coalesced (see ArqReceiver and ArqSession). store_bytes caps the chunk
+    store all sessions share for deduplication (0 turns it off). With a metrics_port, live
+    counters and ACK/copy percentiles are served at http://127.0.0.1:<port>/metrics in the
+    Prometheus text format (port 0 picks a free one). Callbacks run on the engine's
+    thread. With timing, the metrics log breaks every transfer's time down by stage (see
+    stage_timing.StageTimes); with profile, each transfer runs under cProfile and its stats are
+    written next to the logs as profile_<n>.prof and .txt. cProfile follows the event loop
+    thread, so transfers running at the same time share one profile. Each session saves its file as received_file_<session id><ext>, so concurrent
+    transfers never overwrite each other. With udp, clients send their frames as datagrams
+    (see udp_transport.DatagramSocket and DatagramSession) instead of over TCP. verify_workers
+    threads check the CRCs of large batches of chunks alongside the event loop, and each file is
+    written by a thread of its own, at most write_queue chunks behind (see receive_pipeline.py;
+    0 does either on the event loop). A file being resumed (see resume.py) is claimed by
+    one session at a time. Partial files and manifests kept for resuming are deleted at startup
+    once untouched for partial_max_age seconds (None keeps them).
+    """
+
+    def __init__(self, host=HOST, port=PORT, output_dir=OUTPUT_DIR, log_dir=LOG_DIR,
+                 on_log=print, on_chunk_log=None, on_transfer=None, verbosity=LOG_CHUNKS, crc_every=1,
+                 ack_every=ACK_EVERY, ack_delay=ACK_DELAY, store_bytes=STORE_BYTES, metrics_port=None,
+                 timing=False, profile=False, udp=False, write_queue=WRITE_QUEUE, verify_workers=VERIFY_WORKERS,
+                 partial_max_age=PARTIAL_MAX_AGE, stripe_timeout=STRIPE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.output_dir = output_dir
+        self.log_dir = log_dir
+        self.on_log = on_log
+        self.on_chunk_log = on_chunk_log
+        self.on_transfer = on_transfer
+        self.verbosity = verbosity
+        self.crc_every = crc_every
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.chunk_store = ChunkStore(store_bytes) if store_bytes else None
+        self.partial_max_age = partial_max_age
+        self.stripe_timeout = stripe_timeout
+        self.sessions = set()
+        self.metrics_port = metrics_port
+        self.registry = MetricsRegistry(extra=self.gauges) if metrics_port is not None else None
+        self.metrics_endpoint = None
+        self.timing = timing
+        self.profile = profile
+        self.udp = udp
+        # Disk writes on a thread per file, write_queue chunks deep (0 writes on the event loop)
+        self.sink_factory = functools.partial(QueuedSink, depth=write_queue) if write_queue else FileSink
+        self.verify_workers = verify_workers
+        self.verifier = None  # ChunkVerifier while serving, if verify_workers
+        self.profiling = False  # a session's profile is running; it covers the whole event loop thread
+        self.profile_ids = itertools.count(1)
+        self.resuming = set()  # file ids whose resumable temp file a session has open
+        self.stripes = {}  # transfer id -> StripedFile still receiving
+        self.session_ids = itertools.count(1)
+        self.loop = None
+        self.stopping = None
+        self.thread = None
+        self.ready = threading.Event()  # set once listening; port then holds the bound port (useful with port=0)
+        self.logger = None
+
+    def open_logs(self):
+        # Create log directory and clear logs only when the server is actually run
+        os.makedirs(self.log_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.logger = BackgroundLogger(os.path.join(self.log_dir, 'reception_log.txt'),
+                                       os.path.join(self.log_dir, 'crc_log.txt'),
+                                       os.path.join(self.log_dir, 'metrics_log.txt'),
+                                       verbosity=self.verbosity, crc_every=self.crc_every)
+
+    def close_logs(self):
+        if self.logger is not None:
+            self.logger.close()
+
+    def log_event(self, msg, level=LOG_TRANSFERS):
+        if not self.logger.enabled(level):
+            return
+        self.logger.log(msg, level)
+        callback = self.on_log if level == LOG_TRANSFERS else self.on_chunk_log
+        if callback:
+            callback(msg)
+
+    def log_crc(self, line):
+        self.logger.crc(line)
+        if self.on_chunk_log:
+            self.on_chunk_log(line)
+
+    def log_metrics(self, session_name, metrics_lines):
+        self.logger.metrics(f'[{session_name}] {line}' for line in metrics_lines)
+
+    def gauges(self):
+        samples = [Sample('gauge', 'arq_server_sessions', 'open client connections', len(self.sessions))]
+        if self.chunk_store is not None:
+            samples.append(Sample('gauge', 'arq_server_chunk_store_bytes', 'bytes held in the chunk store', self.chunk_store.size))
+        return samples
+
+    def start_profile(self):
+        if self.profiling:
+            return None
+        profile = start_profile()
+        self.profiling = profile is not None
+        return profile
+
+    def end_profile(self, profile, session_name=None):
+        """Stop a session's profile, and write it out unless session_name is None (nothing was transferred)."""
+        self.profiling = False
+        if session_name is None:
+            profile.disable()
+            return
+        path = dump_profile(profile, self.log_dir, f'profile_{next(self.profile_ids)}')
+        self.log_event(f'[{session_name}] Profile written to {path}')
+
+    def join_stripe(self, transfer_id, index, count, size, file_ext, session_id):
+        stripe = self.stripes.get(transfer_id)
+        if stripe is None:
+            stripe = self.stripes[transfer_id] = StripedFile(self.output_dir, transfer_id, count, size, file_ext, session_id,
+                                                               self.sink_factory)
+        elif (count, size) != (stripe.count, stripe.size):
+            raise ProtocolError(f'Stripe {index} of {count} of a {size}-byte file joins a transfer of '
+                                f'{stripe.count} stripes of a {stripe.size}-byte file')
+        elif index in stripe.joined:
+            raise ProtocolError(f'Stripe {index} sent twice')
+        elif index == 0:
+            stripe.session_id = session_id
+        stripe.joined.add(index)
+        stripe.attached += 1
+        if stripe.timer is not None:
+            stripe.timer.cancel()
+            stripe.timer = None
+        return stripe
+
+    def stripe_done(self, stripe, index, status, stats):
+        """Record how one stripe ended; once all have, save the file (or drop it) and report the whole transfer."""
+        stripe.outcomes[index] = (status, stats)
+        stripe.attached -= 1
+        if len(stripe.outcomes) < stripe.count:
+            if not stripe.attached:
+                # The rest of the stripes may never come: give up on the file if none arrives in time
+                stripe.timer = self.loop.call_later(self.stripe_timeout, self.expire_stripe, stripe)
+            return
+        self.finish_stripe(stripe)
+
+    def expire_stripe(self, stripe):
+        stripe.timer = None
+        if self.stripes.get(stripe.transfer_id) is stripe:
+            missing = stripe.count - len(stripe.outcomes)
+            self.log_event(f'[#{stripe.session_id} striped] {missing} of {stripe.count} stripes not received '
+                           f'within {self.stripe_timeout} s')
+            self.finish_stripe(stripe, 'failed')
+
+    def finish_stripe(self, stripe, failure='aborted'):
+        del self.stripes[stripe.transfer_id]
+        duration = max(time.time() - stripe.start_time, 1e-9)
+        total = sum(m['bytes'] for _, m in stripe.outcomes.values())
+        stats = {'time': duration, 'throughput': total / duration, 'bytes': total, 'streams': stripe.count}
+        name = f'#{stripe.session_id} striped'
+        path = None
+        if (len(stripe.outcomes) == stripe.count and all(status == 'complete' for status, _ in stripe.outcomes.values())
+                and total == stripe.size):
+            status = 'complete'
+            path = stripe.file.commit(os.path.join(self.output_dir, f'received_file_{stripe.session_id}{stripe.file_ext or ".bin"}'))
+            self.log_event(f'[{name}] Full binary file received over {stripe.count} streams and saved as: {path}')
+        else:
+            status = failure
+            stripe.file.discard()
+            self.log_event(f'[{name}] Striped transfer incomplete; received data discarded.')
+        metrics_lines = stripe.metrics_lines(stats)
+        self.log_metrics(name, metrics_lines)
+        self.transfer_done(TransferResult(name, status, path, stripe.file_ext, None, metrics_lines, stats))
+
+    def transfer_done(self, result):
+        if self.on_transfer:
+            self.on_transfer(result)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.open_logs()
+        if self.partial_max_age:
+            removed, freed = expire_partials(self.output_dir, self.partial_max_age)
+            if removed:
+                self.log_event(f'Deleted {removed} partial file(s), {freed} bytes, untouched for '
+                               f'{self.partial_max_age / 3600:g} hours or more')
+        if self.verify_workers:
+            self.verifier = ChunkVerifier(self.verify_workers)
+        try:
+            if self.udp:
+                _, server = await self.loop.create_datagram_endpoint(lambda: DatagramServer(self),
+                                                                     local_addr=(self.host, self.port))
+                self.port = server.transport.get_extra_info('sockname')[1]
+            else:
+                server = await self.loop.create_server(
+                    lambda: ArqSession(self, next(self.session_ids)),
+                    self.host, self.port, reuse_address=True)
+                self.port = server.sockets[0].getsockname()[1]
+            self.ready.set()
+            self.log_event(f"Server listening on {'UDP ' if self.udp else ''}{self.host}:{self.port}")
+            if self.registry is not None:
+                self.metrics_endpoint = MetricsEndpoint(self.registry, port=self.metrics_port).start()
+                self.log_event(f'Metrics at http://127.0.0.1:{self.metrics_endpoint.port}/metrics')
+            await self.stopping.wait()
+            server.close()
+            for session in list(self.sessions):
+                session.transport.close()
+            if not self.udp:
+                await server.wait_closed()
+            # Let the sessions run connection_lost before the log files close
+            await asyncio.sleep(0)
+            for stripe in self.stripes.values():
+                if stripe.timer is not None:
+                    stripe.timer.cancel()
+                stripe.file.discard()  # stripes that never connected
+            self.log_event('Server stopped.')
+        finally:
+            if self.metrics_endpoint is not None:
+                self.metrics_endpoint.stop()
+            if self.verifier is not None:
+                self.verifier.close()
+            self.close_logs()
+
+    def run(self):
+        """Serve on the calling thread until stop() is called (or KeyboardInterrupt)."""
+        asyncio.run(self.serve())
+
+    def start(self):
+        """Serve on a background thread, e.g. next to a Tk main loop."""
+        self.thread = threading.Thread(target=self.run_logged, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def run_logged(self):
+        try:
+            self.run()
+        except OSError as e:
+            if self.on_log:
+                self.on_log(f'Server error: {e}')
+        finally:
+            self.ready.set()  # never leave a waiter hanging if binding failed
+
+    def stop(self):
+        """Stop serving; safe to call from any thread."""
+        if self.loop is not None and self.stopping is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
@@ -0,0 +1,89 @@
+import struct
+import threading
+import uuid
+from arq_protocol import FRAME_STRIPE, ProtocolError, pack_frame, payload_text
+
+STRIPE_HEADER = struct.Struct('!16sHHQ')  # transfer id, stripe index, stripe count, file size; the file extension follows
+
+
+def stripe_ranges(size, streams, chunk_size):
+    """Split size bytes into at most streams contiguous (start, end) ranges, on chunk boundaries."""
+    per_stream = -(-size // max(1, streams))
+    per_stream = max(1, -(-per_stream // chunk_size)) * chunk_size
+    return [(start, min(start + per_stream, size)) for start in range(0, size, per_stream)]
+
+
+def pack_stripe(transfer_id, index, count, size, file_ext):
+    return pack_frame(FRAME_STRIPE, STRIPE_HEADER.pack(transfer_id, index, count, size) + (file_ext or '').encode())
+
+
+def unpack_stripe(payload):
+    """(transfer id, stripe index, stripe count, file size, file extension or None) from a FRAME_STRIPE payload.
+
+    Raises ProtocolError if it is too short, its index is not below its count, or the extension is not UTF-8.
+    """
+    if len(payload) < STRIPE_HEADER.size:
+        raise ProtocolError(f'Stripe header of {len(payload)} bytes, expected {STRIPE_HEADER.size}')
+    payload = bytes(payload)
+    transfer_id, index, count, size = STRIPE_HEADER.unpack_from(payload)
+    if index >= count:
+        raise ProtocolError(f'Stripe index {index} for a file of {count} stripes')
+    return transfer_id, index, count, size, payload_text(payload[STRIPE_HEADER.size:]) or None
+
+
+def send_striped(socks, chunks, file_ext, make_sender, log_event=print):
+    """Send a file as one stripe per connection, each by its own ArqSender on its own thread.
+
+    chunks is a MappedChunks of the whole file and socks are connected sockets, at most one per
+    stripe is used. make_sender(sock, index) builds the sender for a stream. Every stream first
+    sends FRAME_STRIPE, so the server writes all of them into one file, then runs the usual ARQ
+    loop over its byte range. Returns (True if every stripe got through, the senders).
+    """
+    ranges = stripe_ranges(chunks.size, len(socks), chunks.chunk_size)
+    transfer_id = uuid.uuid4().bytes
+    senders = [make_sender(sock, index) for index, sock in enumerate(socks[:len(ranges)])]
+    results = [False] * len(ranges)
+
+    def run(index):
+        try:
+            senders[index].sock.sendall(pack_stripe(transfer_id, index, len(ranges), chunks.size, file_ext))
+            results[index] = senders[index].transmit(chunks.select([ranges[index]]))
+        except OSError as e:
+            log_event(f'Stream {index}: {e}')
+
+    threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(len(ranges))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return all(results), senders
+
+
+def striped_metrics_lines(senders):
+    """Aggregate throughput over all streams, then one line per stream with its own RTT."""
+    streams = [sender for sender in senders if sender.start_time is not None and sender.end_time is not None]
+    if not streams:
+        return []
+    start = min(sender.start_time for sender in streams)
+    end = max(sender.end_time for sender in streams)
+    duration = end - start if end > start else 1
+    total = sum(sender.total_bytes_acked for sender in streams)
+    lines = [
+        f"Streams: {len(senders)} ({streams[0].mode_name()} each)",
+        f"Total transmission time: {duration:.4f} seconds",
+        f"Aggregate throughput: {total / duration:.2f} bytes/sec ({total} bytes)",
+    ]
+    compressors = [sender.compressor for sender in streams if sender.compressor is not None]
+    if compressors:
+        bytes_in = sum(c.bytes_in for c in compressors)
+        bytes_out = sum(c.bytes_out for c in compressors)
+        lines.append(f"Compression: {compressors[0].describe()}, {bytes_in} -> {bytes_out} bytes "
+                     f"(ratio {bytes_in / bytes_out if bytes_out else 1.0:.2f}), CPU time {sum(c.cpu_time for c in compressors):.4f} s")
+    for index, sender in enumerate(senders):
+        if sender not in streams:
+            lines.append(f"Stream {index}: connection failed")
+            continue
+        m = sender.metrics()
+        lines.append(f"Stream {index}: {m['bytes']} bytes, {m['throughput']:.2f} bytes/sec, average RTT {m['avg_rtt']:.4f} s, "
+                     f"SRTT {sender.rtt.srtt or 0:.4f} s, {m['retransmissions']} retransmissions ({m['timeouts']} timeouts)")
+    return lines
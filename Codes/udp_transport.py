@@ -0,0 +1,97 @@
+import socket
+from arq_protocol import FRAME_HEADER, ProtocolError, check_header, frame_size
+from fec import FEC_BLOCK, PARITY_SIZE
+
+MAX_DATAGRAM = 65507  # largest UDP payload over IPv4
+SOCKET_BUFFER = 4 * 1024 * 1024  # kernel buffers, so a window of chunks is not dropped before it is read
+IDLE_TIMEOUT = 60  # seconds without a datagram before the server drops a UDP session
+
+
+def max_datagram_chunk(fec=False):
+    """Largest chunk whose DATA frame, with FEC check bits if fec, fits in one datagram."""
+    payload = MAX_DATAGRAM - frame_size(0)
+    if not fec:
+        return payload
+    blocks, rest = divmod(payload, FEC_BLOCK + PARITY_SIZE)
+    return blocks * FEC_BLOCK + max(0, rest - PARITY_SIZE)
+
+
+def whole_frame(data):
+    """True if data is exactly one valid frame, as every datagram must be."""
+    if len(data) < FRAME_HEADER.size:
+        return False
+    frame_type, _, _, _, length = FRAME_HEADER.unpack_from(data)
+    try:
+        check_header(frame_type, length)
+    except ProtocolError:
+        return False
+    return len(data) == frame_size(length)
+
+
+def enlarge_buffers(sock):
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER)
+        except OSError:
+            pass  # the kernel caps it; the default still works, with more drops under load
+
+
+class DatagramSocket:
+    """A connected UDP socket with the parts of the socket API that ArqSender and FrameReader use.
+
+    Every frame goes out as one datagram. Incoming datagrams are handed to the frame reader only
+    if they hold exactly one whole frame, so a truncated datagram is dropped (and recovered by the
+    ARQ) instead of throwing the byte stream out of step. Nothing underneath retransmits: lost
+    frames are lost, which is what lets the ARQ's own timers and RTT samples mean something.
+
+    transfer_tag is the number of the transfer in progress, as TRANSFER_BITS flags; ArqSender
+    moves it on after each transfer.
+    """
+
+    type = socket.SOCK_DGRAM
+
+    def __init__(self, address, timeout=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        enlarge_buffers(self.sock)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        self.datagram = bytearray(MAX_DATAGRAM)
+        self.inbox = bytearray()  # frames received but not yet taken by the reader
+        self.transfer_tag = 0
+        self.datagrams_dropped = 0
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def gettimeout(self):
+        return self.sock.gettimeout()
+
+    def sendall(self, data):
+        self.sock.send(data)
+
+    def sendmsg(self, parts):
+        if hasattr(self.sock, 'sendmsg'):
+            return self.sock.sendmsg(parts)
+        return self.sock.send(b''.join(parts))
+
+    def recv_into(self, buffer):
+        view = memoryview(self.datagram)
+        while not self.inbox:
+            n = self.sock.recv_into(self.datagram)
+            if whole_frame(view[:n]):
+                self.inbox += view[:n]
+            else:
+                self.datagrams_dropped += 1
+        n = min(len(buffer), len(self.inbox))
+        buffer[:n] = self.inbox[:n]
+        del self.inbox[:n]
+        return n
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,168 @@
+import queue
+import time
+import traceback
+
+UI_INTERVAL_MS = 100  # how often the Tk main loop drains the bridge
+SCROLLBACK = 2000  # lines a log area keeps; the oldest are dropped
+RATE_SMOOTHING = 0.3  # weight of the newest interval in the smoothed transfer rate
+
+LINE, CHUNK, STATUS, CALL, CLEAR, TRACK = range(6)
+
+
+def format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024 or unit == 'GB':
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1024
+
+
+def describe_progress(done, total, rate):
+    """e.g. '1.2 MB of 3.1 MB (39%), 850.3 KB/s, ETA 2 s'; without a total, just the bytes and the rate."""
+    text = format_bytes(done)
+    if total:
+        text += f' of {format_bytes(total)} ({100 * min(done, total) / total:.0f}%)'
+    if rate:
+        text += f', {format_bytes(rate)}/s'
+        if total and done < total:
+            text += f', ETA {(total - done) / rate:.0f} s'
+    return text
+
+
+def failure(what, error):
+    """Log area line for a UI callback that raised; the traceback goes to stderr as Tk would print it."""
+    traceback.print_exception(type(error), error, error.__traceback__)
+    return f'UI error in {what}: {type(error).__name__}: {error}\n'
+
+
+class UiBridge:
+    """Hands UI work from worker threads to the Tk main loop, which is the only thread allowed to touch Tk.
+
+    The client's transfer thread and the server engine's thread call log(), chunk(), status(),
+    call(), clear() and track(); these only put an item on a queue. Every interval_ms the main
+    loop drains it with after(): all new lines go into the log area with one insert() and one
+    see(), and the area is trimmed to scrollback lines, so its cost stays flat however long a
+    transfer runs. Routine per-chunk lines are not inserted one by one: the label shows the
+    newest, how many came since the last tick, and the progress that track() polls for, with a
+    smoothed rate and an ETA. Everything is also in the log files. A callback or progress() that
+    raises is reported in the log area (and its traceback on stderr) without stopping the pump.
+    """
+
+    def __init__(self, root, log_area, label=None, interval_ms=UI_INTERVAL_MS, scrollback=SCROLLBACK):
+        self.root = root
+        self.log_area = log_area
+        self.label = label
+        self.interval_ms = interval_ms
+        self.scrollback = scrollback
+        self.queue = queue.SimpleQueue()
+        self.progress = None  # callable() -> (bytes done, total bytes or None), polled every tick
+        self.last_sample = None  # (time, bytes done) at the previous tick
+        self.rate = 0.0
+        self.last_chunk = None
+        self.chunk_events = 0
+        self.root.after(self.interval_ms, self.pump)
+
+    # Any thread
+
+    def log(self, msg):
+        self.queue.put((LINE, msg))
+
+    def chunk(self, msg):
+        self.queue.put((CHUNK, msg))
+
+    def status(self, message, color):
+        self.queue.put((STATUS, (message, color)))
+
+    def call(self, callback, *args):
+        """Run callback(*args) on the main loop, after the lines queued before it are shown."""
+        self.queue.put((CALL, (callback, args)))
+
+    def clear(self):
+        self.queue.put((CLEAR, None))
+
+    def track(self, progress):
+        """Show progress() on the label from now on; None stops."""
+        self.queue.put((TRACK, progress))
+
+    # Main loop
+
+    def pump(self):
+        try:
+            self.drain()
+        finally:
+            self.root.after(self.interval_ms, self.pump)
+
+    def drain(self):
+        parts = []  # text, tags, text, tags... for one insert()
+        try:
+            while True:
+                kind, item = self.queue.get_nowait()
+                if kind == LINE:
+                    parts += (item + '\n', ())
+                elif kind == CHUNK:
+                    self.last_chunk = item
+                    self.chunk_events += 1
+                elif kind == STATUS:
+                    message, color = item
+                    tag = f'status_{color}'
+                    self.log_area.tag_config(tag, foreground=color, font=('Arial', 12, 'bold'))
+                    parts += (message + '\n', (tag,))
+                elif kind == CLEAR:
+                    parts = []
+                    self.write(parts, clear=True)
+                elif kind == TRACK:
+                    if self.progress is not None:
+                        self.update_label()  # the final numbers of the transfer that ended
+                    self.progress = item
+                    self.last_sample = None
+                    self.rate = 0.0
+                else:
+                    self.write(parts)
+                    parts = []
+                    callback, args = item
+                    try:
+                        callback(*args)
+                    except Exception as e:
+                        parts += (failure(getattr(callback, '__name__', 'callback'), e), ())
+        except queue.Empty:
+            pass
+        self.write(parts)
+        self.update_label()
+
+    def write(self, parts, clear=False):
+        if not parts and not clear:
+            return
+        parts = parts[-2 * self.scrollback:]  # a burst longer than the scrollback would be trimmed anyway
+        self.log_area.config(state='normal')
+        if clear:
+            self.log_area.delete('1.0', 'end')
+        if parts:
+            self.log_area.insert('end', *parts)
+            excess = int(self.log_area.index('end-1c').split('.')[0]) - 1 - self.scrollback
+            if excess > 0:
+                self.log_area.delete('1.0', f'{excess + 1}.0')
+            self.log_area.see('end')
+        self.log_area.config(state='disabled')
+
+    def update_label(self):
+        if self.label is None:
+            return
+        text = ''
+        if self.progress is not None:
+            try:
+                done, total = self.progress()
+            except Exception as e:
+                self.progress = None  # tracking stops rather than failing every tick
+                self.write([failure('progress', e), ()])
+                return
+            now = time.monotonic()
+            if self.last_sample is not None and now > self.last_sample[0] and done >= self.last_sample[1]:
+                rate = (done - self.last_sample[1]) / (now - self.last_sample[0])
+                self.rate = rate if not self.rate else (1 - RATE_SMOOTHING) * self.rate + RATE_SMOOTHING * rate
+            self.last_sample = (now, done)
+            text = describe_progress(done, total, self.rate)
+        if self.chunk_events:
+            more = f' (+{self.chunk_events - 1} more)' if self.chunk_events > 1 else ''
+            text = f'{text} | {self.last_chunk}{more}' if text else f'{self.last_chunk}{more}'
+            self.chunk_events = 0
+        if text:
+            self.label.config(text=text)
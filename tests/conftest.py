@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules live in Codes/ and import each other as top-level modules, as the scripts run them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Codes'))
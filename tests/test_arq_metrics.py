@@ -0,0 +1,100 @@
+import math
+import random
+import urllib.error
+import urllib.request
+import pytest
+from arq_metrics import Histogram, MetricsEndpoint, MetricsRegistry, Sample, prometheus_text, snr_db, snr_value
+
+
+def test_snr():
+    assert snr_value(1000, 0) == math.inf
+    assert snr_db(1000, 0) == 'Infinity'
+    assert snr_value(1000, 1000) == 0.0
+    assert snr_db(1100, 100) == '10.00'
+
+
+def test_histogram_percentiles_within_one_percent():
+    rng = random.Random(1)
+    values = sorted(rng.expovariate(1 / 0.05) for _ in range(20_000))
+    histogram = Histogram(unit=1e-6)
+    for value in values:
+        histogram.record(value)
+    for q in (50, 95, 99):
+        exact = values[math.ceil(q / 100 * len(values)) - 1]
+        assert histogram.percentile(q) == pytest.approx(exact, rel=0.01)
+    assert histogram.percentile(100) == histogram.max == values[-1]
+    assert histogram.count == len(values)
+    assert len(histogram.counts) < 2000
+
+
+def test_histogram_merge_and_summary():
+    empty = Histogram()
+    assert empty.percentile(50) == 0.0
+    assert empty.summary('Retries') == 'Retries: no samples'
+    a, b = Histogram(), Histogram()
+    a.record(1, count=3)
+    b.record(5)
+    merged = a.copy().merge(b)
+    assert (merged.count, merged.total, merged.max) == (4, 8, 5)
+    assert a.count == 3  # copy() leaves the original alone
+    assert merged.summary('Retries', fmt='{:.0f}', suffix='') == 'Retries: p50 1, p95 5, p99 5, max 5 (4 samples)'
+
+
+class Source:
+    def __init__(self, sent, rtt):
+        self.sent = sent
+        self.rtt = Histogram()
+        self.rtt.record(rtt)
+
+    def samples(self):
+        return [Sample('counter', 'arq_chunks_sent_total', 'Chunks sent', self.sent),
+                Sample('gauge', 'arq_window', 'Window size', 8),
+                Sample('summary', 'arq_rtt_seconds', 'Chunk round-trip time', self.rtt)]
+
+
+def by_name(samples):
+    return {sample.name: sample.value for sample in samples}
+
+
+def test_registry_folds_finished_transfers_into_the_totals():
+    registry = MetricsRegistry(extra=lambda: [Sample('gauge', 'arq_sessions', 'Open sessions', 2)])
+    first, second = Source(10, 0.1), Source(5, 0.3)
+    registry.track(first)
+    registry.finish(first)
+    registry.track(second)
+    values = by_name(registry.collect())
+    assert values['arq_chunks_sent_total'] == 15
+    assert values['arq_window'] == 8  # gauges are not summed
+    assert values['arq_rtt_seconds'].count == 2
+    assert values['arq_sessions'] == 2
+    registry.collect()
+    assert by_name(registry.collect())['arq_rtt_seconds'].count == 2  # collecting does not fold live sources in
+    assert first.rtt.count == 1
+
+
+def test_prometheus_text():
+    histogram = Histogram()
+    histogram.record(2)
+    text = prometheus_text([Sample('counter', 'arq_chunks_total', 'Chunks', 3), Sample('summary', 'arq_rtt', 'RTT', histogram)])
+    assert text.splitlines() == [
+        '# HELP arq_chunks_total Chunks', '# TYPE arq_chunks_total counter', 'arq_chunks_total 3',
+        '# HELP arq_rtt RTT', '# TYPE arq_rtt summary',
+        'arq_rtt{quantile="0.5"} 2', 'arq_rtt{quantile="0.95"} 2', 'arq_rtt{quantile="0.99"} 2',
+        'arq_rtt_sum 2', 'arq_rtt_count 1',
+    ]
+
+
+def test_endpoint_serves_the_registry():
+    registry = MetricsRegistry()
+    source = Source(7, 0.2)
+    registry.track(source)
+    endpoint = MetricsEndpoint(registry).start()
+    try:
+        url = f'http://127.0.0.1:{endpoint.port}'
+        with urllib.request.urlopen(url + '/metrics', timeout=5) as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert 'arq_chunks_sent_total 7' in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other', timeout=5)
+    finally:
+        endpoint.stop()
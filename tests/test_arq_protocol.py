@@ -0,0 +1,51 @@
+import pytest
+from arq_protocol import (FRAME_ACK, FRAME_DATA, FRAME_HEADER, MAX_PAYLOAD, RESPONSE_NACK, FrameReader, ProtocolError, pack_ack,
+                          pack_frame, parse_ack, selectively_acked)
+
+
+def read_all(data):
+    reader = FrameReader()
+    reader.feed(data)
+    frames = []
+    while True:
+        frame = reader.next_frame()
+        if frame is None:
+            return frames
+        frames.append(frame._replace(payload=bytes(frame.payload)))
+
+
+def test_frames_split_across_reads():
+    data = pack_frame(FRAME_DATA, b'hello', seq=1, offset=0) + pack_frame(FRAME_DATA, b'x' * 5000, seq=2, offset=5)
+    reader = FrameReader()
+    frames = []
+    for start in range(0, len(data), 7):
+        reader.feed(data[start:start + 7])
+        while (frame := reader.next_frame()) is not None:
+            frames.append((frame.seq, frame.offset, bytes(frame.payload)))
+    assert frames == [(1, 0, b'hello'), (2, 5, b'x' * 5000)]
+
+
+def test_unknown_frame_type_is_a_protocol_error():
+    with pytest.raises(ProtocolError):
+        read_all(FRAME_HEADER.pack(99, 0, 0, 0, 0) + b'\0' * 4)
+
+
+def test_oversized_frame_is_a_protocol_error():
+    with pytest.raises(ProtocolError):
+        read_all(FRAME_HEADER.pack(FRAME_DATA, 0, 0, 0, MAX_PAYLOAD + 1))
+
+
+def test_ack_round_trip():
+    [frame] = read_all(pack_ack(10, 14, RESPONSE_NACK, received=[12, 14, 20]))
+    assert frame.type == FRAME_ACK
+    ack = parse_ack(frame)
+    assert (ack.cumulative, ack.trigger, ack.flags) == (10, 14, RESPONSE_NACK)
+    assert sorted(selectively_acked(ack)) == [12, 14, 20]
+
+
+def test_ack_without_gap_has_empty_bitmap():
+    [frame] = read_all(pack_ack(5, 4))
+    ack = parse_ack(frame)
+    assert frame.payload == b''
+    assert (ack.cumulative, ack.trigger, ack.bitmap) == (5, 4, 0)
+    assert list(selectively_acked(ack)) == []
@@ -0,0 +1,46 @@
+from arq_sender import SIZER_EPOCH, ChunkSizer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_epoch(sizer, outcomes, nbytes):
+    for ok in outcomes:
+        sizer.record(ok, nbytes)
+
+
+def test_sizer_waits_for_a_full_epoch():
+    sizer = ChunkSizer(4096, clock=Clock())
+    run_epoch(sizer, [False] * (SIZER_EPOCH - 1), 0)
+    assert sizer.decide(0.1, 8) is None
+
+
+def test_sizer_shrinks_on_errors():
+    sizer = ChunkSizer(4096, clock=Clock())
+    run_epoch(sizer, [index % 4 != 0 for index in range(SIZER_EPOCH)], 4096)
+    assert sizer.decide(0.0, 8) == 2048
+    assert sizer.last_error_rate == 0.25
+
+
+def test_sizer_grows_on_a_clean_slow_link():
+    clock = Clock()
+    sizer = ChunkSizer(1024, clock=clock)
+    run_epoch(sizer, [True] * SIZER_EPOCH, 1024)
+    clock.now = 1.0
+    assert sizer.decide(0.1, 1) == 2048
+
+
+def test_sizer_stays_within_bounds():
+    clock = Clock()
+    sizer = ChunkSizer(1024, max_size=1024, clock=clock)
+    run_epoch(sizer, [True] * SIZER_EPOCH, 1024)
+    clock.now = 1.0
+    assert sizer.decide(0.1, 1) is None
+    sizer = ChunkSizer(256, clock=clock)
+    run_epoch(sizer, [False] * SIZER_EPOCH, 0)
+    assert sizer.decide(0.1, 1) is None
@@ -0,0 +1,37 @@
+import pytest
+from arq_simulator import simulate
+
+
+@pytest.mark.parametrize('mode', ['gbn', 'sr'])
+@pytest.mark.parametrize('window', [1, 8])
+def test_clean_transfer(mode, window):
+    success, sender, receiver_end, channel = simulate(200_000, chunk_size=1024, window=window, mode=mode)
+    assert success
+    [stats] = receiver_end.completed
+    assert stats['bytes'] == 200_000
+    assert sender.retransmissions == 0
+
+
+@pytest.mark.parametrize('mode', ['gbn', 'sr'])
+def test_transfer_over_lossy_noisy_link(mode):
+    success, sender, receiver_end, channel = simulate(300_000, chunk_size=1024, window=16, mode=mode, ber=1e-5, loss=0.02,
+                                                      seed=7)
+    assert success
+    assert receiver_end.completed[-1]['bytes'] == 300_000
+    assert sender.retransmissions > 0
+
+
+def test_adaptive_chunks():
+    success, sender, receiver_end, channel = simulate(500_000, chunk_size=1024, window=8, mode='sr', adaptive_chunks=True,
+                                                      delay=0.01)
+    assert success
+    assert receiver_end.completed[-1]['bytes'] == 500_000
+    assert [size for _, _, size in sender.chunk_sizes][:3] == [1024, 2048, 4096]  # a clean link with a long RTT favours bigger chunks
+
+
+
+def test_fec_repairs_bit_errors():
+    success, sender, receiver_end, channel = simulate(300_000, chunk_size=1024, window=8, mode='sr', ber=1e-5, seed=3, fec=True)
+    assert success
+    assert receiver_end.completed[-1]['bytes'] == 300_000
+    assert receiver_end.completed[-1]['chunks_corrected'] > 0
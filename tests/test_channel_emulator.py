@@ -0,0 +1,113 @@
+from arq_protocol import FRAME_DATA, FRAME_EOT, FRAME_HEADER, frame_size, pack_frame
+from channel_emulator import UP, GilbertElliott, Link
+
+
+class FakeLoop:
+    """Just enough of an asyncio loop for a Link, on a virtual clock."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.timers = []
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback):
+        self.timers.append((when, callback))
+
+    def run(self):
+        while self.timers:
+            self.timers.sort(key=lambda timer: timer[0])
+            when, callback = self.timers.pop(0)
+            self.now = max(self.now, when)
+            callback()
+
+
+class LoseFrames:
+    """A channel that loses the frames at the given positions and passes the rest untouched."""
+
+    def __init__(self, *lost):
+        self.lost = set(lost)
+        self.frames = 0
+
+    def apply(self, frame, lossy=True, corruptible=True):
+        self.frames += 1
+        return None if lossy and self.frames in self.lost else frame
+
+
+def deliveries(link_options, frames, channel):
+    loop = FakeLoop()
+    delivered = []
+    link = Link(loop, UP, lambda frame: delivered.append((loop.time(), frame)), channel=channel, **link_options)
+    for frame in frames:
+        link.send(frame)
+    loop.run()
+    return delivered
+
+
+def test_lost_frame_is_dropped():
+    frames = [pack_frame(FRAME_DATA, bytes([index]) * 10, seq=index) for index in range(3)]
+    delivered = deliveries({'delay': 0.01}, frames, LoseFrames(2))
+    assert [frame for _, frame in delivered] == [frames[0], frames[2]]
+
+
+def test_stall_holds_up_the_frames_behind_a_lost_one():
+    frames = [pack_frame(FRAME_DATA, bytes([index]) * 10, seq=index) for index in range(3)]
+    delivered = deliveries({'delay': 0.01, 'control_loss': True, 'stall': 0.2}, frames, LoseFrames(2))
+    assert [frame for _, frame in delivered] == frames
+    assert [round(when, 6) for when, _ in delivered] == [0.01, 0.21, 0.21]
+
+
+def test_control_frames_only_lost_with_control_loss():
+    eot = pack_frame(FRAME_EOT)
+    assert deliveries({}, [eot], LoseFrames(1)) == [(0.0, eot)]
+    assert deliveries({'control_loss': True}, [eot], LoseFrames(1)) == []
+
+
+def test_gilbert_elliott_burst_lengths():
+    channel = GilbertElliott(p_good_bad=0.01, p_bad_good=0.1, seed=1)
+    bursts = []
+    length = 0
+    for _ in range(100_000):
+        channel.step()
+        if channel.bad:
+            length += 1
+        elif length:
+            bursts.append(length)
+            length = 0
+    assert channel.frames == 100_000
+    # Bad bursts last 1 / p_bad_good frames on average, and the bad state holds p_gb / (p_gb + p_bg) of the time
+    assert 9 < sum(bursts) / len(bursts) < 11
+    assert 0.08 < channel.bad_frames / channel.frames < 0.1
+
+
+def test_gilbert_elliott_loses_and_corrupts_in_the_bad_state_only():
+    channel = GilbertElliott(p_good_bad=1, p_bad_good=0, loss_bad=0.5, ber_bad=1e-2, seed=2)
+    frame = pack_frame(FRAME_DATA, bytes(1000))
+    out = [channel.apply(frame) for _ in range(200)]
+    lost = out.count(None)
+    assert lost == channel.frames_lost and 60 < lost < 140
+    delivered = [f for f in out if f is not None]
+    assert all(len(f) == len(frame) and f[:FRAME_HEADER.size] == frame[:FRAME_HEADER.size] and f[-4:] == frame[-4:]
+               for f in delivered)
+    assert channel.frames_corrupted == sum(f != frame for f in delivered) > 0
+    clean = GilbertElliott(loss_bad=1, ber_bad=1, seed=3)  # never leaves the good state
+    assert all(clean.apply(frame) == frame for _ in range(100))
+    assert clean.bad_frames == 0
+
+
+def test_bandwidth_serialises_frames():
+    frames = [pack_frame(FRAME_DATA, bytes(125 - frame_size(0))) for _ in range(3)]  # 1000 bits, 1 ms each at 1 Mbit/s
+    delivered = deliveries({'delay': 0.01, 'bandwidth': 1e6}, frames, None)
+    assert [round(when, 6) for when, _ in delivered] == [0.011, 0.012, 0.013]
+
+
+def test_link_closes_behind_queued_frames():
+    loop = FakeLoop()
+    delivered = []
+    link = Link(loop, UP, delivered.append, delay=0.01)
+    frame = pack_frame(FRAME_DATA, b'x')
+    link.send(frame)
+    link.close()
+    loop.run()
+    assert delivered == [frame, None]
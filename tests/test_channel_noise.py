@@ -0,0 +1,77 @@
+import random
+import pytest
+import channel_noise
+from channel_noise import BitErrorChannel, ChunkErrorChannel, make_channel
+
+
+def differing_bits(a, b):
+    return sum(bin(x ^ y).count('1') for x, y in zip(a, b))
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def use_numpy(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(channel_noise, 'np', None)
+    return request.param == 'numpy'
+
+
+def test_rejects_bad_rates():
+    with pytest.raises(ValueError):
+        BitErrorChannel(1.5)
+    with pytest.raises(ValueError):
+        ChunkErrorChannel(-0.1)
+
+
+def test_clean_channel_returns_chunks_as_they_are(use_numpy):
+    channel = BitErrorChannel(0)
+    chunk = bytes(1000)
+    assert channel.corrupt(chunk) == (chunk, 0)
+    assert channel.corrupt(chunk)[0] is chunk
+    assert channel.corrupt_batch([chunk, chunk]) == [(chunk, 0), (chunk, 0)]
+    assert channel.bits_seen == 4 * 8000
+
+
+def test_reported_flips_match_the_data(use_numpy):
+    channel = BitErrorChannel(1e-3, seed=1)
+    chunks = [random.Random(n).randbytes(1000) for n in range(50)]
+    flips = corrupted = 0
+    for chunk in chunks:
+        noisy, flipped = channel.corrupt(chunk)
+        assert differing_bits(chunk, noisy) == flipped
+        flips += flipped
+        corrupted += flipped > 0
+    assert (channel.bits_flipped, channel.chunks_corrupted) == (flips, corrupted)
+    # 400 000 bits at 1e-3: 400 errors expected
+    assert 300 < flips < 500
+
+
+def test_batch_matches_chunk_by_chunk(use_numpy):
+    rng = random.Random(2)
+    chunks = [rng.randbytes(rng.randrange(1, 2000)) for _ in range(100)]
+    one_by_one = BitErrorChannel(5e-4, seed=3)
+    batched = BitErrorChannel(5e-4, seed=3)
+    expected = [one_by_one.corrupt(chunk) for chunk in chunks]
+    assert batched.corrupt_batch(chunks[:40]) + batched.corrupt_batch(chunks[40:]) == expected
+    assert (batched.bits_seen, batched.bits_flipped, batched.chunks_corrupted) == \
+           (one_by_one.bits_seen, one_by_one.bits_flipped, one_by_one.chunks_corrupted)
+
+
+def test_every_bit_flips_at_ber_one(use_numpy):
+    channel = BitErrorChannel(1)
+    assert channel.corrupt_batch([b'\x00\xff', b'\x0f']) == [(b'\xff\x00', 16), (b'\xf0', 8)]
+
+
+def test_chunk_error_channel_flips_one_bit():
+    channel = ChunkErrorChannel(1, seed=1)
+    chunk = bytes(100)
+    noisy, flipped = channel.corrupt(chunk)
+    assert flipped == 1 and differing_bits(chunk, noisy) == 1
+    assert ChunkErrorChannel(0).corrupt_batch([chunk]) == [(chunk, 0)]
+
+
+def test_make_channel():
+    assert make_channel() is None
+    assert isinstance(make_channel(error_prob=0.1), ChunkErrorChannel)
+    assert isinstance(make_channel(error_prob=0.1, ber=1e-5), BitErrorChannel)
@@ -0,0 +1,31 @@
+import pytest
+from chunk_store import OFFER_BATCH, ChunkStore, chunk_hash, pack_held, pack_offer, unpack_held, unpack_offer
+
+
+def test_offer_round_trip():
+    hashes = [chunk_hash(bytes([index])) for index in range(3)]
+    assert unpack_offer(pack_offer(2500, 1000, 0, hashes)) == (2500, 1000, 0, hashes)
+    assert unpack_held(pack_held([True, False, True]), 3) == [True, False, True]
+
+
+@pytest.mark.parametrize('payload', [
+    pack_offer(2500, 0, 0, [b'h' * 32] * 3),  # no chunk size
+    pack_offer(2500, 1000, 0, [b'h' * 32] * 2),  # too few hashes
+    pack_offer(2500, 1000, 0, [b'h' * 32] * 3) + b'x',  # partial hash
+    pack_offer(OFFER_BATCH * 2, 1, 1, [b'h' * 32] * OFFER_BATCH),  # batch not at a batch boundary
+    b'short',
+])
+def test_bad_offers_rejected(payload):
+    with pytest.raises(ValueError):
+        unpack_offer(payload)
+
+
+def test_store_evicts_least_recently_used():
+    store = ChunkStore(capacity=3000)
+    chunks = [bytes([index]) * 1000 for index in range(4)]
+    for chunk in chunks[:3]:
+        store.put(chunk)
+    store.get(chunk_hash(chunks[0]))
+    store.put(chunks[3])
+    assert store.get(chunk_hash(chunks[1])) is None
+    assert store.get(chunk_hash(chunks[0])) == chunks[0]
@@ -0,0 +1,32 @@
+import random
+import pytest
+from compression import ChunkCompressor, ChunkDecompressor, available_codecs, compress_raw
+
+
+@pytest.mark.parametrize('codec', available_codecs())
+def test_round_trip(codec):
+    compressor = ChunkCompressor(codec)
+    decompressor = ChunkDecompressor(codec)
+    text = b'the quick brown fox jumps over the lazy dog ' * 50
+    noise = random.Random(1).randbytes(2000)
+    for chunk in (text, noise, text[:100]):
+        packed, compressed = compressor.compress(chunk)
+        assert decompressor.decompress(packed) == chunk if compressed else packed == chunk
+    assert compressor.chunks_compressed >= 1
+    assert compressor.chunks_raw >= 1  # random bytes do not shrink
+
+
+@pytest.mark.parametrize('codec', available_codecs())
+def test_output_limited_to_chunk_size(codec):
+    decompressor = ChunkDecompressor(codec)
+    bomb = compress_raw(codec, b'\0' * 10_000_000, 1)
+    assert decompressor.decompress(bomb, 4096) is None
+    packed = compress_raw(codec, b'a' * 4096, 1)
+    assert decompressor.decompress(packed, 4096) == b'a' * 4096
+    assert decompressor.decompress(packed, 4095) is None
+
+
+@pytest.mark.parametrize('codec', available_codecs())
+def test_damaged_data_does_not_decode(codec):
+    packed = compress_raw(codec, b'hello world ' * 100, 1)
+    assert ChunkDecompressor(codec).decompress(packed[:len(packed) // 2]) is None
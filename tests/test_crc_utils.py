@@ -0,0 +1,42 @@
+import random
+import pytest
+from crc_utils import (crc16_ccitt, crc16_ccitt_batch, crc16_ccitt_bitwise, crc16_ccitt_numpy, crc16_ccitt_sliced,
+                       crc16_ccitt_table, crc32, crc32_batch, np)
+
+SAMPLES = [b'', b'\x00', b'123456789', bytes(range(256)), random.Random(1).randbytes(1000), random.Random(2).randbytes(4099)]
+
+
+@pytest.mark.parametrize('data', SAMPLES)
+@pytest.mark.parametrize('variant', [crc16_ccitt_table, crc16_ccitt_sliced, crc16_ccitt])
+def test_crc16_variants_match_bitwise(variant, data):
+    assert variant(data) == crc16_ccitt_bitwise(data)
+
+
+@pytest.mark.parametrize('variant', [crc16_ccitt_table, crc16_ccitt_sliced, crc16_ccitt])
+def test_crc16_other_polynomial_and_init(variant):
+    data = random.Random(3).randbytes(777)
+    assert variant(data, 0x8005, 0) == crc16_ccitt_bitwise(data, 0x8005, 0)
+
+
+def test_crc16_check_value():
+    assert crc16_ccitt_bitwise(b'123456789') == 0x29B1  # CRC-16/CCITT-FALSE
+
+
+def test_crc16_batch():
+    chunks = [random.Random(seed).randbytes(size) for seed, size in enumerate([64, 64, 100, 0, 64])]
+    expected = [crc16_ccitt_bitwise(chunk) for chunk in chunks]
+    assert crc16_ccitt_batch(chunks) == expected
+    assert crc16_ccitt_batch(chunks, use_numpy=False) == expected
+
+
+@pytest.mark.skipif(np is None, reason='NumPy is not installed')
+def test_crc16_numpy_matches_bitwise():
+    chunks = [random.Random(seed).randbytes(128) for seed in range(5)]
+    assert crc16_ccitt_numpy(chunks) == [crc16_ccitt_bitwise(chunk) for chunk in chunks]
+    assert crc16_ccitt_batch(chunks, 0x8005, 0, use_numpy=True) == [crc16_ccitt_bitwise(chunk, 0x8005, 0) for chunk in chunks]
+
+
+def test_crc32():
+    assert crc32(b'123456789') == 0xCBF43926
+    chunks = SAMPLES[:4]
+    assert crc32_batch(chunks) == [crc32(chunk) for chunk in chunks]
@@ -0,0 +1,44 @@
+import random
+import pytest
+import fec
+
+
+def flip(data, bit):
+    data = bytearray(data)
+    data[bit // 8] ^= 1 << (bit % 8)
+    return bytes(data)
+
+
+@pytest.mark.parametrize('size', [1, 255, 256, 257, 1024, 1000])
+def test_round_trip(size):
+    data = random.Random(size).randbytes(size)
+    parity = fec.encode(data)
+    assert len(parity) == fec.parity_length(size)
+    assert fec.split(data + parity) == (data, parity)
+    assert fec.repair(data, parity) == (data, 0)
+
+
+@pytest.mark.parametrize('bit', [0, 7, 8, 1000, 2047, 2048, 4000, 8191])
+def test_single_bit_error_repaired(bit):
+    data = random.Random(bit).randbytes(1024)
+    parity = fec.encode(data)
+    repaired, corrected = fec.repair(flip(data, bit), parity)
+    assert bytes(repaired) == data
+    assert corrected == 1
+
+
+def test_one_error_per_block_repaired():
+    data = random.Random(5).randbytes(1024)
+    parity = fec.encode(data)
+    damaged = data
+    for block in range(4):
+        damaged = flip(damaged, block * fec.FEC_BLOCK * 8 + 3 * block + 1)
+    repaired, corrected = fec.repair(damaged, parity)
+    assert bytes(repaired) == data
+    assert corrected == 4
+
+
+def test_double_bit_error_detected():
+    data = random.Random(6).randbytes(256)
+    parity = fec.encode(data)
+    assert fec.repair(flip(flip(data, 10), 20), parity) == (None, 0)
@@ -0,0 +1,113 @@
+import random
+import socket
+import threading
+import time
+import pytest
+import fec
+from arq_logging import LOG_ERRORS
+from arq_protocol import DATA_FEC, FRAME_DATA, FRAME_END, FRAME_META, FrameReader, pack_frame
+from arq_sender import ArqSender
+from crc_utils import crc32
+from file_chunker import open_chunks
+from receive_pipeline import ChunkVerifier, QueuedSink
+from server_engine import ServerEngine
+
+TIMEOUT = 5
+
+
+def parse(*frames):
+    reader = FrameReader()
+    reader.feed(b''.join(frames))
+    parsed = []
+    while (frame := reader.next_frame()) is not None:
+        parsed.append(frame)
+    return parsed
+
+
+@pytest.fixture
+def verifier():
+    verifier = ChunkVerifier(2)
+    yield verifier
+    verifier.close()
+
+
+def test_verifier_matches_inline_crcs(verifier):
+    rng = random.Random(1)
+    chunks = [rng.randbytes(16 * 1024) for _ in range(6)]
+    frames = parse(pack_frame(FRAME_META, b'.bin'),
+                   *(pack_frame(FRAME_DATA, chunk, seq=seq) for seq, chunk in enumerate(chunks[:3])),
+                   *(pack_frame(FRAME_DATA, chunk + fec.encode(chunk), seq=seq, flags=DATA_FEC) for seq, chunk in enumerate(chunks[3:], 3)))
+    assert verifier.crcs(frames) == [None] + [crc32(chunk) for chunk in chunks]
+
+
+def test_verifier_leaves_small_batches_inline(verifier):
+    assert verifier.crcs(parse(pack_frame(FRAME_DATA, bytes(60_000)))) is None  # one chunk
+    assert verifier.crcs(parse(*(pack_frame(FRAME_DATA, bytes(1024), seq=seq) for seq in range(100)))) is None
+
+
+def test_transfer_with_verify_workers(tmp_path):
+    log = []
+    engine = ServerEngine('127.0.0.1', 0, output_dir=str(tmp_path / 'out'), log_dir=str(tmp_path / 'logs'), on_log=log.append,
+                          on_transfer=log.append, verbosity=LOG_ERRORS, crc_every=0, verify_workers=2)
+    engine.start()
+    engine.ready.wait(TIMEOUT)
+    try:
+        path = tmp_path / 'in.bin'
+        data = random.Random(2).randbytes(500_000)
+        path.write_bytes(data)
+        with socket.create_connection(('127.0.0.1', engine.port), timeout=TIMEOUT) as sock:
+            sender = ArqSender(sock, window=16, mode='sr', log_event=lambda msg: None)
+            sender.announce_file_type('.bin')
+            with open_chunks(str(path), 16 * 1024) as chunks:
+                assert sender.transmit(chunks)
+            sock.sendall(pack_frame(FRAME_END))
+        deadline = time.monotonic() + TIMEOUT
+        while not any(not isinstance(item, str) for item in log) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        [result] = [item for item in log if not isinstance(item, str)]
+        assert result.status == 'complete'
+        with open(result.path, 'rb') as f:
+            assert f.read() == data
+    finally:
+        engine.stop()
+        engine.thread.join(TIMEOUT)
+
+
+@pytest.fixture
+def sink(tmp_path):
+    sink = QueuedSink(str(tmp_path), depth=4)
+    yield sink
+    sink.discard()
+
+
+def test_backlog_and_drain(sink):
+    release = threading.Event()
+    sink.after_writes(release.wait, TIMEOUT)  # holds up the writer thread
+    for offset in range(0, 300, 100):
+        sink.write_at(offset, b'x' * 100)
+    assert sink.backlogged()
+    drained = threading.Event()
+    sink.when_drained(drained.set)
+    assert not drained.is_set()
+    release.set()
+    assert drained.wait(TIMEOUT)
+    sink.close()
+    with open(sink.temp_path, 'rb') as f:
+        assert f.read() == b'x' * 300
+
+
+def test_when_drained_calls_back_at_once_without_a_backlog(sink):
+    called = []
+    sink.when_drained(lambda: called.append(True))
+    assert called == [True]
+
+
+def test_write_error_is_raised_later(sink):
+    def fail():
+        raise OSError('disk full')
+
+    sink.after_writes(fail)
+    sink.flush()
+    sink.close()
+    with pytest.raises(OSError, match='disk full'):
+        sink.write_at(0, b'x')
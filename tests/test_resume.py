@@ -0,0 +1,91 @@
+import os
+import random
+import pytest
+from arq_protocol import ProtocolError
+from arq_receiver import FileSink
+from crc_utils import crc32
+from receive_pipeline import QueuedSink
+from resume import Manifest, missing_ranges, pack_resume_request, unpack_resume_request
+
+FID = bytes(range(16))
+
+
+def test_manifest_round_trip(tmp_path):
+    manifest = Manifest(tmp_path, FID, 3000, 1000, '.bin')
+    assert manifest.open() == []
+    open(manifest.data_path, 'wb').close()
+    for offset in (0, 2000):
+        manifest.add(offset, 1000, 0x1234 + offset)
+    manifest.close()
+    reopened = Manifest(tmp_path, FID, 3000, 1000)
+    assert reopened.open() == [(0, 1000, 0x1234), (2000, 1000, 0x1234 + 2000)]
+    assert reopened.file_ext == '.bin'
+    reopened.close()
+
+
+def test_manifest_ignores_torn_line(tmp_path):
+    manifest = Manifest(tmp_path, FID, 3000, 1000)
+    manifest.open()
+    open(manifest.data_path, 'wb').close()
+    manifest.add(0, 1000, 1)
+    manifest.close()
+    with open(manifest.path, 'a') as f:
+        f.write('1000 1000')  # cut short by a crash
+    reopened = Manifest(tmp_path, FID, 3000, 1000)
+    assert reopened.open() == [(0, 1000, 1)]
+    reopened.close()
+
+
+@pytest.mark.parametrize('line', ['1000 1000 zz\n', 'x 1000 1\n', '2500 1000 1\n', '-1 1000 1\n'])
+def test_manifest_stops_at_corrupted_line(tmp_path, line):
+    manifest = Manifest(tmp_path, FID, 3000, 1000)
+    manifest.open()
+    open(manifest.data_path, 'wb').close()
+    manifest.add(0, 1000, 1)
+    manifest.close()
+    with open(manifest.path, 'a') as f:
+        f.write(line + '2000 1000 2\n')
+    reopened = Manifest(tmp_path, FID, 3000, 1000)
+    assert reopened.open() == [(0, 1000, 1)]
+    reopened.close()
+
+
+def test_manifest_for_other_size_starts_over(tmp_path):
+    manifest = Manifest(tmp_path, FID, 3000, 1000)
+    manifest.open()
+    open(manifest.data_path, 'wb').close()
+    manifest.add(0, 1000, 1)
+    manifest.close()
+    other = Manifest(tmp_path, FID, 5000, 1000)
+    assert other.open() == []
+    other.remove()
+
+
+def test_missing_ranges_checks_crcs():
+    data = random.Random(1).randbytes(4000)
+    held = [(0, 1000, crc32(data[:1000])), (1000, 1000, 0), (3000, 1000, crc32(data[3000:]))]
+    assert missing_ranges(held, memoryview(data)) == ([(1000, 3000)], 2000)
+
+
+def test_resume_request_round_trip():
+    assert unpack_resume_request(pack_resume_request(FID, 3000, 1000)) == (FID, 3000, 1000)
+
+
+@pytest.mark.parametrize('payload', [b'', pack_resume_request(FID, 3000, 1000)[:-1], pack_resume_request(FID, 3000, 1000) + b'x',
+                                     pack_resume_request(FID, 3000, 0), pack_resume_request(FID, 3000, 1 << 20)])
+def test_malformed_resume_request(payload):
+    with pytest.raises(ProtocolError):
+        unpack_resume_request(payload)
+
+
+@pytest.mark.parametrize('sink_type', [FileSink, QueuedSink])
+def test_manifest_batch_waits_for_the_data_to_be_synced(tmp_path, monkeypatch, sink_type):
+    events = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: (events.append('fsync'), fsync(fd)))
+    sink = sink_type(str(tmp_path))
+    sink.write_at(0, b'x' * 1000)
+    sink.after_writes(events.append, 'manifest')
+    sink.close()
+    sink.discard()
+    assert events == ['fsync', 'manifest']
@@ -0,0 +1,118 @@
+import socket
+import time
+import pytest
+from arq_logging import LOG_ERRORS
+from arq_protocol import (FRAME_ABORT, FRAME_ACK, FRAME_CHUNK_SIZE, FRAME_COMPRESS, FRAME_DATA, FRAME_DEDUP, FRAME_END, FRAME_EOT,
+                          FRAME_META, FRAME_RESUME, FRAME_STRIPE, FrameReader, pack_frame)
+from server_engine import ServerEngine
+from udp_transport import DatagramSocket
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    engines = []
+
+    def make(**options):
+        log = []
+        engine = ServerEngine('127.0.0.1', 0, output_dir=str(tmp_path / 'out'), log_dir=str(tmp_path / 'logs'),
+                              on_log=log.append, verbosity=LOG_ERRORS, crc_every=0, **options)
+        engine.log = log
+        engine.start()
+        engine.ready.wait(TIMEOUT)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.stop()
+        engine.thread.join(TIMEOUT)
+
+
+@pytest.fixture
+def engine(make_engine):
+    return make_engine()
+
+
+def connect(engine):
+    sock = socket.create_connection(('127.0.0.1', engine.port), timeout=TIMEOUT)
+    return sock, FrameReader(sock)
+
+
+def replies(sock, reader):
+    """Types of the frames the server sends until it closes the connection."""
+    types = []
+    while (frame := reader.read_frame()) is not None:
+        types.append(frame.type)
+    sock.close()
+    return types
+
+
+def wait_for_log(engine, text):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        if any(text in line for line in engine.log):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.mark.parametrize('payload', [b'', b'short', bytes(28) + b'x', bytes(24) + bytes(4)])
+def test_malformed_resume_request_answered_with_abort(engine, payload):
+    sock, reader = connect(engine)
+    sock.sendall(pack_frame(FRAME_META, b'.bin') + pack_frame(FRAME_RESUME, payload))
+    assert replies(sock, reader) == [FRAME_ABORT]
+
+
+@pytest.mark.parametrize('frame_type, payload, expected, error', [
+    (FRAME_META, b'\xff\xfe', [], True),
+    (FRAME_COMPRESS, b'zl\xc3', [], True),
+    (FRAME_CHUNK_SIZE, b'', [], True),
+    (FRAME_CHUNK_SIZE, (1 << 20).to_bytes(4, 'big'), [], True),
+    (FRAME_RESUME, b'short', [FRAME_ABORT], True),
+    (FRAME_STRIPE, b'short', [], True),
+    (FRAME_STRIPE, bytes(16) + b'\0\0\0\0' + bytes(8), [], True),  # no stripes
+    (FRAME_DEDUP, b'short', [FRAME_ABORT], False),  # the offer is refused, and the connection stays open until END
+    (FRAME_EOT, b'junk', [FRAME_EOT], False),
+    (FRAME_ABORT, b'junk', [FRAME_ABORT], False),
+])
+def test_malformed_control_frames(engine, frame_type, payload, expected, error):
+    sock, reader = connect(engine)
+    sock.sendall(pack_frame(frame_type, payload) + pack_frame(FRAME_END))
+    assert replies(sock, reader) == expected
+    if error:
+        assert wait_for_log(engine, 'Protocol error')
+    else:
+        assert wait_for_log(engine, 'End signal received')
+
+
+def test_malformed_frame_over_udp(make_engine):
+    engine = make_engine(udp=True)
+    sock = DatagramSocket(('127.0.0.1', engine.port))
+    try:
+        sock.sendall(pack_frame(FRAME_META, b'\xff'))
+        assert wait_for_log(engine, 'Protocol error')
+        sock.settimeout(TIMEOUT)
+        sock.sendall(pack_frame(FRAME_META, b'.bin'))  # a new session answers
+        assert FrameReader(sock).read_frame().type == FRAME_META
+    finally:
+        sock.close()
+
+
+def test_ack_sent_early_cancels_the_coalescing_timer(make_engine):
+    delay = 0.3
+    engine = make_engine(ack_delay=delay)
+    sock, reader = connect(engine)
+    sock.sendall(pack_frame(FRAME_DATA, b'a' * 100))
+    time.sleep(delay / 6)
+    sock.sendall(pack_frame(FRAME_EOT))  # sends the owed ACK at once, ahead of the EOT echo
+    assert [reader.read_frame().type for _ in range(2)] == [FRAME_ACK, FRAME_EOT]
+    time.sleep(delay / 6)
+    sent = time.monotonic()
+    sock.sendall(pack_frame(FRAME_DATA, b'b' * 100))  # the next transfer's first chunk
+    assert reader.read_frame().type == FRAME_ACK
+    # Coalesced for the full delay, not sent by the first chunk's stale timer
+    assert time.monotonic() - sent >= delay * 0.9
+    sock.sendall(pack_frame(FRAME_END))
+    assert replies(sock, reader) == []
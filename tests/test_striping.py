@@ -0,0 +1,128 @@
+import os
+import random
+import socket
+import time
+import pytest
+from arq_logging import LOG_ERRORS
+from arq_protocol import FRAME_DATA, FRAME_END, FRAME_STRIPE, FrameReader, ProtocolError, pack_frame
+from arq_sender import ArqSender
+from file_chunker import open_chunks
+from server_engine import ServerEngine
+from striping import STRIPE_HEADER, pack_stripe, send_striped, stripe_ranges, unpack_stripe
+
+TIMEOUT = 5
+TID = bytes(range(16))
+
+
+def test_stripe_ranges_cover_the_file_on_chunk_boundaries():
+    ranges = stripe_ranges(10_000, 3, 1024)
+    assert ranges == [(0, 4096), (4096, 8192), (8192, 10_000)]
+    assert stripe_ranges(1000, 4, 1024) == [(0, 1000)]
+
+
+def test_stripe_round_trip():
+    frame = FrameReader()
+    frame.feed(pack_stripe(TID, 1, 3, 5000, '.jpg'))
+    payload = frame.next_frame().payload
+    assert unpack_stripe(payload) == (TID, 1, 3, 5000, '.jpg')
+    assert unpack_stripe(STRIPE_HEADER.pack(TID, 0, 1, 10)) == (TID, 0, 1, 10, None)
+
+
+@pytest.mark.parametrize('payload', [
+    b'',
+    STRIPE_HEADER.pack(TID, 0, 1, 10)[:-1],
+    STRIPE_HEADER.pack(TID, 0, 0, 10),  # no stripes
+    STRIPE_HEADER.pack(TID, 3, 3, 10),  # index past the count
+    STRIPE_HEADER.pack(TID, 0, 2, 10) + b'\xff',  # extension not UTF-8
+])
+def test_malformed_stripe_header(payload):
+    with pytest.raises(ProtocolError):
+        unpack_stripe(payload)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    log = []
+    engine = ServerEngine('127.0.0.1', 0, output_dir=str(tmp_path / 'out'), log_dir=str(tmp_path / 'logs'), on_log=log.append,
+                          on_transfer=log.append, verbosity=LOG_ERRORS, crc_every=0, stripe_timeout=0.2)
+    engine.log = log
+    engine.start()
+    engine.ready.wait(TIMEOUT)
+    yield engine
+    engine.stop()
+    engine.thread.join(TIMEOUT)
+
+
+def connect(engine):
+    return socket.create_connection(('127.0.0.1', engine.port), timeout=TIMEOUT)
+
+
+def wait_for(engine, predicate):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        for item in list(engine.log):
+            if predicate(item):
+                return item
+        time.sleep(0.01)
+    return None
+
+
+def is_result(item):
+    return not isinstance(item, str)  # a TransferResult, not a log line
+
+
+def partial_files(engine):
+    return [name for name in os.listdir(engine.output_dir) if name.endswith('.part')]
+
+
+def closed_by_server(sock):
+    try:
+        return FrameReader(sock).read_frame() is None
+    finally:
+        sock.close()
+
+
+def test_striped_transfer(engine, tmp_path):
+    path = tmp_path / 'in.bin'
+    data = random.Random(1).randbytes(300_000)
+    path.write_bytes(data)
+    socks = [connect(engine) for _ in range(3)]
+    with open_chunks(str(path), 4096) as chunks:
+        success, senders = send_striped(socks, chunks, '.bin', lambda sock, index: ArqSender(sock, window=8, mode='sr',
+                                                                                             log_event=lambda msg: None))
+    for sock in socks:
+        sock.sendall(pack_frame(FRAME_END))
+        sock.close()
+    assert success
+    result = wait_for(engine, is_result)
+    assert result.status == 'complete'
+    with open(result.path, 'rb') as f:
+        assert f.read() == data
+    assert partial_files(engine) == []
+
+
+def test_stripe_that_does_not_match_its_file_is_rejected(engine):
+    first = connect(engine)
+    first.sendall(pack_frame(FRAME_STRIPE, STRIPE_HEADER.pack(TID, 0, 2, 1000)))
+    for header in (STRIPE_HEADER.pack(TID, 1, 3, 1000), STRIPE_HEADER.pack(TID, 1, 2, 2000), STRIPE_HEADER.pack(TID, 0, 2, 1000)):
+        sock = connect(engine)
+        sock.sendall(pack_frame(FRAME_STRIPE, header))
+        assert closed_by_server(sock)
+    first.close()
+    assert wait_for(engine, is_result).status in ('aborted', 'failed')
+
+
+def test_chunk_outside_the_file_is_rejected(engine):
+    sock = connect(engine)
+    sock.sendall(pack_frame(FRAME_STRIPE, STRIPE_HEADER.pack(TID, 0, 1, 1000)) + pack_frame(FRAME_DATA, b'x' * 100, offset=1 << 62))
+    assert closed_by_server(sock)
+    assert wait_for(engine, is_result).status == 'aborted'
+    assert partial_files(engine) == []
+
+
+def test_missing_stripes_time_out(engine):
+    sock = connect(engine)
+    sock.sendall(pack_frame(FRAME_STRIPE, STRIPE_HEADER.pack(TID, 0, 2, 1000)) + pack_frame(FRAME_DATA, b'x' * 500))
+    sock.close()
+    assert wait_for(engine, is_result).status == 'failed'
+    assert partial_files(engine) == []
@@ -0,0 +1,148 @@
+import random
+import socket
+import time
+import pytest
+import fec
+from arq_logging import LOG_ERRORS
+from arq_protocol import (FRAME_ACK, FRAME_DATA, FRAME_EOT, FRAME_HEADER, FRAME_META, RESPONSE_DUPLICATE, TRANSFER_STEP, FrameReader,
+                          frame_size, pack_frame, parse_ack, transfer_delta)
+from arq_sender import ArqSender
+from file_chunker import open_chunks
+from server_engine import ServerEngine
+from udp_transport import MAX_DATAGRAM, DatagramSocket, max_datagram_chunk, whole_frame
+
+TIMEOUT = 5
+
+
+def test_largest_chunk_fills_a_datagram():
+    assert frame_size(max_datagram_chunk()) == MAX_DATAGRAM
+    chunk = max_datagram_chunk(fec=True)
+    assert frame_size(chunk + fec.parity_length(chunk)) <= MAX_DATAGRAM
+    assert frame_size(chunk + 1 + fec.parity_length(chunk + 1)) > MAX_DATAGRAM
+
+
+def test_whole_frame():
+    frame = pack_frame(FRAME_DATA, b'hello')
+    assert whole_frame(frame)
+    assert not whole_frame(frame[:-1])
+    assert not whole_frame(frame + b'x')
+    assert not whole_frame(FRAME_HEADER.pack(99, 0, 0, 0, 0) + bytes(4))
+
+
+def test_transfer_delta_wraps_around():
+    assert transfer_delta(0x00, 0x00) == 0
+    assert transfer_delta(0x10, 0x00) == 1
+    assert transfer_delta(0x00, 0x10) == -1
+    assert transfer_delta(0x00, 0xF0) == 1  # 15 -> 0
+    assert transfer_delta(0xF0, 0x00) == -1
+
+
+@pytest.fixture
+def engine(tmp_path):
+    log = []
+    engine = ServerEngine('127.0.0.1', 0, output_dir=str(tmp_path / 'out'), log_dir=str(tmp_path / 'logs'), on_log=log.append,
+                          on_transfer=log.append, verbosity=LOG_ERRORS, crc_every=0, udp=True)
+    engine.log = log
+    engine.start()
+    engine.ready.wait(TIMEOUT)
+    yield engine
+    engine.stop()
+    engine.thread.join(TIMEOUT)
+
+
+def transfer_results(engine):
+    return [item for item in engine.log if not isinstance(item, str)]
+
+
+def wait_for_results(engine, count):
+    deadline = time.monotonic() + TIMEOUT
+    while len(transfer_results(engine)) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return transfer_results(engine)
+
+
+@pytest.mark.parametrize('use_fec', [False, True])
+def test_transfer_at_the_largest_chunk(engine, tmp_path, use_fec):
+    path = tmp_path / 'in.bin'
+    data = random.Random(1).randbytes(300_000)
+    path.write_bytes(data)
+    with DatagramSocket(('127.0.0.1', engine.port), timeout=TIMEOUT) as sock:
+        sender = ArqSender(sock, window=4, mode='sr', fec=use_fec, log_event=lambda msg: None)
+        sender.announce_file_type('.bin')
+        with open_chunks(str(path), max_datagram_chunk(use_fec)) as chunks:
+            assert sender.transmit(chunks)
+    [result] = wait_for_results(engine, 1)
+    assert result.status == 'complete'
+    with open(result.path, 'rb') as f:
+        assert f.read() == data
+
+
+class Client:
+    """Raw datagrams to the UDP server, to replay what a lossy network does to a sender's frames."""
+
+    def __init__(self, engine):
+        self.sock = DatagramSocket(('127.0.0.1', engine.port), timeout=TIMEOUT)
+        self.reader = FrameReader(self.sock)
+
+    def send(self, frame_type, payload=b'', seq=0, offset=0, tag=0):
+        self.sock.sendall(pack_frame(frame_type, payload, seq=seq, offset=offset, flags=tag))
+
+    def reply(self):
+        return self.reader.read_frame()
+
+    def no_reply(self, wait=0.2):
+        self.sock.settimeout(wait)
+        try:
+            self.reader.read_frame()
+        except socket.timeout:
+            return True
+        finally:
+            self.sock.settimeout(TIMEOUT)
+        return False
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def client(engine):
+    client = Client(engine)
+    yield client
+    client.close()
+
+
+def test_repeats_and_late_duplicates(engine, client):
+    client.send(FRAME_META, b'.bin')
+    assert client.reply().type == FRAME_META  # echoed, since the sender waits for it
+    client.send(FRAME_DATA, b'a' * 100, seq=0)
+    client.send(FRAME_DATA, b'a' * 100, seq=0)  # a retransmission whose ACK was lost
+    acks = [parse_ack(client.reply()) for _ in range(2)]
+    assert acks[-1].flags & RESPONSE_DUPLICATE
+    assert acks[-1].cumulative == 1
+    client.send(FRAME_EOT)
+    eot = client.reply()
+    assert (eot.type, eot.flags) == (FRAME_EOT, 0)
+    assert [result.status for result in wait_for_results(engine, 1)] == ['complete']
+
+    # The EOT echo was lost: the repeat of transfer 0's EOT is answered again, not finished twice
+    client.send(FRAME_EOT)
+    assert client.reply().type == FRAME_EOT
+    # A late copy of a chunk of transfer 0 is dropped without an answer
+    client.send(FRAME_DATA, b'a' * 100, seq=0)
+    assert client.no_reply()
+    assert len(transfer_results(engine)) == 1
+
+    # Transfer 1 is told apart by its number, and its ACKs carry it
+    client.send(FRAME_DATA, b'b' * 100, seq=0, tag=TRANSFER_STEP)
+    frame = client.reply()
+    assert frame.type == FRAME_ACK and frame.flags & 0xF0 == TRANSFER_STEP
+
+
+def test_frame_of_a_later_transfer_aborts_the_current_one(engine, client):
+    client.send(FRAME_DATA, b'a' * 100, seq=0)
+    client.send(FRAME_DATA, b'a' * 100, seq=1, offset=100)
+    assert client.reply().type == FRAME_ACK
+    # Every copy of the EOT was lost and the sender moved on to transfer 1
+    client.send(FRAME_DATA, b'b' * 100, seq=0, tag=TRANSFER_STEP)
+    assert client.reply().type == FRAME_ACK
+    assert [result.status for result in wait_for_results(engine, 1)] == ['aborted']
@@ -0,0 +1,122 @@
+import pytest
+from ui_bridge import UiBridge, describe_progress, format_bytes
+
+
+class FakeRoot:
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, callback):
+        self.scheduled.append(callback)
+
+    def tick(self):
+        callback = self.scheduled.pop()
+        callback()
+
+
+class FakeText:
+    """The few tk.Text calls UiBridge makes, on a list of lines."""
+
+    def __init__(self):
+        self.lines = []
+        self.state = 'disabled'
+
+    def config(self, state):
+        self.state = state
+
+    def tag_config(self, tag, **options):
+        pass
+
+    def insert(self, index, *parts):
+        assert self.state == 'normal'
+        self.lines += ''.join(parts[::2]).splitlines()
+
+    def delete(self, start, end):
+        if end == 'end':
+            self.lines = []
+        else:
+            del self.lines[:int(end.split('.')[0]) - 1]
+
+    def index(self, index):
+        return f'{len(self.lines) + 1}.0'
+
+    def see(self, index):
+        pass
+
+
+class FakeLabel:
+    text = ''
+
+    def config(self, text):
+        self.text = text
+
+
+@pytest.fixture
+def bridge():
+    return UiBridge(FakeRoot(), FakeText(), FakeLabel(), scrollback=5)
+
+
+def test_format_bytes():
+    assert format_bytes(512) == '512 B'
+    assert format_bytes(1536) == '1.5 KB'
+    assert format_bytes(3 * 2 ** 30) == '3.0 GB'
+    assert format_bytes(2 ** 40) == '1024.0 GB'
+
+
+def test_describe_progress():
+    assert describe_progress(512, None, 0) == '512 B'
+    assert describe_progress(1024, 4096, 1024) == '1.0 KB of 4.0 KB (25%), 1.0 KB/s, ETA 3 s'
+    assert describe_progress(4096, 4096, 1024) == '4.0 KB of 4.0 KB (100%), 1.0 KB/s'
+
+
+def test_lines_are_shown_in_order_and_trimmed(bridge):
+    for n in range(8):
+        bridge.log(f'line {n}')
+    bridge.call(bridge.log, 'from the call')  # runs after the lines before it are written
+    bridge.root.tick()
+    assert bridge.log_area.lines == [f'line {n}' for n in range(4, 8)] + ['from the call']
+    assert bridge.log_area.state == 'disabled'
+
+
+def test_chunk_lines_are_coalesced_on_the_label(bridge):
+    for n in range(3):
+        bridge.chunk(f'chunk {n}')
+    bridge.root.tick()
+    assert bridge.log_area.lines == []
+    assert bridge.label.text == 'chunk 2 (+2 more)'
+
+
+def test_failing_callback_is_logged_and_the_pump_goes_on(bridge, capsys):
+    def broken():
+        raise ValueError('boom')
+
+    bridge.log('before')
+    bridge.call(broken)
+    bridge.log('after')
+    bridge.root.tick()
+    assert bridge.log_area.lines == ['before', 'UI error in broken: ValueError: boom', 'after']
+    assert 'ValueError: boom' in capsys.readouterr().err
+    assert len(bridge.root.scheduled) == 1
+
+
+def test_failing_progress_stops_tracking(bridge, capsys):
+    def progress():
+        raise OSError('gone')
+
+    bridge.track(progress)
+    bridge.root.tick()
+    assert bridge.log_area.lines == ['UI error in progress: OSError: gone']
+    assert bridge.progress is None
+    assert len(bridge.root.scheduled) == 1
+    capsys.readouterr()
+
+
+def test_pump_reschedules_even_if_the_log_area_fails(bridge):
+    def insert(*args):
+        raise RuntimeError('widget destroyed')
+
+    bridge.log_area.insert = insert
+    bridge.log('line')
+    with pytest.raises(RuntimeError):
+        bridge.root.tick()
+    assert len(bridge.root.scheduled) == 1